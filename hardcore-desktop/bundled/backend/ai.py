@@ -7,13 +7,35 @@ import os
 import json
 import re
 import time
+import asyncio
+import hashlib
+import threading
+import contextlib
 import requests
+import requests.adapters
 from typing import Dict, Any, List, Optional, Tuple
 from dataclasses import dataclass, field
+from collections import deque
 from pathlib import Path
 from datetime import datetime
 
 from context_loader import ProjectContext, ProjectContextLoader
+from context_packer import pack_context
+from code_patcher import PatchError, apply_edits, parse_edit_blocks
+from generation_cache import GenerationCache, get_generation_cache
+from model_health import model_health
+from rate_limiter import get_rate_limiter, RateLimitQueueFull, RateLimitTimeout
+from metrics import registry, span, record_cache_lookup
+
+try:
+    import httpx
+except ImportError:  # Async calls fall back to the pooled requests session on a worker thread
+    httpx = None
+
+_TIMEOUT_ERRORS = (requests.Timeout, httpx.TimeoutException) if httpx else (requests.Timeout,)
+
+# Point at mock_gemini_server.py for local load testing
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com").rstrip("/")
 
 @dataclass
 class GenerationAttempt:
@@ -37,6 +59,8 @@ class FirmwarePackage:
     model_used: str = ""
     confidence: float = 1.0
     context_used: bool = False
+    cache_hit: bool = False
+    edited: bool = False  # Produced by applying edit blocks to the existing code
     attempts: List[GenerationAttempt] = field(default_factory=list)
     
     def to_dict(self) -> Dict[str, Any]:
@@ -51,6 +75,8 @@ class FirmwarePackage:
                 "model": self.model_used,
                 "confidence": self.confidence,
                 "context_aware": self.context_used,
+                "cached": self.cache_hit,
+                "edited": self.edited,
                 "attempts": [
                     {
                         "model": a.model,
@@ -62,6 +88,378 @@ class FirmwarePackage:
             }
         }
 
+@dataclass
+class ModelCacheEntry:
+    """Cached result of a preflight model listing."""
+    models: List[str]
+    error: Optional[str]
+    fetched_at: float
+    ttl: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    @property
+    def expired(self) -> bool:
+        return self.age >= self.ttl
+
+class ModelAvailabilityCache:
+    """
+    Process-wide cache of which whitelisted models support generateContent.
+
+    Shared by every StrictGeminiEngine instance so the `GET /v1beta/models`
+    round trip is paid once per TTL instead of once per generation.
+    Failed lookups are cached for a shorter TTL (negative caching), and
+    healthy entries are refreshed on a background thread shortly before
+    they expire so callers never wait on the listing.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float, refresh_fraction: float):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_fraction = refresh_fraction
+        self._entries: Dict[Tuple, ModelCacheEntry] = {}
+        self._load_locks: Dict[Tuple, threading.Lock] = {}
+        self._refreshing: set = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple, loader) -> Tuple[List[str], Optional[str]]:
+        """
+        Return (models, error) for key, calling loader() on a miss.
+        loader must return the same (models, error) tuple.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        if entry and not entry.expired:
+            record_cache_lookup("gemini_models", hit=True)
+            if entry.models and entry.age >= entry.ttl * self.refresh_fraction:
+                self._refresh_in_background(key, loader)
+            return (entry.models, entry.error)
+        record_cache_lookup("gemini_models", hit=False)
+
+        # Only one caller per key hits the API; the rest wait for its result
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry and not entry.expired:
+                return (entry.models, entry.error)
+            models, error = loader()
+            self._store(key, models, error)
+            return (models, error)
+
+    def invalidate(self, key: Optional[Tuple] = None):
+        """Drop one entry (or everything) so the next lookup hits the API."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def _store(self, key: Tuple, models: List[str], error: Optional[str]):
+        ttl = self.ttl if models else self.negative_ttl
+        with self._lock:
+            self._entries[key] = ModelCacheEntry(
+                models=list(models),
+                error=error,
+                fetched_at=time.time(),
+                ttl=ttl
+            )
+
+    def _refresh_in_background(self, key: Tuple, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def _run():
+            try:
+                models, error = loader()
+                # Keep serving the old list if the refresh itself failed
+                if models:
+                    self._store(key, models, error)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=_run, name="gemini-model-refresh", daemon=True).start()
+
+# Shared across all engine instances in this process
+_model_cache = ModelAvailabilityCache(
+    ttl=float(os.getenv("GEMINI_MODEL_CACHE_TTL", "600")),
+    negative_ttl=float(os.getenv("GEMINI_MODEL_CACHE_NEGATIVE_TTL", "30")),
+    refresh_fraction=float(os.getenv("GEMINI_MODEL_CACHE_REFRESH_FRACTION", "0.8"))
+)
+
+class GeminiStreamHTTPError(Exception):
+    """Non-200 status from a streaming request."""
+    def __init__(self, status_code: int, body_text: str):
+        self.status_code = status_code
+        self.body_text = body_text
+        super().__init__(f"HTTP {status_code}")
+
+class GeminiHttpClient:
+    """
+    Shared, connection-pooled HTTP client for all Gemini traffic.
+
+    One requests.Session (sync) and one httpx.AsyncClient per event loop
+    (async) keep TLS connections to generativelanguage.googleapis.com alive,
+    so the handshake is paid once per process rather than per call.
+    Connect and read timeouts are configured separately.
+    """
+
+    def __init__(self,
+                 pool_size: int = 10,
+                 keepalive_expiry: float = 60.0,
+                 connect_timeout: float = 5.0,
+                 http2: Optional[bool] = None):
+        self.pool_size = pool_size
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.http2 = self._http2_available() if http2 is None else http2
+        self._session: Optional[requests.Session] = None
+        self._async_client = None
+        self._async_loop = None
+        self._retiring: set = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _http2_available() -> bool:
+        if httpx is None:
+            return False
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def _get_session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=self.pool_size,
+                    pool_maxsize=self.pool_size,
+                    max_retries=0
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def _get_async_client(self):
+        # httpx clients are bound to the loop that opened their connections
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._async_client is None or self._async_loop is not loop:
+                if self._async_client is not None:
+                    self._retire_async_client(self._async_client, self._async_loop)
+                self._async_client = httpx.AsyncClient(
+                    http2=self.http2,
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size,
+                        max_keepalive_connections=self.pool_size,
+                        keepalive_expiry=self.keepalive_expiry
+                    )
+                )
+                self._async_loop = loop
+            return self._async_client
+
+    def _retire_async_client(self, client, old_loop):
+        """Close the client of a previous event loop, on that loop while it still runs."""
+        if old_loop is not None and old_loop.is_running() and not old_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self._aclose_quietly(client), old_loop)
+            return
+        # Loop already stopped: close what can still be closed from here
+        task = asyncio.get_running_loop().create_task(self._aclose_quietly(client))
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    @staticmethod
+    async def _aclose_quietly(client):
+        try:
+            await client.aclose()
+        except Exception as e:
+            print(f"[GeminiHttpClient] Could not close previous async client: {e}")
+
+    def get(self, url: str, read_timeout: float) -> Tuple[int, str]:
+        """GET url; returns (status_code, body_text)."""
+        response = self._get_session().get(url, timeout=(self.connect_timeout, read_timeout))
+        return (response.status_code, response.text)
+
+    def post_json(self, url: str, payload: Dict[str, Any], read_timeout: float) -> Tuple[int, str]:
+        """POST a JSON body; returns (status_code, body_text)."""
+        response = self._get_session().post(
+            url,
+            headers={"Content-Type": "application/json"},
+            json=payload,
+            timeout=(self.connect_timeout, read_timeout)
+        )
+        return (response.status_code, response.text)
+
+    async def apost_json(self, url: str, payload: Dict[str, Any], read_timeout: float) -> Tuple[int, str]:
+        """Non-blocking post_json. Falls back to a worker thread without httpx."""
+        if httpx is None:
+            return await asyncio.to_thread(self.post_json, url, payload, read_timeout)
+
+        response = await self._get_async_client().post(
+            url,
+            headers={"Content-Type": "application/json"},
+            json=payload,
+            timeout=httpx.Timeout(read_timeout, connect=self.connect_timeout)
+        )
+        return (response.status_code, response.text)
+
+    def stream_sse(self, url: str, payload: Dict[str, Any], read_timeout: float):
+        """
+        POST a JSON body and yield each server-sent `data:` event as a dict.
+        Raises GeminiStreamHTTPError on a non-200 status.
+        """
+        response = self._get_session().post(
+            url,
+            headers={"Content-Type": "application/json"},
+            json=payload,
+            timeout=(self.connect_timeout, read_timeout),
+            stream=True
+        )
+        with response:
+            if response.status_code != 200:
+                raise GeminiStreamHTTPError(response.status_code, response.text)
+            for line in response.iter_lines(decode_unicode=True):
+                event = self._parse_sse_line(line)
+                if event is not None:
+                    yield event
+
+    async def astream_sse(self, url: str, payload: Dict[str, Any], read_timeout: float):
+        """Async stream_sse. Falls back to a worker thread without httpx."""
+        if httpx is None:
+            async for event in self._astream_sse_threaded(url, payload, read_timeout):
+                yield event
+            return
+
+        async with self._get_async_client().stream(
+            "POST",
+            url,
+            headers={"Content-Type": "application/json"},
+            json=payload,
+            timeout=httpx.Timeout(read_timeout, connect=self.connect_timeout)
+        ) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", errors="replace")
+                raise GeminiStreamHTTPError(response.status_code, body)
+            async for line in response.aiter_lines():
+                event = self._parse_sse_line(line)
+                if event is not None:
+                    yield event
+
+    async def _astream_sse_threaded(self, url: str, payload: Dict[str, Any], read_timeout: float):
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def _pump():
+            try:
+                for event in self.stream_sse(url, payload, read_timeout):
+                    loop.call_soon_threadsafe(queue.put_nowait, event)
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        loop.run_in_executor(None, _pump)
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    @staticmethod
+    def _parse_sse_line(line: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not line or not line.startswith("data:"):
+            return None
+        data = line[5:].strip()
+        if not data or data == "[DONE]":
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    async def aclose(self):
+        """Close pooled connections (called on app shutdown)."""
+        with self._lock:
+            session, self._session = self._session, None
+            client, self._async_client = self._async_client, None
+            self._async_loop = None
+        if session is not None:
+            session.close()
+        if client is not None:
+            await client.aclose()
+
+_http_client: Optional[GeminiHttpClient] = None
+_http_client_lock = threading.Lock()
+
+def get_http_client() -> GeminiHttpClient:
+    """Process-wide pooled client for Gemini traffic."""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            http2_env = os.getenv("GEMINI_HTTP2", "").strip().lower()
+            _http_client = GeminiHttpClient(
+                pool_size=int(os.getenv("GEMINI_HTTP_POOL_SIZE", "10")),
+                keepalive_expiry=float(os.getenv("GEMINI_HTTP_KEEPALIVE", "60")),
+                connect_timeout=float(os.getenv("GEMINI_CONNECT_TIMEOUT", "5")),
+                http2=None if not http2_env else http2_env in ("1", "true", "yes")
+            )
+        return _http_client
+
+class LatencyTracker:
+    """Rolling window of successful generation latencies, shared process-wide."""
+
+    def __init__(self, window: int = 100):
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms: int):
+        with self._lock:
+            self._samples.append(latency_ms)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Latency (ms) at the given percentile, or None with no samples."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+        return float(samples[index])
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+_latency_tracker = LatencyTracker()
+
+GEMINI_ATTEMPTS = registry.counter(
+    "hardcore_gemini_attempts_total",
+    "Gemini generation attempts by model and HTTP status (499 = lost hedge race)",
+    ("model", "status")
+)
+GEMINI_REQUEST_SECONDS = registry.histogram(
+    "hardcore_gemini_request_seconds",
+    "Latency of successful Gemini generation calls",
+    ("model",)
+)
+
+# In-flight Gemini calls per API key (async path); hedges never exceed this
+_key_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+def _key_semaphore(api_key: str) -> asyncio.Semaphore:
+    if api_key not in _key_semaphores:
+        _key_semaphores[api_key] = asyncio.Semaphore(int(os.getenv("GEMINI_MAX_CONCURRENCY_PER_KEY", "4")))
+    return _key_semaphores[api_key]
+
 class GeminiError(Exception):
     """Base exception for Gemini-related errors."""
     def __init__(self, error_code: str, message: str, attempts: List[GenerationAttempt]):
@@ -70,6 +468,88 @@ class GeminiError(Exception):
         self.attempts = attempts
         super().__init__(message)
 
+class StreamingSectionParser:
+    """
+    Incrementally parses streamed Gemini output into a FirmwarePackage.
+
+    Each section is parsed with the engine's normal extractors as soon as
+    its terminator has arrived, so clients can render the code before the
+    pin table and tests have been generated.
+    """
+
+    SECTIONS = ("code", "pin_block", "pin_json", "timeline", "tests")
+    PIN_JSON_MARKER = "<!--PIN-CONNECTIONS-JSON-->"
+
+    def __init__(self, engine: "StrictGeminiEngine", board: str):
+        self.engine = engine
+        self.board = board
+        self.buffer = ""
+        self.completed: List[str] = []
+        self.package = FirmwarePackage(code="", pin_block="", pin_json={}, timeline="", tests=[])
+
+    def feed(self, text: str) -> List[str]:
+        """Add a chunk; returns sections that became complete."""
+        self.buffer += text
+        return self._scan(final=False)
+
+    def finish(self) -> List[str]:
+        """Flush at end of stream; returns any remaining sections."""
+        return self._scan(final=True)
+
+    def _scan(self, final: bool) -> List[str]:
+        newly_completed = []
+        for section in self.SECTIONS:
+            if section in self.completed:
+                continue
+            if getattr(self, f"_try_{section}")(final):
+                self.completed.append(section)
+                newly_completed.append(section)
+        if newly_completed:
+            self.package.confidence = self.engine._calculate_confidence(self.package)
+        return newly_completed
+
+    def _try_code(self, final: bool) -> bool:
+        # Needs an opening and a closing fence
+        if self.buffer.count("```") < 2 and not final:
+            return False
+        code = self.engine._extract_code(self.buffer)
+        if code:
+            self.package.code = code
+            return True
+        return final
+
+    def _try_pin_block(self, final: bool) -> bool:
+        match = re.search(r"PIN CONNECTIONS[\s\S]*?(?:\n\n|" + re.escape(self.PIN_JSON_MARKER) + ")", self.buffer, re.I)
+        if not match and not final:
+            return False
+        self.package.pin_block = self.engine._extract_pin_block(self.buffer, self.board)
+        return True
+
+    def _try_pin_json(self, final: bool) -> bool:
+        label_pos = self.buffer.find(self.PIN_JSON_MARKER)
+        if label_pos == -1 and not final:
+            return False
+        if not final and not self.engine._find_json_object(self.buffer[label_pos + len(self.PIN_JSON_MARKER):]):
+            return False
+        self.package.pin_json = self.engine._extract_pin_json(self.buffer, self.board)
+        if self.package.pin_json.get("connections"):
+            self.package.pin_block = self.engine.generate_pin_block_from_json(self.package.pin_json, self.board)
+        return True
+
+    def _try_timeline(self, final: bool) -> bool:
+        if not final and not re.search(r"//\s*TIMELINE[:\s]+.*?\n", self.buffer, re.I):
+            return False
+        self.package.timeline = self.engine._extract_timeline(self.buffer)
+        return True
+
+    def _try_tests(self, final: bool) -> bool:
+        # The checklist is the last section; it is terminated by a blank line or EOF
+        match = re.search(r"(?:TEST|CHECKLIST)[:\s]*[\s\S]*?\n\s*[-•][\s\S]*?\n\n", self.buffer, re.I)
+        if not match and not final:
+            return False
+        self.package.tests = self.engine._extract_tests(self.buffer)
+        return True
+
 class StrictGeminiEngine:
     """
     Strict Gemini-only firmware generation engine with semantic intent protection.
@@ -93,6 +573,28 @@ class StrictGeminiEngine:
         "backoff_factor": 1.5
     }
     
+    # Hedged requests (async path): if the primary model has not answered
+    # within the p-th percentile of recent latencies, race the next model
+    HEDGE_CONFIG = {
+        "enabled": os.getenv("GEMINI_HEDGING", "0").strip().lower() in ("1", "true", "yes"),
+        "percentile": float(os.getenv("GEMINI_HEDGE_PERCENTILE", "0.95")),
+        "max_hedges": int(os.getenv("GEMINI_MAX_HEDGES", "1")),
+        "min_samples": 5,
+        "default_delay": float(os.getenv("GEMINI_HEDGE_DEFAULT_DELAY", "8.0")),
+        "min_delay": 1.0
+    }
+    
+    # Edit mode: follow-up requests on an existing main.cpp ask for
+    # SEARCH/REPLACE blocks instead of a complete firmware package
+    EDIT_CONFIG = {
+        "enabled": os.getenv("GEMINI_EDIT_MODE", "1").strip().lower() not in ("0", "false", "no"),
+        "max_output_tokens": int(os.getenv("GEMINI_EDIT_MAX_OUTPUT_TOKENS", "1024")),
+        "max_file_chars": int(os.getenv("GEMINI_EDIT_MAX_FILE_CHARS", "24000")),
+        # Requests that want a different program, not a change to this one
+        "rewrite_hints": ("from scratch", "start over", "new project", "rewrite", "completely different",
+                          "replace everything", "port to", "convert to", "switch to"),
+    }
+    
     def __init__(self, api_key: Optional[str] = None, workspace_root: Optional[Path] = None):
         self.api_key = api_key or os.getenv("LLM_API_KEY", "")
         
@@ -112,10 +614,15 @@ class StrictGeminiEngine:
         # Configuration
         self.timeout = 30
         self.temperature = 0.2
+        self.max_output_tokens = 4096
         
         # Track last user prompt for helpers
         self.last_user_prompt: Optional[str] = None
         
+        # Rate-limiter scheduling: project for fair queueing, lower priority value = served first
+        self.project_id = "current_project"
+        self.priority = 0
+        
         print(f"[StrictGemini] ===== GEMINI-ONLY ENGINE (INTENT-PROTECTED) =====")
         print(f"[StrictGemini] Model whitelist: {self.model_whitelist}")
         print(f"[StrictGemini] Max retries: {self.RETRY_CONFIG['max_attempts']}")
@@ -123,79 +630,405 @@ class StrictGeminiEngine:
     
     def preflight_check_models(self) -> Tuple[Optional[str], Optional[str]]:
         """
-        Query Gemini API to find first supported model.
+        Find first supported model, using the process-wide model cache.
         Returns: (model_name, error_message)
         """
-        print(f"[StrictGemini] Running preflight model check...")
-        
         if not self.api_key:
             return (None, "No API key configured")
         
-        endpoint = f"https://generativelanguage.googleapis.com/v1beta/models?key={self.api_key}"
+        models, error = self._supported_models()
+        if models:
+            return (models[0], None)
+        return (None, error)
+    
+    def _supported_models(self) -> Tuple[List[str], Optional[str]]:
+        """All whitelisted models that support generateContent (cached)."""
+        if not self.api_key:
+            return ([], "No API key configured")
+        return _model_cache.get(self._model_cache_key(), self._fetch_supported_models)
+    
+    def _select_healthiest_model(self, supported: List[str]) -> Optional[str]:
+        """
+        Healthiest supported model whose circuit breaker lets a request
+        through. Nothing is claimed here: the HALF_OPEN probe slot is taken
+        right before the HTTP call and released if no outcome gets recorded.
+        """
+        for model in model_health.rank(supported):
+            if model_health.is_available(model):
+                return model
+        return None
+    
+    def _model_cache_key(self) -> Tuple:
+        """Cache key for the preflight result of this key + whitelist."""
+        return (self.api_key, tuple(self.model_whitelist))
+    
+    def _fetch_supported_models(self) -> Tuple[List[str], Optional[str]]:
+        """
+        Query Gemini API for whitelisted models that support generateContent.
+        Returns: (supported_models, error_message)
+        """
+        print(f"[StrictGemini] Running preflight model check...")
+        
+        endpoint = f"{GEMINI_API_BASE}/v1beta/models?key={self.api_key}"
         
         try:
-            resp = requests.get(endpoint, timeout=10)
-            resp.raise_for_status()
-            models_data = resp.json()
+            status_code, body_text = get_http_client().get(endpoint, read_timeout=10)
+            if status_code != 200:
+                error_msg = f"Preflight HTTP error {status_code}: {body_text[:200]}"
+                print(f"[StrictGemini] ✗ Preflight failed: {error_msg}")
+                return ([], error_msg)
+            models_data = json.loads(body_text)
             
-            # Find first whitelisted model that supports generateContent
+            # Collect whitelisted models that support generateContent
+            supported = []
             for model_info in models_data.get("models", []):
                 model_name = model_info.get("name", "").replace("models/", "")
                 
                 if model_name in self.model_whitelist:
                     methods = model_info.get("supportedGenerationMethods", [])
                     if "generateContent" in methods:
-                        print(f"[StrictGemini] ✓ Found supported model: {model_name}")
-                        return (model_name, None)
+                        supported.append(model_name)
+            
+            if supported:
+                print(f"[StrictGemini] ✓ Found supported models: {supported}")
+                return (supported, None)
             
             available = [m.get("name", "").replace("models/", "") for m in models_data.get("models", [])]
             error_msg = f"No whitelisted models support generateContent. Available: {available[:5]}"
             print(f"[StrictGemini] ✗ Preflight failed: {error_msg}")
-            return (None, error_msg)
+            return ([], error_msg)
             
-        except requests.HTTPError as e:
-            error_msg = f"Preflight HTTP error {e.response.status_code}: {e.response.text[:200]}"
-            print(f"[StrictGemini] ✗ Preflight failed: {error_msg}")
-            return (None, error_msg)
         except Exception as e:
             error_msg = f"Preflight check failed: {str(e)}"
             print(f"[StrictGemini] ✗ Preflight failed: {error_msg}")
-            return (None, error_msg)
+            return ([], error_msg)
+    
+    def _is_model_unsupported_error(self, status_code: int, body: str) -> bool:
+        """True if the API rejected the model itself (stale preflight result)."""
+        if status_code == 404:
+            return True
+        if status_code == 400:
+            lower = body.lower()
+            return "not supported" in lower or "not found" in lower
+        return False
     
+    @span("engine", "generate_firmware")
     def generate_firmware(self, 
                          user_request: str, 
                          board_type: str = "esp32",
-                         project_id: str = "current_project") -> FirmwarePackage:
+                         project_id: str = "current_project",
+                         use_cache: bool = True) -> FirmwarePackage:
         """
         Main entry point - Strict Gemini-only generation with intent protection.
         
+        Identical requests are served from the generation cache unless
+        use_cache is False (fresh results are still written back).
+        
         Raises GeminiError if generation fails for any reason.
         NEVER returns local fallback code.
         """
+        context, prompt = self._prepare_generation(user_request, board_type, project_id)
+        
+        cache_key = self._generation_cache_key(user_request, context)
+        if use_cache:
+            with span("engine", "cache_lookup"):
+                cached = self._load_cached_package(cache_key, user_request, project_id)
+            if cached:
+                return cached
+        
+        if self._use_edit_mode(user_request, context):
+            print(f"[StrictGemini] STAGE 3: Requesting edit blocks...")
+            with span("engine", "llm_call"), self._edit_output_budget():
+                raw_output, attempts = self._generate_with_retry(self._build_edit_prompt(user_request, context))
+            package = self._finalize_edit(user_request, project_id, context, raw_output, attempts)
+            if package:
+                self._store_cached_package(cache_key, package)
+                return package
+        
+        # STAGE 4: Generate with retry (exponential backoff)
+        print(f"[StrictGemini] STAGE 3: Calling Gemini with retry...")
+        with span("engine", "llm_call"):
+            raw_output, attempts = self._generate_with_retry(prompt)
+        
+        package = self._finalize_generation(user_request, project_id, context, raw_output, attempts)
+        self._store_cached_package(cache_key, package)
+        return package
+    
+    @span("engine", "agenerate_firmware")
+    async def agenerate_firmware(self,
+                                 user_request: str,
+                                 board_type: str = "esp32",
+                                 project_id: str = "current_project",
+                                 use_cache: bool = True) -> FirmwarePackage:
+        """
+        Asyncio-native generate_firmware for use from async endpoints.
+        
+        Blocking work (preflight on a cache miss, file IO) runs in a worker
+        thread and the Gemini call uses the non-blocking client, so the
+        event loop keeps serving other requests during generation.
+        """
+        context, prompt = await asyncio.to_thread(
+            self._prepare_generation, user_request, board_type, project_id
+        )
+        
+        cache_key = self._generation_cache_key(user_request, context)
+        if use_cache:
+            with span("engine", "cache_lookup"):
+                cached = await asyncio.to_thread(self._load_cached_package, cache_key, user_request, project_id)
+            if cached:
+                return cached
+        
+        if self._use_edit_mode(user_request, context):
+            print(f"[StrictGemini] STAGE 3: Requesting edit blocks (async)...")
+            with span("engine", "llm_call"), self._edit_output_budget():
+                raw_output, attempts = await self._agenerate_with_retry(self._build_edit_prompt(user_request, context))
+            package = await asyncio.to_thread(
+                self._finalize_edit, user_request, project_id, context, raw_output, attempts
+            )
+            if package:
+                await asyncio.to_thread(self._store_cached_package, cache_key, package)
+                return package
+        
+        print(f"[StrictGemini] STAGE 3: Calling Gemini with retry (async)...")
+        with span("engine", "llm_call"):
+            raw_output, attempts = await self._agenerate_with_retry(prompt)
+        
+        package = await asyncio.to_thread(
+            self._finalize_generation, user_request, project_id, context, raw_output, attempts
+        )
+        await asyncio.to_thread(self._store_cached_package, cache_key, package)
+        return package
+    
+    @span("engine", "astream_firmware")
+    async def astream_firmware(self,
+                               user_request: str,
+                               board_type: str = "esp32",
+                               project_id: str = "current_project",
+                               use_cache: bool = True):
+        """
+        Streaming generation via streamGenerateContent.
+        
+        Async generator of event dicts:
+        - {"event": "queued", "position": n} while waiting for API quota
+        - {"event": "delta", "text": ...} for every streamed chunk
+        - {"event": "section", "section": ..., "package": ...} as sections complete
+        - {"event": "complete", "package": ..., "firmware_package": FirmwarePackage}
+          once validated (firmware_package is the object, not JSON)
+        
+        Raises GeminiError like generate_firmware. Retries (with model
+        rotation) only happen before the first chunk has been received.
+        """
+        context, prompt = await asyncio.to_thread(
+            self._prepare_generation, user_request, board_type, project_id
+        )
+        
+        cache_key = self._generation_cache_key(user_request, context)
+        if use_cache:
+            with span("engine", "cache_lookup"):
+                cached = await asyncio.to_thread(self._load_cached_package, cache_key, user_request, project_id)
+            if cached:
+                for section in StreamingSectionParser.SECTIONS:
+                    yield {"event": "section", "section": section, "package": cached.to_dict()}
+                yield {"event": "complete", "package": cached.to_dict(), "firmware_package": cached}
+                return
+        
+        print(f"[StrictGemini] STAGE 3: Streaming from Gemini...")
+        attempts: List[GenerationAttempt] = []
+        max_attempts = self.RETRY_CONFIG["max_attempts"]
+        
+        for attempt_num in range(max_attempts):
+            # Breaker first: a skipped attempt must not spend the key's quota
+            model = self.current_model
+            probe = object()
+            if not model_health.acquire(model, probe):
+                attempts.append(self._skipped_attempt(model))
+                if attempt_num < max_attempts - 1:
+                    self._rotate_model()
+                continue
+            
+            try:
+                async for position in self._aqueue_for_quota(prompt, attempts):
+                    yield {"event": "queued", "position": position}
+            except BaseException:
+                model_health.release(model, probe)
+                raise
+            
+            start_time = time.time()
+            delay = 0.0
+            parser = StreamingSectionParser(self, context.board_type)
+            try:
+                print(f"[StrictGemini]   Stream attempt {attempt_num + 1}/{max_attempts}: {self.current_model}")
+                
+                async for chunk in get_http_client().astream_sse(
+                    self._stream_endpoint(),
+                    self._generation_payload(prompt),
+                    read_timeout=self.timeout
+                ):
+                    text = self._extract_chunk_text(chunk)
+                    if not text:
+                        continue
+                    yield {"event": "delta", "text": text}
+                    for section in parser.feed(text):
+                        yield {"event": "section", "section": section, "package": parser.package.to_dict()}
+                
+                for section in parser.finish():
+                    yield {"event": "section", "section": section, "package": parser.package.to_dict()}
+                
+                latency_ms = int((time.time() - start_time) * 1000)
+                print(f"[StrictGemini]   Stream finished: {len(parser.buffer)} chars ({latency_ms}ms)")
+                attempt = GenerationAttempt(
+                    model=self.current_model,
+                    status_code=200,
+                    latency_ms=latency_ms,
+                    success=bool(parser.buffer.strip())
+                )
+                if not attempt.success:
+                    attempt.error_snippet = "Empty response"
+                self._record_attempt(attempt)
+                attempts.append(attempt)
+                
+                if attempt.success:
+                    package = await asyncio.to_thread(
+                        self._finalize_generation, user_request, project_id, context, parser.buffer, attempts
+                    )
+                    await asyncio.to_thread(self._store_cached_package, cache_key, package)
+                    yield {"event": "complete", "package": package.to_dict(), "firmware_package": package}
+                    return
+                
+            except asyncio.CancelledError:
+                raise
+            
+            except GeminiStreamHTTPError as e:
+                latency_ms = int((time.time() - start_time) * 1000)
+                attempt, _, delay = self._evaluate_response(e.status_code, e.body_text, latency_ms, attempt_num)
+                attempts.append(attempt)
+            
+            except Exception as e:
+                is_timeout = isinstance(e, _TIMEOUT_ERRORS)
+                attempts.append(self._failed_attempt(
+                    start_time, 408 if is_timeout else 500, "Timeout" if is_timeout else str(e)[:200]
+                ))
+                if parser.buffer:
+                    # Chunks were already sent to the client; do not splice in another model's output
+                    raise GeminiError(
+                        error_code="LLM_UNAVAILABLE",
+                        message=f"Gemini stream interrupted after {len(parser.buffer)} chars. Please try again.",
+                        attempts=attempts
+                    )
+            
+            finally:
+                model_health.release(model, probe)
+            
+            if attempt_num < max_attempts - 1:
+                if delay:
+                    await asyncio.sleep(delay)
+                self._rotate_model()
+        
+        raise GeminiError(
+            error_code="LLM_UNAVAILABLE",
+            message=f"All {len(attempts)} Gemini attempts failed. Check API status and try again in 60s.",
+            attempts=attempts
+        )
+    
+    def _generation_cache_key(self, user_request: str, context: ProjectContext) -> str:
+        """Content address of a request: prompt, board, model, temperature and existing code."""
+        context_digest = ""
+        if context.existing_code:
+            context_digest = hashlib.sha256(context.existing_code.encode("utf-8")).hexdigest()
+        return GenerationCache.make_key(
+            user_request, context.board_type, self.current_model, self.temperature, context_digest
+        )
+    
+    def _load_cached_package(self, cache_key: str, user_request: str,
+                             project_id: str) -> Optional[FirmwarePackage]:
+        """Return a cached FirmwarePackage (recording history like a fresh one), or None."""
+        cache = get_generation_cache()
+        if cache is None:
+            return None
+        
+        payload = cache.get(cache_key)
+        if not payload:
+            return None
+        
+        package = FirmwarePackage(
+            code=payload.get("code", ""),
+            pin_block=payload.get("pin_block", ""),
+            pin_json=payload.get("pin_json", {}),
+            timeline=payload.get("timeline", ""),
+            tests=payload.get("tests", []),
+            model_used=payload.get("model_used", ""),
+            confidence=payload.get("confidence", 1.0),
+            context_used=payload.get("context_used", False),
+            cache_hit=True
+        )
+        print(f"[StrictGemini] ✅ Served from generation cache ({cache_key[:12]})")
+        
+        self.context_loader.save_history(project_id, user_request, package.to_dict())
+        return package
+    
+    def _store_cached_package(self, cache_key: str, package: FirmwarePackage):
+        """Write a validated package to the generation cache."""
+        cache = get_generation_cache()
+        if cache is None:
+            return
+        
+        try:
+            cache.put(cache_key, {
+                "code": package.code,
+                "pin_block": package.pin_block,
+                "pin_json": package.pin_json,
+                "timeline": package.timeline,
+                "tests": package.tests,
+                "model_used": package.model_used,
+                "confidence": package.confidence,
+                "context_used": package.context_used,
+            })
+        except Exception as e:
+            # A cache failure must never fail a successful generation
+            print(f"[StrictGemini]   Warning: could not cache package: {e}")
+    
+    def _prepare_generation(self, user_request: str, board_type: str,
+                            project_id: str) -> Tuple[ProjectContext, str]:
+        """Preflight, load context and build the prompt. Returns (context, prompt)."""
         print(f"\n[StrictGemini] ===== FIRMWARE GENERATION REQUEST =====")
         print(f"[StrictGemini] Request: {user_request[:100]}...")
         print(f"[StrictGemini] Board (API): {board_type}")
         
         # Track for pin extraction
         self.last_user_prompt = user_request
-        
-        attempts: List[GenerationAttempt] = []
+        self.project_id = project_id
         
         # STAGE 1: Preflight check
-        supported_model, error = self.preflight_check_models()
-        if not supported_model:
+        with span("engine", "preflight"):
+            supported_models, error = self._supported_models()
+        if not supported_models:
             raise GeminiError(
                 error_code="MODEL_NOT_SUPPORTED",
                 message=f"No Gemini models available. {error}",
-                attempts=attempts
+                attempts=[]
+            )
+        
+        # Start on the healthiest preflight-validated model; fail fast if
+        # every breaker is open instead of burning retries on known-bad models
+        selected_model = self._select_healthiest_model(supported_models)
+        if not selected_model:
+            retry_after = model_health.retry_after(supported_models)
+            board = model_health.scoreboard()
+            all_throttled = all(board.get(m, {}).get("open_reason", "").startswith("rate limited") for m in supported_models)
+            raise GeminiError(
+                error_code="RATE_LIMITED" if all_throttled else "LLM_UNAVAILABLE",
+                message=f"All Gemini models are temporarily unavailable. Retry in {retry_after:.0f}s.",
+                attempts=[]
             )
         
-        # Use the preflight-validated model
-        self.current_model = supported_model
+        self.current_model = selected_model
+        if selected_model in self.model_whitelist:
+            self.current_model_index = self.model_whitelist.index(selected_model)
         
         # STAGE 2: Load context
         print(f"\n[StrictGemini] STAGE 1: Loading project context...")
-        context = self.context_loader.load(project_id)
+        with span("engine", "context_load"):
+            context = self.context_loader.load(project_id)
         
         # CRITICAL: Extract board from user's prompt text FIRST
         # This prevents asking "What board?" when user says "Make this ESP32..."
@@ -215,12 +1048,14 @@ class StrictGeminiEngine:
         
         # STAGE 3: Build prompt with ABSOLUTE CORE RULE
         print(f"[StrictGemini] STAGE 2: Building prompt...")
-        prompt = self._build_contextual_prompt(user_request, context)
-        
-        # STAGE 4: Generate with retry (exponential backoff)
-        print(f"[StrictGemini] STAGE 3: Calling Gemini with retry...")
-        raw_output, attempts = self._generate_with_retry(prompt)
+        with span("engine", "prompt_build"):
+            prompt = self._build_contextual_prompt(user_request, context)
         
+        return (context, prompt)
+    
+    def _finalize_generation(self, user_request: str, project_id: str, context: ProjectContext,
+                             raw_output: Optional[str], attempts: List[GenerationAttempt]) -> FirmwarePackage:
+        """Parse, validate and record raw Gemini output."""
         if not raw_output:
             # All retries exhausted
             raise GeminiError(
@@ -232,7 +1067,8 @@ class StrictGeminiEngine:
         # STAGE 5: Parse output
         print(f"[StrictGemini] STAGE 4: Parsing output...")
         try:
-            package = self._parse_ai_output(raw_output, context.board_type)
+            with span("engine", "parse"):
+                package = self._parse_ai_output(raw_output, context.board_type)
             package.model_used = self.current_model
             package.context_used = context.existing_code is not None
             package.attempts = attempts
@@ -244,10 +1080,16 @@ class StrictGeminiEngine:
                 attempts=attempts
             )
         
+        return self._accept_package(user_request, project_id, context, package, attempts)
+    
+    def _accept_package(self, user_request: str, project_id: str, context: ProjectContext,
+                        package: FirmwarePackage, attempts: List[GenerationAttempt]) -> FirmwarePackage:
+        """Validate a parsed (or patched) package and record it in history."""
         # STAGE 6: SEMANTIC VALIDATION (Warning Only - NOT Blocking)
         # This checks if Gemini violated intent rules but does NOT prevent output
         print(f"[StrictGemini] STAGE 5: Semantic validation (warning only)...")
-        is_semantically_valid, semantic_error = self._semantic_validate(user_request, package)
+        with span("engine", "semantic_validation"):
+            is_semantically_valid, semantic_error = self._semantic_validate(user_request, package)
         
         if not is_semantically_valid:
             print(f"[StrictGemini]   ⚠️  WARNING: {semantic_error}")
@@ -259,7 +1101,10 @@ class StrictGeminiEngine:
         
         # STAGE 7: Strict structural validation
         print(f"[StrictGemini] STAGE 6: Structural validation...")
-        is_valid, validation_error = self._validate_strict(package)
+        with span("engine", "structural_validation") as validation_span:
+            is_valid, validation_error = self._validate_strict(package)
+            if not is_valid:
+                validation_span.fail()
         
         if not is_valid:
             raise GeminiError(
@@ -269,7 +1114,8 @@ class StrictGeminiEngine:
             )
         
         # Save to history
-        self.context_loader.save_history(project_id, user_request, package.to_dict())
+        with span("engine", "history_save"):
+            self.context_loader.save_history(project_id, user_request, package.to_dict())
         
         print(f"[StrictGemini] ✅ Generation complete!")
         print(f"[StrictGemini]   Model: {package.model_used}")
@@ -278,6 +1124,93 @@ class StrictGeminiEngine:
         
         return package
     
+    def _use_edit_mode(self, user_request: str, context: ProjectContext) -> bool:
+        """Edit the existing main.cpp unless there is none, it is huge, or the user wants a new program."""
+        if not self.EDIT_CONFIG["enabled"] or not context.existing_code:
+            return False
+        if len(context.existing_code) > self.EDIT_CONFIG["max_file_chars"]:
+            return False
+        request_lower = user_request.lower()
+        return not any(hint in request_lower for hint in self.EDIT_CONFIG["rewrite_hints"])
+    
+    @contextlib.contextmanager
+    def _edit_output_budget(self):
+        """Edit blocks are short: cap output tokens (and the rate-limiter estimate) for the call."""
+        previous = self.max_output_tokens
+        self.max_output_tokens = self.EDIT_CONFIG["max_output_tokens"]
+        try:
+            yield
+        finally:
+            self.max_output_tokens = previous
+    
+    def _build_edit_prompt(self, user_request: str, context: ProjectContext) -> str:
+        """Prompt asking for SEARCH/REPLACE blocks against the current main.cpp."""
+        prompt_parts = [f"""You are HardcoreAI, editing existing {context.board_type.upper()} firmware.
+
+THE USER'S INTENT IS THE SINGLE SOURCE OF TRUTH: make exactly the requested change
+and keep everything else in the file as it is.
+
+Reply ONLY with one or more edit blocks in this exact format:
+
+<<<<<<< SEARCH
+lines copied exactly from the current file
+=======
+the lines that replace them
+>>>>>>> REPLACE
+
+Rules:
+• SEARCH must match the current file exactly (including indentation) and only once;
+  add a neighbouring line if needed to make it unique
+• Keep blocks small; use several blocks for changes in different places
+• To add code, SEARCH for the line it goes after and repeat that line in REPLACE
+• Multi-phase logic MUST NOT use delay(); keep the existing timing style
+• If the request needs a different program rather than an edit, reply instead with the
+  complete new firmware in one ```cpp block
+"""]
+        prompt_parts.append(f"\n--- CURRENT FILE (src/main.cpp) ---\n```cpp\n{context.existing_code}\n```\n")
+        prompt_parts.append(f"\n--- USER REQUEST ---\n{user_request}\n")
+        return "".join(prompt_parts)
+    
+    def _finalize_edit(self, user_request: str, project_id: str, context: ProjectContext,
+                       raw_output: Optional[str], attempts: List[GenerationAttempt]) -> Optional[FirmwarePackage]:
+        """Apply edit blocks to the existing code; None means fall back to full generation."""
+        if not raw_output:
+            raise GeminiError(
+                error_code="LLM_UNAVAILABLE",
+                message=f"All {len(attempts)} Gemini attempts failed. Check API status and try again in 60s.",
+                attempts=attempts
+            )
+        
+        blocks = parse_edit_blocks(raw_output)
+        if not blocks and self._extract_code(raw_output):
+            # The model decided a rewrite was needed and sent a whole file
+            print(f"[StrictGemini]   Edit mode: model returned a complete file")
+            try:
+                return self._finalize_generation(user_request, project_id, context, raw_output, attempts)
+            except GeminiError as e:
+                print(f"[StrictGemini]   Edit mode: rewrite unusable ({e.message}), falling back to full generation")
+                return None
+        
+        print(f"[StrictGemini] STAGE 4: Applying {len(blocks)} edit block(s)...")
+        try:
+            with span("engine", "apply_edits"):
+                code = apply_edits(context.existing_code, blocks)
+        except PatchError as e:
+            print(f"[StrictGemini]   Edit did not apply ({e}), falling back to full generation")
+            return None
+        
+        # Pins, timeline and tests are derived from the patched code by _validate_strict
+        package = FirmwarePackage(code=code, pin_block="", pin_json={"mcu": context.board_type}, timeline="", tests=[])
+        package.model_used = self.current_model
+        package.context_used = True
+        package.edited = True
+        package.attempts = attempts
+        package = self._accept_package(user_request, project_id, context, package, attempts)
+        if package.pin_json.get("connections"):
+            package.pin_block = self.generate_pin_block_from_json(package.pin_json, context.board_type)
+        package.confidence = self._calculate_confidence(package)
+        return package
+    
     def _build_contextual_prompt(self, user_request: str, context: ProjectContext) -> str:
         """Build prompt with ABSOLUTE CORE RULE and context injection."""
         
@@ -349,13 +1282,22 @@ TIMING RULES
         prompt_parts = [system_prompt, "\n\n--- CURRENT CONTEXT ---\n"]
         prompt_parts.append(f"TARGET BOARD: {context.board_type.upper()}\n")
         
-        # Existing code context
+        # Existing code context: the blocks most relevant to this request, within a token budget
+        pins = context.existing_pins
         if context.existing_code:
-            prompt_parts.append(f"\nEXISTING CODE (for reference):\n```cpp\n{context.existing_code[:800]}\n```\n")
+            with span("engine", "context_pack"):
+                packed = pack_context(context.existing_code, user_request, context.existing_pins, context.components)
+            pins = packed.pins
+            if packed.omitted:
+                print(f"[StrictGemini]   Packed context: {packed.included} (~{packed.tokens} tokens, "
+                      f"{len(packed.omitted)} blocks omitted)")
+                prompt_parts.append(f"\nEXISTING CODE (most relevant parts, for reference):\n```cpp\n{packed.code}\n```\n")
+            else:
+                prompt_parts.append(f"\nEXISTING CODE (for reference):\n```cpp\n{packed.code}\n```\n")
             
         # Existing pins
-        if context.existing_pins:
-            pin_str = ", ".join(f"{k}={v}" for k, v in list(context.existing_pins.items())[:5])
+        if pins:
+            pin_str = ", ".join(f"{k}={v}" for k, v in pins.items())
             prompt_parts.append(f"\nCURRENT PINS: {pin_str}\n")
         
         # Conversation history
@@ -515,126 +1457,369 @@ TIMING RULES
     
     # ===== All original methods below (unchanged) =====
     
+    def _generation_endpoint(self, model: Optional[str] = None) -> str:
+        """generateContent URL for model (default: the current model)."""
+        model = model or self.current_model
+        return f"{GEMINI_API_BASE}/v1/models/{model}:generateContent?key={self.api_key}"
+    
+    def _stream_endpoint(self) -> str:
+        """streamGenerateContent (SSE) URL for the current model."""
+        return f"{GEMINI_API_BASE}/v1/models/{self.current_model}:streamGenerateContent?alt=sse&key={self.api_key}"
+    
+    def _generation_payload(self, prompt: str) -> Dict[str, Any]:
+        """Request body for firmware generation."""
+        return {
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generation_config": {
+                "temperature": self.temperature,
+                "top_p": 0.95,
+                "top_k": 40,
+                "max_output_tokens": self.max_output_tokens
+            }
+        }
+    
+    def _evaluate_response(self, status_code: int, body_text: str, latency_ms: int,
+                           attempt_num: int,
+                           model: Optional[str] = None) -> Tuple[GenerationAttempt, Optional[str], Optional[float]]:
+        """
+        Classify one generateContent response.
+        
+        Returns (attempt, text, retry_delay):
+        - text is set when the attempt produced usable output
+        - retry_delay is the pause before rotating to the next model
+        """
+        attempt = GenerationAttempt(
+            model=model or self.current_model,
+            status_code=status_code,
+            latency_ms=latency_ms,
+            success=status_code == 200
+        )
+        
+        print(f"[StrictGemini]   Status: {status_code} from {attempt.model} ({latency_ms}ms)")
+        
+        if status_code == 429:
+            attempt.error_snippet = body_text[:200]
+            self._record_attempt(attempt)
+            delay = min(
+                self.RETRY_CONFIG["base_delay"] * (self.RETRY_CONFIG["backoff_factor"] ** attempt_num),
+                self.RETRY_CONFIG["max_delay"]
+            )
+            print(f"[StrictGemini]   Rate limited, retrying in {delay}s...")
+            # Hold every queued request for this key, not just this one
+            get_rate_limiter(self.api_key).pause(delay)
+            return (attempt, None, delay)
+        
+        if status_code != 200:
+            attempt.error_snippet = body_text[:200]
+            
+            if self._is_model_unsupported_error(status_code, body_text):
+                print(f"[StrictGemini]   Model rejected, invalidating model cache")
+                _model_cache.invalidate(self._model_cache_key())
+            
+            self._record_attempt(attempt)
+            return (attempt, None, 0.5)
+        
+        try:
+            text = self._extract_text(json.loads(body_text))
+        except ValueError:
+            text = None
+        
+        if text:
+            print(f"[StrictGemini]   ✓ Received {len(text)} chars")
+            _latency_tracker.record(latency_ms)
+            self._record_attempt(attempt)
+            return (attempt, text, None)
+        
+        attempt.error_snippet = "Empty response"
+        attempt.success = False
+        self._record_attempt(attempt)
+        return (attempt, None, 0.0)
+    
+    def _record_attempt(self, attempt: GenerationAttempt):
+        """Feed an attempt to the model scoreboard and the /metrics counters."""
+        model_health.record(attempt)
+        GEMINI_ATTEMPTS.inc(model=attempt.model, status=attempt.status_code)
+        if attempt.success:
+            GEMINI_REQUEST_SECONDS.observe(attempt.latency_ms / 1000.0, model=attempt.model)
+    
+    def _failed_attempt(self, start_time: float, status_code: int, error_snippet: str,
+                        model: Optional[str] = None) -> GenerationAttempt:
+        """Attempt record for a request that never produced a response."""
+        attempt = GenerationAttempt(
+            model=model or self.current_model,
+            status_code=status_code,
+            latency_ms=int((time.time() - start_time) * 1000),
+            error_snippet=error_snippet,
+            success=False
+        )
+        self._record_attempt(attempt)
+        return attempt
+    
+    def _skipped_attempt(self, model: str) -> GenerationAttempt:
+        """Attempt record for a model whose breaker closed the door; not fed back to the scoreboard."""
+        print(f"[StrictGemini]   Skipping {model} (circuit breaker open or probe in flight)")
+        return GenerationAttempt(model=model, status_code=503, latency_ms=0,
+                                 error_snippet="Skipped: circuit breaker open", success=False)
+    
+    def _estimate_tokens(self, prompt: str) -> int:
+        """Rough quota cost of one call: prompt tokens (~4 chars each) + output budget."""
+        return len(prompt) // 4 + self._generation_payload("")["generation_config"]["max_output_tokens"]
+    
+    async def _aqueue_for_quota(self, prompt: str, attempts: List[GenerationAttempt]):
+        """Wait in the per-key fair queue for quota, yielding queue positions."""
+        limiter = get_rate_limiter(self.api_key)
+        try:
+            ticket = limiter.submit(self.project_id, self._estimate_tokens(prompt), self.priority)
+            async for position in limiter.wait_with_updates(ticket):
+                yield position
+        except (RateLimitQueueFull, RateLimitTimeout) as e:
+            raise GeminiError(
+                error_code="RATE_LIMITED",
+                message=f"{e}. Try again shortly.",
+                attempts=attempts
+            )
+    
     def _generate_with_retry(self, prompt: str) -> Tuple[Optional[str], List[GenerationAttempt]]:
         """Call Gemini with exponential backoff retry."""
         attempts = []
         max_attempts = self.RETRY_CONFIG["max_attempts"]
-        base_delay = self.RETRY_CONFIG["base_delay"]
-        backoff_factor = self.RETRY_CONFIG["backoff_factor"]
-        max_delay = self.RETRY_CONFIG["max_delay"]
+        limiter = get_rate_limiter(self.api_key)
         
         for attempt_num in range(max_attempts):
-            start_time = time.time()
+            # Breaker first: a skipped attempt must not spend the key's quota
+            probe = object()
+            if not model_health.acquire(self.current_model, probe):
+                attempts.append(self._skipped_attempt(self.current_model))
+                if attempt_num < max_attempts - 1:
+                    self._rotate_model()
+                continue
             
+            try:
+                limiter.acquire_blocking(self._estimate_tokens(prompt))
+            except RateLimitTimeout as e:
+                model_health.release(self.current_model, probe)
+                raise GeminiError(error_code="RATE_LIMITED", message=f"{e}. Try again shortly.", attempts=attempts)
+            
+            start_time = time.time()
+            delay = 0.0
             try:
                 print(f"[StrictGemini]   Attempt {attempt_num + 1}/{max_attempts}: {self.current_model}")
                 
-                endpoint = f"https://generativelanguage.googleapis.com/v1/models/{self.current_model}:generateContent"
-                payload = {
-                    "contents": [{"parts": [{"text": prompt}]}],
-                    "generation_config": {
-                        "temperature": self.temperature,
-                        "top_p": 0.95,
-                        "top_k": 40,
-                        "max_output_tokens": 4096
-                    }
-                }
-                
-                response = requests.post(
-                    f"{endpoint}?key={self.api_key}",
-                    headers={"Content-Type": "application/json"},
-                    json=payload,
-                    timeout=self.timeout
+                status_code, body_text = get_http_client().post_json(
+                    self._generation_endpoint(),
+                    self._generation_payload(prompt),
+                    read_timeout=self.timeout
                 )
                 
                 latency_ms = int((time.time() - start_time) * 1000)
-                
-                attempt = GenerationAttempt(
-                    model=self.current_model,
-                    status_code=response.status_code,
-                    latency_ms=latency_ms,
-                    success=response.status_code == 200
+                attempt, text, delay = self._evaluate_response(
+                    status_code, body_text, latency_ms, attempt_num
                 )
-                
-                print(f"[StrictGemini]   Status: {response.status_code} ({latency_ms}ms)")
-                
-                if response.status_code == 429:
-                    attempt.error_snippet = response.text[:200]
-                    attempts.append(attempt)
-                    
-                    if attempt_num < max_attempts - 1:
-                        delay = min(base_delay * (backoff_factor ** attempt_num), max_delay)
-                        print(f"[StrictGemini]   Rate limited, retrying in {delay}s...")
-                        time.sleep(delay)
-                        self._rotate_model()
-                        continue
-                    else:
-                        return (None, attempts)
-                
-                if response.status_code != 200:
-                    attempt.error_snippet = response.text[:200]
-                    attempts.append(attempt)
-                    
-                    if attempt_num < max_attempts - 1:
-                        self._rotate_model()
-                        time.sleep(0.5)
-                        continue
-                    else:
-                        return (None, attempts)
-                
-                body = response.json()
-                text = self._extract_text(body)
+                attempts.append(attempt)
                 
                 if text:
-                    print(f"[StrictGemini]   ✓ Received {len(text)} chars")
-                    attempts.append(attempt)
                     return (text, attempts)
-                else:
-                    attempt.error_snippet = "Empty response"
-                    attempts.append(attempt)
-                    
-                    if attempt_num < max_attempts - 1:
-                        self._rotate_model()
-                        continue
-                    else:
-                        return (None, attempts)
                     
             except requests.Timeout:
-                latency_ms = int((time.time() - start_time) * 1000)
-                attempt = GenerationAttempt(
-                    model=self.current_model,
-                    status_code=408,
-                    latency_ms=latency_ms,
-                    error_snippet="Timeout",
-                    success=False
-                )
-                attempts.append(attempt)
-                
-                if attempt_num < max_attempts - 1:
-                    self._rotate_model()
-                    continue
+                attempts.append(self._failed_attempt(start_time, 408, "Timeout"))
                     
             except Exception as e:
-                latency_ms = int((time.time() - start_time) * 1000)
-                attempt = GenerationAttempt(
-                    model=self.current_model,
-                    status_code=500,
-                    latency_ms=latency_ms,
-                    error_snippet=str(e)[:200],
-                    success=False
-                )
-                attempts.append(attempt)
-                
+                attempts.append(self._failed_attempt(start_time, 500, str(e)[:200]))
+            
+            finally:
+                model_health.release(self.current_model, probe)
+            
+            if attempt_num < max_attempts - 1:
+                if delay:
+                    time.sleep(delay)
+                self._rotate_model()
+        
+        return (None, attempts)
+    
+    async def _agenerate_with_retry(self, prompt: str) -> Tuple[Optional[str], List[GenerationAttempt]]:
+        """
+        Asyncio-native variant of _generate_with_retry.
+        Uses a non-blocking HTTP client and asyncio.sleep for backoff so
+        concurrent generations overlap instead of stalling the event loop.
+        With hedging enabled, each attempt may race several models.
+        """
+        attempts = []
+        max_attempts = self.RETRY_CONFIG["max_attempts"]
+        hedging = self.HEDGE_CONFIG["enabled"] and len(self.model_whitelist) > 1
+        
+        for attempt_num in range(max_attempts):
+            # Breaker first: a skipped attempt must not spend the key's quota
+            model = self.current_model
+            probe = object()
+            if not model_health.acquire(model, probe):
+                attempts.append(self._skipped_attempt(model))
                 if attempt_num < max_attempts - 1:
                     self._rotate_model()
-                    continue
+                continue
+            
+            try:
+                async for position in self._aqueue_for_quota(prompt, attempts):
+                    print(f"[StrictGemini]   Queued for quota (position {position})")
+            except BaseException:
+                model_health.release(model, probe)
+                raise
+            
+            print(f"[StrictGemini]   Attempt {attempt_num + 1}/{max_attempts}: {model}")
+            
+            if hedging:
+                round_attempts, text, delay = await self._ahedged_call(prompt, attempt_num, probe)
+            else:
+                attempt, text, delay = await self._acall_model(model, prompt, attempt_num, probe)
+                round_attempts = [attempt]
+            attempts.extend(round_attempts)
+            
+            if text:
+                return (text, attempts)
+            
+            if attempt_num < max_attempts - 1:
+                if delay:
+                    await asyncio.sleep(delay)
+                self._rotate_model()
         
         return (None, attempts)
     
+    async def _acall_model(self, model: str, prompt: str, attempt_num: int,
+                           probe: object) -> Tuple[GenerationAttempt, Optional[str], float]:
+        """
+        One generateContent call against model, holding a per-key
+        concurrency slot. The caller has claimed the model's breaker slot
+        (model_health.acquire(model, probe)) and the call's quota; the slot
+        is released on exit, including when a hedge loser is cancelled.
+        """
+        try:
+            async with _key_semaphore(self.api_key):
+                start_time = time.time()
+                try:
+                    status_code, body_text = await get_http_client().apost_json(
+                        self._generation_endpoint(model),
+                        self._generation_payload(prompt),
+                        read_timeout=self.timeout
+                    )
+                    latency_ms = int((time.time() - start_time) * 1000)
+                    attempt, text, delay = self._evaluate_response(
+                        status_code, body_text, latency_ms, attempt_num, model=model
+                    )
+                    return (attempt, text, delay or 0.0)
+                
+                except _TIMEOUT_ERRORS:
+                    return (self._failed_attempt(start_time, 408, "Timeout", model=model), None, 0.0)
+                
+                except Exception as e:
+                    if isinstance(e, asyncio.CancelledError):
+                        raise
+                    return (self._failed_attempt(start_time, 500, str(e)[:200], model=model), None, 0.0)
+        
+        finally:
+            model_health.release(model, probe)
+    
+    def _hedge_delay(self) -> float:
+        """Seconds to wait on the primary before hedging (percentile of recent latencies)."""
+        config = self.HEDGE_CONFIG
+        if len(_latency_tracker) < config["min_samples"]:
+            return config["default_delay"]
+        budget_ms = _latency_tracker.percentile(config["percentile"])
+        return max(config["min_delay"], budget_ms / 1000.0)
+    
+    def _hedge_candidates(self) -> List[str]:
+        """Models to hedge with, in whitelist order after the current one."""
+        count = len(self.model_whitelist)
+        candidates = [
+            self.model_whitelist[(self.current_model_index + offset) % count]
+            for offset in range(1, count)
+        ]
+        candidates = [m for m in candidates if m != self.current_model and model_health.is_available(m)]
+        return candidates[:self.HEDGE_CONFIG["max_hedges"]]
+    
+    async def _ahedged_call(self, prompt: str, attempt_num: int,
+                            probe: object) -> Tuple[List[GenerationAttempt], Optional[str], float]:
+        """
+        Race the current model against hedge models.
+        
+        A hedge is only fired when the primary exceeds the latency budget
+        and a per-key concurrency slot is free. The first valid response
+        wins; the rest are cancelled and recorded as cancelled attempts.
+        """
+        attempts: List[GenerationAttempt] = []
+        hedge_models = self._hedge_candidates()
+        budget = self._hedge_delay()
+        semaphore = _key_semaphore(self.api_key)
+        delay = 0.0
+        
+        started: Dict[asyncio.Task, Tuple[str, float, object]] = {}
+        
+        def launch(model: str, owner: object):
+            task = asyncio.create_task(self._acall_model(model, prompt, attempt_num, owner))
+            started[task] = (model, time.time(), owner)
+        
+        launch(self.current_model, probe)
+        pending = set(started)
+        
+        try:
+            while pending:
+                wait_for = budget if hedge_models else None
+                done, pending = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                
+                if not done:
+                    # Budget elapsed with nothing back: hedge if the key has capacity
+                    model = hedge_models.pop(0)
+                    if semaphore.locked():
+                        print(f"[StrictGemini]   Hedge to {model} skipped (per-key concurrency cap)")
+                        continue
+                    owner = object()
+                    if not model_health.acquire(model, owner):
+                        print(f"[StrictGemini]   Hedge to {model} skipped (circuit breaker open or probe in flight)")
+                        continue
+                    if not get_rate_limiter(self.api_key).try_acquire_now(self._estimate_tokens(prompt)):
+                        model_health.release(model, owner)
+                        print(f"[StrictGemini]   Hedge to {model} skipped (no spare quota)")
+                        continue
+                    print(f"[StrictGemini]   No answer after {budget:.1f}s, hedging with {model}")
+                    launch(model, owner)
+                    pending = {t for t in started if not t.done()}
+                    continue
+                
+                for task in done:
+                    attempt, text, task_delay = task.result()
+                    attempts.append(attempt)
+                    delay = max(delay, task_delay)
+                    if text:
+                        if attempt.model != self.current_model:
+                            # Report the model that actually produced the output
+                            self.current_model = attempt.model
+                            self.current_model_index = self.model_whitelist.index(attempt.model)
+                        return (attempts, text, 0.0)
+            
+            return (attempts, None, delay)
+        
+        finally:
+            for task, (model, start_time, _) in started.items():
+                if not task.done():
+                    task.cancel()
+                    attempts.append(self._failed_attempt(start_time, 499, "Cancelled (lost hedge race)", model=model))
+            losers = [t for t in started if not t.done()]
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+            # A task cancelled before its first step never reached its own finally
+            for model, _, owner in started.values():
+                model_health.release(model, owner)
+    
     def _rotate_model(self):
-        """Switch to next model in whitelist."""
+        """Switch to next model in whitelist, skipping models with an open breaker."""
         old_model = self.current_model
-        self.current_model_index = (self.current_model_index + 1) % len(self.model_whitelist)
+        count = len(self.model_whitelist)
+        for offset in range(1, count + 1):
+            index = (self.current_model_index + offset) % count
+            if model_health.is_available(self.model_whitelist[index]):
+                break
+        else:
+            # Every breaker is open; fall back to plain rotation
+            index = (self.current_model_index + 1) % count
+        self.current_model_index = index
         self.current_model = self.model_whitelist[self.current_model_index]
         print(f"[StrictGemini]   Rotated: {old_model} → {self.current_model}")
     
@@ -654,6 +1839,14 @@ TIMING RULES
         except Exception:
             return None
     
+    def _extract_chunk_text(self, chunk: Dict[str, Any]) -> str:
+        """Text of one streamed chunk, unstripped so chunk boundaries stay intact."""
+        try:
+            parts = chunk.get("candidates", [{}])[0].get("content", {}).get("parts", [])
+            return "".join(p.get("text", "") for p in parts)
+        except Exception:
+            return ""
+    
     def _parse_ai_output(self, text: str, board: str) -> FirmwarePackage:
         """Parse AI output - may raise exceptions if incomplete."""
         package = FirmwarePackage(code="", pin_block="", pin_json={}, timeline="", tests=[])
@@ -965,21 +2158,21 @@ TIMING RULES
     def chat_response(self, prompt: str) -> str:
         """Handle conversational chat."""
         try:
-            endpoint = f"https://generativelanguage.googleapis.com/v1/models/{self.current_model}:generateContent"
+            endpoint = f"{GEMINI_API_BASE}/v1/models/{self.current_model}:generateContent"
             payload = {
                 "contents": [{"parts": [{"text": f"You are HardcoreAI. User: '{prompt}'. Reply in 2-3 sentences."}]}],
                 "generation_config": {"temperature": 0.7, "max_output_tokens": 512}
             }
             
-            response = requests.post(f"{endpoint}?key={self.api_key}",
-                                   headers={"Content-Type": "application/json"},
-                                   json=payload, timeout=10)
+            status_code, body_text = get_http_client().post_json(
+                f"{endpoint}?key={self.api_key}", payload, read_timeout=10
+            )
             
-            if response.status_code == 429:
+            if status_code == 429:
                 return "I'm rate-limited. Try generating firmware!"
             
-            if response.status_code == 200:
-                text = self._extract_text(response.json())
+            if status_code == 200:
+                text = self._extract_text(json.loads(body_text))
                 return text if text else "I'm having trouble responding."
             
             return "Error connecting to AI."
@@ -0,0 +1,322 @@
+"""
+Benchmark - End-to-End Latency Harness for the Orchestrator
+Drives /execute, /chat and /build in-process against the mock Gemini server
+at configurable concurrency and reports p50/p95/p99 per pipeline stage, giving
+a repeatable performance baseline for changes to ai.py and main.py.
+
+Usage:
+    python benchmark.py --requests 50 --concurrency 8 --latency-ms 800
+    python benchmark.py --scenarios execute --rate-429 0.1 --json baseline.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import asyncio
+import argparse
+import functools
+import inspect
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from mock_gemini_server import MockGeminiConfig, start_mock_server, load_recordings
+
+PROJECT_PREFIX = "bench_"
+
+EXECUTE_PROMPTS = [
+    "Blink an LED on GPIO 2 every 500ms",
+    "Sweep a servo on GPIO 18 from 0 to 180 degrees",
+]
+
+# Small talk, build intent, the behavior answer, then the confirmation that triggers generation
+CHAT_CONVERSATION = [
+    "hello",
+    "blink an LED on GPIO 2",
+    "esp32, toggle it every 500ms",
+    "yes, go ahead",
+]
+
+BUILD_FIRMWARE = """#include <Arduino.h>
+#define LED_PIN 2
+void setup() { pinMode(LED_PIN, OUTPUT); }
+void loop() { digitalWrite(LED_PIN, !digitalRead(LED_PIN)); delay(500); }
+"""
+
+class StageTimer:
+    """Collects wall-clock durations (ms) per stage from wrapped functions."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, elapsed_ms: float, failed: bool = False):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(elapsed_ms)
+            if failed:
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+
+    def instrument(self, owner, attr: str, stage: str):
+        """Replace owner.attr with a timing wrapper (sync or async)."""
+        original = getattr(owner, attr)
+
+        if inspect.iscoroutinefunction(original):
+            @functools.wraps(original)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                failed = True
+                try:
+                    result = await original(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    self.record(stage, (time.perf_counter() - start) * 1000, failed)
+        else:
+            @functools.wraps(original)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                failed = True
+                try:
+                    result = original(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    self.record(stage, (time.perf_counter() - start) * 1000, failed)
+
+        setattr(owner, attr, wrapper)
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                stage: {
+                    "count": len(values),
+                    "errors": self.errors.get(stage, 0),
+                    "p50_ms": percentile(values, 0.50),
+                    "p95_ms": percentile(values, 0.95),
+                    "p99_ms": percentile(values, 0.99),
+                    "max_ms": round(max(values), 1),
+                }
+                for stage, values in self.samples.items()
+            }
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return round(ordered[index], 1)
+
+def configure_environment(args, gemini_base: str):
+    """Environment for main/ai; must run before they are imported."""
+    os.environ["GEMINI_API_BASE"] = gemini_base
+    os.environ.setdefault("LLM_API_KEY", "mock-benchmark-key")
+    if not args.use_cache:
+        os.environ["GENERATION_CACHE_ENABLED"] = "0"
+    if not args.rate_limit:
+        # Measure the pipeline, not the client-side quota queue
+        os.environ["GEMINI_RPM"] = "1000000"
+        os.environ["GEMINI_TPM"] = "1000000000"
+
+def isolate_state(scratch: Path):
+    """
+    Point every persistent store the pipeline writes to at scratch, so the
+    benchmark's bench_* rows never reach the real caches and history.
+    """
+    os.environ["GENERATION_CACHE_PATH"] = str(scratch / "generation_cache.db")
+    os.environ["HISTORY_DB_PATH"] = str(scratch / "history.db")
+    os.environ["CONVERSATION_STATE_BACKEND"] = "sqlite"
+    os.environ["CONVERSATION_STATE_PATH"] = str(scratch / "conversation_state.db")
+    os.environ["BUILD_CACHE_PATH"] = str(scratch / "build_cache")
+
+def instrument_pipeline(timer: StageTimer):
+    """Wrap every pipeline stage that /execute, /chat and /build pass through."""
+    import ai
+    import main
+    import context_loader
+    import hal_adapter
+    import firmware_gen
+    import platformio_builder
+
+    timer.instrument(ai.StrictGeminiEngine, "_supported_models", "preflight")
+    timer.instrument(context_loader.ProjectContextLoader, "load", "context_load")
+    timer.instrument(ai.StrictGeminiEngine, "_generate_with_retry", "generation")
+    timer.instrument(ai.StrictGeminiEngine, "_agenerate_with_retry", "generation")
+    timer.instrument(ai.StrictGeminiEngine, "_parse_ai_output", "parse")
+    timer.instrument(hal_adapter.IntelligentHAL, "validate_and_resolve", "hal")
+    timer.instrument(firmware_gen.FirmwareAssembler, "assemble", "assembly")
+    timer.instrument(main, "_save_to_workspace", "workspace_save")
+    timer.instrument(platformio_builder.PlatformIOBuilder, "build_and_flash", "build")
+
+async def run_execute(client, index: int, args) -> bool:
+    response = await client.post("/execute", json={
+        "prompt": EXECUTE_PROMPTS[index % len(EXECUTE_PROMPTS)],
+        "board_type": "esp32",
+        "project_id": f"{PROJECT_PREFIX}execute_{index}",
+        "bypass_cache": not args.use_cache,
+    })
+    return response.status_code == 200 and response.json().get("status") == "success"
+
+async def run_chat(client, index: int, args) -> bool:
+    """The whole conversation; only counts as ok if the last turn returned generated firmware."""
+    project_id = f"{PROJECT_PREFIX}chat_{index}"
+    body: Dict[str, Any] = {}
+    for message in CHAT_CONVERSATION:
+        response = await client.post("/chat", json={
+            "message": message,
+            "project_id": project_id,
+            "board_type": "esp32",
+        })
+        body = response.json() if response.status_code == 200 else {}
+        if body.get("status") != "success":
+            return False
+    if body.get("response_type") != "code" or "setup" not in (body.get("firmware") or ""):
+        print(f"[Benchmark] chat #{index} ended without firmware "
+              f"(state {body.get('state')}): {body.get('message', '')[:80]!r}")
+        return False
+    return True
+
+async def run_build(client, index: int, args) -> bool:
+    response = await client.post("/build", json={
+        "firmware": BUILD_FIRMWARE,
+        "board_type": "esp32",
+    })
+    return response.status_code == 200 and bool(response.json().get("success"))
+
+SCENARIOS = {
+    "execute": run_execute,
+    "chat": run_chat,
+    "build": run_build,
+}
+
+async def run_scenario(client, name: str, timer: StageTimer, args) -> Dict[str, Any]:
+    runner = SCENARIOS[name]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    outcomes = {"ok": 0, "failed": 0}
+
+    async def one(index: int):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                ok = await runner(client, index, args)
+            except Exception as e:
+                print(f"[Benchmark] {name} #{index} raised: {e}")
+                ok = False
+            timer.record(f"{name}_total", (time.perf_counter() - start) * 1000, not ok)
+            outcomes["ok" if ok else "failed"] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(args.requests)])
+    elapsed = time.perf_counter() - start
+    return {
+        **outcomes,
+        "wall_s": round(elapsed, 2),
+        "throughput_rps": round(args.requests / elapsed, 2) if elapsed else 0.0,
+    }
+
+async def run_benchmark(args) -> Dict[str, Any]:
+    import httpx
+    import main
+    import auth
+
+    timer = StageTimer()
+    instrument_pipeline(timer)
+
+    # /build requires a JWT; the benchmark runs as the local desktop user
+    desktop_user = type("User", (), {"id": 0, "email": "benchmark@local", "full_name": "Benchmark"})()
+    main.app.dependency_overrides[auth.get_current_user] = lambda: desktop_user
+
+    results: Dict[str, Any] = {"scenarios": {}}
+    async with httpx.AsyncClient(app=main.app, base_url="http://benchmark",
+                                 headers={"X-Desktop-Key": auth.DESKTOP_BYPASS_KEY},
+                                 timeout=None) as client:
+        for name in args.scenarios:
+            print(f"[Benchmark] Running {name}: {args.requests} requests @ concurrency {args.concurrency}")
+            results["scenarios"][name] = await run_scenario(client, name, timer, args)
+
+    main.app.dependency_overrides.pop(auth.get_current_user, None)
+    results["stages"] = timer.report()
+    return results
+
+def cleanup_workspace():
+    """Remove bench_* projects the pipeline wrote into the shared workspace."""
+    workspace = Path(__file__).parent.parent / "workspace"
+    for project_dir in workspace.glob(f"{PROJECT_PREFIX}*"):
+        shutil.rmtree(project_dir, ignore_errors=True)
+
+def print_report(results: Dict[str, Any]):
+    print("\n" + "=" * 78)
+    print(f"{'scenario':<12}{'ok':>8}{'failed':>8}{'wall s':>10}{'req/s':>10}")
+    for name, summary in results["scenarios"].items():
+        print(f"{name:<12}{summary['ok']:>8}{summary['failed']:>8}{summary['wall_s']:>10}{summary['throughput_rps']:>10}")
+
+    print("-" * 78)
+    print(f"{'stage':<18}{'count':>7}{'errors':>8}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'max ms':>11}")
+    for stage, row in results["stages"].items():
+        print(f"{stage:<18}{row['count']:>7}{row['errors']:>8}{row['p50_ms']:>11}"
+              f"{row['p95_ms']:>11}{row['p99_ms']:>11}{row['max_ms']:>11}")
+    print("=" * 78)
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency benchmark for the orchestrator")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--scenarios", default="execute,chat,build",
+                        help=f"Comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--gemini-base", help="Use an already running Gemini stand-in instead of starting one")
+    parser.add_argument("--latency-ms", type=float, default=800.0)
+    parser.add_argument("--jitter-ms", type=float, default=200.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--recordings", help="JSON file with recorded Gemini responses")
+    parser.add_argument("--use-cache", action="store_true", help="Allow generation cache hits")
+    parser.add_argument("--rate-limit", action="store_true", help="Keep the client-side Gemini rate limiter")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {unknown}")
+
+    gemini_base = args.gemini_base
+    if not gemini_base:
+        config = MockGeminiConfig(
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            rate_429=args.rate_429,
+            truncate_rate=args.truncate_rate,
+            seed=args.seed
+        )
+        _, gemini_base = start_mock_server(config, recordings=load_recordings(args.recordings))
+
+    configure_environment(args, gemini_base)
+    if args.json:
+        args.json = str(Path(args.json).resolve())
+
+    # Builder workspace and auth DB are cwd-relative; together with the
+    # cache/history/state DBs they live in a scratch dir removed afterwards
+    original_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="hardcore_bench_", ignore_cleanup_errors=True) as scratch:
+        isolate_state(Path(scratch))
+        os.chdir(scratch)
+        try:
+            results = asyncio.run(run_benchmark(args))
+        finally:
+            cleanup_workspace()
+            os.chdir(original_cwd)
+
+    results["config"] = {k: v for k, v in vars(args).items() if k != "json"}
+    print_report(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+        print(f"[Benchmark] Results written to {args.json}")
+
+if __name__ == "__main__":
+    main()
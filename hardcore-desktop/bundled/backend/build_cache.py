@@ -0,0 +1,221 @@
+"""
+Build Cache - Content-Addressed Firmware Artifact Store
+Keeps compiled firmware (bin/elf/hex plus the bootloader/partition images the
+upload step needs) and build logs on disk, keyed by a hash of the sources,
+board and toolchain, so rebuilding or re-flashing unchanged code skips pio run.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import subprocess
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from metrics import registry, record_cache_lookup
+
+# Top-level files in .pio/build/<env> worth keeping; ESP32 uploads also need
+# bootloader.bin and partitions.bin next to firmware.bin
+ARTIFACT_SUFFIXES = (".bin", ".elf", ".hex")
+META_FILE = "meta.json"
+
+class BuildCache:
+    """
+    Directory-per-key artifact store with size-bounded LRU eviction.
+
+    Each entry is <root>/<key>/ holding the artifacts and a meta.json with
+    the build logs and access time. Entries are written to a temporary
+    directory and renamed into place, so readers never see partial builds.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 512 * 1024 * 1024):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        print(f"[BuildCache] Initialized at {self.root} (max {self.max_bytes // (1024 * 1024)} MB)")
+
+    @staticmethod
+    def make_key(main_cpp: str, resolved_pins_h: str, platformio_ini: str,
+                 board: str, toolchain_version: str) -> str:
+        material = json.dumps({
+            "main_cpp": main_cpp,
+            "resolved_pins_h": resolved_pins_h,
+            "platformio_ini": platformio_ini,
+            "board": board,
+            "toolchain": toolchain_version,
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Metadata for key ({"artifacts": [...], "stdout", "stderr", ...}) or None."""
+        entry_dir = self.root / key
+        with self._lock:
+            meta = self._read_meta(entry_dir)
+            if meta is None:
+                self.misses += 1
+                record_cache_lookup("build", hit=False)
+                return None
+            meta["last_access"] = time.time()
+            meta["hit_count"] = meta.get("hit_count", 0) + 1
+            self._write_meta(entry_dir, meta)
+            self.hits += 1
+        record_cache_lookup("build", hit=True)
+        return meta
+
+    def restore(self, key: str, build_dir: Path) -> List[str]:
+        """Copy key's artifacts into build_dir (e.g. .pio/build/default). Returns file names."""
+        entry_dir = self.root / key
+        build_dir.mkdir(parents=True, exist_ok=True)
+        restored = []
+        with self._lock:
+            meta = self._read_meta(entry_dir) or {}
+            for name in meta.get("artifacts", []):
+                source = entry_dir / name
+                if source.is_file():
+                    shutil.copy2(source, build_dir / name)
+                    restored.append(name)
+        return restored
+
+    def put(self, key: str, build_dir: Path, stdout: str = "", stderr: str = "") -> bool:
+        """Store the artifacts found in build_dir under key. Returns False if there were none."""
+        artifacts = [p for p in build_dir.glob("*") if p.is_file() and p.suffix in ARTIFACT_SUFFIXES]
+        if not artifacts:
+            return False
+
+        staging = self.root / f".tmp-{key}-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        for artifact in artifacts:
+            shutil.copy2(artifact, staging / artifact.name)
+
+        now = time.time()
+        meta = {
+            "artifacts": [a.name for a in artifacts],
+            "stdout": stdout,
+            "stderr": stderr,
+            "size": sum(a.stat().st_size for a in artifacts),
+            "created_at": now,
+            "last_access": now,
+            "hit_count": 0,
+        }
+        self._write_meta(staging, meta)
+
+        entry_dir = self.root / key
+        with self._lock:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(staging, entry_dir)
+            self._evict_locked(keep=key)
+        print(f"[BuildCache] Stored {len(artifacts)} artifacts ({meta['size'] // 1024} KB) for {key[:12]}")
+        return True
+
+    def invalidate(self, key: Optional[str] = None):
+        """Remove one entry, or clear the cache."""
+        with self._lock:
+            targets = [self.root / key] if key else [p for p in self.root.iterdir() if p.is_dir()]
+            for entry_dir in targets:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._entries_locked()
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(entries),
+            "bytes": sum(meta.get("size", 0) for _, meta in entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def _entries_locked(self) -> List:
+        entries = []
+        for entry_dir in self.root.iterdir():
+            if not entry_dir.is_dir() or entry_dir.name.startswith(".tmp-"):
+                continue
+            meta = self._read_meta(entry_dir)
+            if meta is not None:
+                entries.append((entry_dir, meta))
+        return entries
+
+    def _evict_locked(self, keep: str):
+        entries = self._entries_locked()
+        total = sum(meta.get("size", 0) for _, meta in entries)
+        if total <= self.max_bytes:
+            return
+
+        evicted = 0
+        for entry_dir, meta in sorted(entries, key=lambda e: e[1].get("last_access", 0)):
+            if total <= self.max_bytes:
+                break
+            if entry_dir.name == keep:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= meta.get("size", 0)
+            evicted += 1
+        print(f"[BuildCache] Evicted {evicted} entries")
+
+    @staticmethod
+    def _read_meta(entry_dir: Path) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads((entry_dir / META_FILE).read_text(encoding="utf-8"))
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_meta(entry_dir: Path, meta: Dict[str, Any]):
+        (entry_dir / META_FILE).write_text(json.dumps(meta), encoding="utf-8")
+
+_toolchain_version: Optional[str] = None
+
+def toolchain_version(pio_exe: str = "pio") -> str:
+    """
+    PlatformIO core version, resolved once per process. Platform and
+    framework versions are covered by platformio.ini in the key.
+    BUILD_CACHE_TOOLCHAIN_ID overrides it (e.g. to bust the cache).
+    """
+    global _toolchain_version
+    override = os.getenv("BUILD_CACHE_TOOLCHAIN_ID")
+    if override:
+        return override
+    if _toolchain_version is None:
+        try:
+            result = subprocess.run([pio_exe, "--version"], capture_output=True, text=True, timeout=30)
+            _toolchain_version = result.stdout.strip() or "unknown"
+        except (OSError, subprocess.SubprocessError):
+            _toolchain_version = "unknown"
+    return _toolchain_version
+
+_cache: Optional[BuildCache] = None
+_cache_lock = threading.Lock()
+
+def get_build_cache() -> Optional[BuildCache]:
+    """Process-wide artifact cache, or None when disabled via BUILD_CACHE_ENABLED=0."""
+    global _cache
+    if os.getenv("BUILD_CACHE_ENABLED", "1").strip().lower() in ("0", "false", "no"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            default_path = Path(__file__).parent.parent / "cache" / "build_artifacts"
+            _cache = BuildCache(
+                root=Path(os.getenv("BUILD_CACHE_PATH", str(default_path))),
+                max_bytes=int(float(os.getenv("BUILD_CACHE_MAX_MB", "512")) * 1024 * 1024)
+            )
+        return _cache
+
+def _collect_metrics():
+    if _cache is None:
+        return []
+    stats = _cache.stats()
+    return [
+        ("hardcore_build_cache_entries", "gauge", "Firmware builds in the artifact cache", [({}, stats["entries"])]),
+        ("hardcore_build_cache_bytes", "gauge", "Size of cached firmware artifacts", [({}, stats["bytes"])]),
+        ("hardcore_build_cache_hit_ratio", "gauge", "Build cache hits / lookups since start", [({}, stats["hit_rate"])]),
+    ]
+
+registry.register_collector(_collect_metrics)
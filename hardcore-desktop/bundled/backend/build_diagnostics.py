@@ -0,0 +1,277 @@
+"""
+Build Diagnostics - Structured Events from PlatformIO/GCC Output
+Parses build logs on the fly into compile-unit timings, errors/warnings with
+file/line/column and RAM/Flash usage, streamed as NDJSON so the frontend and
+the AI read events instead of re-scanning raw logs.
+"""
+
+import re
+import json
+import time
+from typing import Dict, Any, AsyncIterator, Iterable, List, Optional, Set
+
+EVENT_TYPES = ("stage", "unit_start", "unit_end", "diagnostic", "memory", "result", "log")
+
+# pio (non-verbose) announces each SCons step on its own line
+_STEP_RE = re.compile(r"^(?P<action>Compiling|Linking|Archiving|Indexing|Building) (?P<target>\S+)")
+_RETRIEVED_RE = re.compile(r"^Retrieved `(?P<target>[^']+)' from cache")
+# main.cpp:12:5: error: 'foo' was not declared in this scope
+_GCC_RE = re.compile(
+    r"^(?P<file>(?:[A-Za-z]:)?[^:\n]+):(?P<line>\d+):(?:(?P<column>\d+):)?\s*"
+    r"(?P<severity>fatal error|error|warning|note):\s*(?P<message>.*)$"
+)
+# GNU ld prefixes its messages with its own path:
+# /…/xtensa-esp32-elf/bin/ld: …   C:/…/bin/ld.exe: …   avr-ld: …
+_LD_PREFIX_RE = re.compile(r"^.*?\bld(?:\.exe)?:\s+")
+# .pio/build/esp32dev/src/main.cpp.o:(.literal._Z4loopv+0x0): undefined reference to `foo'
+# main.cpp:(.text.loop+0x4): undefined reference to `foo'   src/main.cpp:12: multiple definition of `bar'
+_LINKER_RE = re.compile(
+    r"^(?P<file>(?:[A-Za-z]:)?[^:\n]+?):(?:\([^)]*\)|(?P<line>\d+)|[^:\n]*):\s*"
+    r"(?P<message>(?:undefined reference to|multiple definition of|first defined here).*)$"
+)
+# main.cpp.o: in function `loop':   (ld)     src/main.cpp: In function 'void loop()':   (gcc)
+_FUNCTION_CONTEXT_RE = re.compile(r"^(?P<file>.+?):\s*[Ii]n function [`'\u2018](?P<function>.+?)['\u2019]:?$")
+_GLOBAL_SCOPE_RE = re.compile(r"^.+?:\s*At global scope:?$")
+_COLLECT2_RE = re.compile(r"^collect2(?:\.exe)?: error: (?P<message>.*)$")
+# RAM:   [=         ]   6.5% (used 21312 bytes from 327680 bytes)
+_MEMORY_RE = re.compile(
+    r"^(?P<region>RAM|Flash):\s*\[[^\]]*\]\s*(?P<percent>[\d.]+)%\s*"
+    r"\(used (?P<used>\d+) bytes from (?P<total>\d+) bytes\)"
+)
+# ========== [SUCCESS] Took 12.34 seconds ==========
+_RESULT_RE = re.compile(r"\[(?P<status>SUCCESS|FAILED|ERROR)\] Took (?P<seconds>[\d.]+) seconds")
+# Markers yielded by PlatformIOBuilder's streaming methods
+_STAGE_MARKERS = {
+    "Starting build process...": "build",
+    "Starting flash process...": "flash",
+}
+_OUTCOME_MARKERS = {
+    "Build successful!": True,
+    "Flash successful!": True,
+    "Build failed!": False,
+    "Flash failed!": False,
+    "Build cancelled.": False,
+}
+
+def _unit_name(target: str) -> str:
+    """.pio/build/default/src/main.cpp.o -> src/main.cpp"""
+    name = re.sub(r"^\.pio[/\\]build[/\\][^/\\]+[/\\]", "", target)
+    return name[:-2] if name.endswith(".o") else name
+
+class BuildLogParser:
+    """
+    Incremental parser: feed() raw output chunks as they arrive and get
+    event dicts back. Compile units are timed from their "Compiling" line to
+    the next step line; with SCons running parallel jobs that is the time
+    until the next unit started, so treat durations as approximate.
+    """
+
+    def __init__(self, include_log: bool = True):
+        self.include_log = include_log
+        self.errors = 0
+        self.warnings = 0
+        self.memory: Dict[str, Dict[str, Any]] = {}
+        self.units: List[Dict[str, Any]] = []
+        self.success: Optional[bool] = None
+        self._diagnostics: List[Dict[str, Any]] = []
+        self._partial = ""
+        self._stage = "build"
+        self._function: Optional[str] = None  # From the last "In function" line
+        self._current: Optional[Dict[str, Any]] = None
+        self._started = time.monotonic()
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        events: List[Dict[str, Any]] = []
+        lines = (self._partial + text).replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            events.extend(self._parse_line(line))
+        return events
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """Flush the trailing line, close the open unit and emit the final result."""
+        events: List[Dict[str, Any]] = []
+        if self._partial:
+            events.extend(self._parse_line(self._partial))
+            self._partial = ""
+        events.extend(self._close_unit())
+        events.append({
+            "type": "result",
+            "success": self.success if self.success is not None else self.errors == 0,
+            "duration_s": round(time.monotonic() - self._started, 2),
+            "errors": self.errors,
+            "warnings": self.warnings,
+            "memory": self.memory,
+        })
+        return events
+
+    def summary(self, limit: int = 20) -> Dict[str, Any]:
+        """Compact digest for non-streaming responses."""
+        digest = {
+            "errors": self.errors,
+            "warnings": self.warnings,
+            "diagnostics": self._diagnostics[:limit],
+            "memory": self.memory,
+            "units_compiled": sum(1 for u in self.units if not u["cached"]),
+            "units_cached": sum(1 for u in self.units if u["cached"]),
+        }
+        # Only meaningful when the log was fed live, not parsed after the fact
+        if any(u["duration_ms"] for u in self.units):
+            digest["slowest_units"] = sorted(self.units, key=lambda u: u["duration_ms"], reverse=True)[:5]
+        return digest
+
+    def _parse_line(self, line: str) -> List[Dict[str, Any]]:
+        stripped = line.strip()
+        if not stripped:
+            return []
+        events: List[Dict[str, Any]] = []
+
+        stage = _STAGE_MARKERS.get(stripped)
+        if stage:
+            events.extend(self._close_unit())
+            self._stage = stage
+            events.append({"type": "stage", "stage": stage, "status": "started"})
+            return events
+
+        if stripped in _OUTCOME_MARKERS or stripped.startswith("Error:"):
+            self.success = _OUTCOME_MARKERS.get(stripped, False)
+
+        match = _STEP_RE.match(stripped)
+        if match:
+            events.extend(self._close_unit())
+            if match.group("action") == "Compiling":
+                self._current = {"file": _unit_name(match.group("target")), "start": time.monotonic()}
+                events.append({"type": "unit_start", "file": self._current["file"]})
+            else:
+                events.append({"type": "stage", "stage": match.group("action").lower(),
+                               "status": "started", "target": _unit_name(match.group("target"))})
+            return events
+
+        match = _RETRIEVED_RE.match(stripped)
+        if match:
+            events.extend(self._close_unit())
+            unit = {"file": _unit_name(match.group("target")), "duration_ms": 0.0, "cached": True}
+            self.units.append(unit)
+            events.append({"type": "unit_end", **unit})
+            return events
+
+        match = _GCC_RE.match(stripped)
+        if match:
+            severity = "error" if match.group("severity") == "fatal error" else match.group("severity")
+            return [self._diagnostic(severity, match.group("message"), match.group("file"),
+                                     int(match.group("line")),
+                                     int(match.group("column")) if match.group("column") else None)]
+
+        linker_line = _LD_PREFIX_RE.sub("", stripped, count=1)
+        is_ld = linker_line != stripped
+
+        match = _FUNCTION_CONTEXT_RE.match(linker_line)
+        if match:
+            # Context for the diagnostics that follow, not a diagnostic itself
+            self._function = match.group("function")
+            return [{"type": "log", "text": line}] if self.include_log else []
+        if _GLOBAL_SCOPE_RE.match(stripped):
+            self._function = None
+            return [{"type": "log", "text": line}] if self.include_log else []
+
+        match = _LINKER_RE.match(linker_line)
+        if match:
+            file = match.group("file")
+            # "first defined here" points at the other half of a multiple definition
+            severity = "note" if match.group("message").startswith("first defined") else "error"
+            return [self._diagnostic(severity, match.group("message"),
+                                     None if file.startswith("<") else _unit_name(file),
+                                     int(match.group("line")) if match.group("line") else None, None)]
+
+        match = _COLLECT2_RE.match(stripped)
+        if match:
+            return [self._diagnostic("error", match.group("message"), None, None, None)]
+
+        if is_ld:
+            # Anything else ld says (region overflowed, cannot find -lfoo, ...) is an error unless marked
+            severity = "warning" if linker_line.lower().startswith("warning:") else "error"
+            message = linker_line[len("warning:"):] if severity == "warning" else linker_line
+            return [self._diagnostic(severity, message, None, None, None)]
+
+        match = _MEMORY_RE.match(stripped)
+        if match:
+            region = match.group("region").lower()
+            self.memory[region] = {
+                "percent": float(match.group("percent")),
+                "used": int(match.group("used")),
+                "total": int(match.group("total")),
+            }
+            return [{"type": "memory", "region": region, **self.memory[region]}]
+
+        match = _RESULT_RE.search(stripped)
+        if match:
+            # One per pio invocation (compile, then upload)
+            events.extend(self._close_unit())
+            events.append({"type": "stage", "stage": self._stage,
+                           "status": "success" if match.group("status") == "SUCCESS" else "failed",
+                           "duration_s": float(match.group("seconds"))})
+            return events
+
+        if self.include_log:
+            events.append({"type": "log", "text": line})
+        return events
+
+    def _diagnostic(self, severity: str, message: str, file: Optional[str],
+                    line: Optional[int], column: Optional[int]) -> Dict[str, Any]:
+        if severity == "error":
+            self.errors += 1
+        elif severity == "warning":
+            self.warnings += 1
+        event = {"type": "diagnostic", "severity": severity, "file": file,
+                 "line": line, "column": column, "message": message.strip()}
+        if self._function:
+            event["function"] = self._function
+        self._diagnostics.append({k: v for k, v in event.items() if k != "type"})
+        return event
+
+    def _close_unit(self) -> List[Dict[str, Any]]:
+        self._function = None
+        if not self._current:
+            return []
+        unit = {
+            "file": self._current["file"],
+            "duration_ms": round((time.monotonic() - self._current["start"]) * 1000, 1),
+            "cached": False,
+        }
+        self._current = None
+        self.units.append(unit)
+        return [{"type": "unit_end", **unit}]
+
+def parse_build_log(text: str) -> Dict[str, Any]:
+    """Summary (errors, warnings, memory, unit counts) of a complete build log."""
+    parser = BuildLogParser(include_log=False)
+    parser.feed(text or "")
+    parser.finish()
+    return parser.summary()
+
+def parse_event_filter(events: Optional[Any]) -> Optional[Set[str]]:
+    """"diagnostic,memory" or ["diagnostic", "memory"] -> set; None/empty means all events."""
+    if not events:
+        return None
+    names = events.split(",") if isinstance(events, str) else list(events)
+    wanted = {n.strip() for n in names if n and n.strip()}
+    unknown = wanted - set(EVENT_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown build event types: {sorted(unknown)} (valid: {', '.join(EVENT_TYPES)})")
+    return wanted or None
+
+async def ndjson_events(chunks: AsyncIterator[str], wanted: Optional[Iterable[str]] = None) -> AsyncIterator[str]:
+    """Turn a raw build log stream into NDJSON lines, keeping only the wanted event types."""
+    wanted = set(wanted) if wanted else None
+    parser = BuildLogParser(include_log=wanted is None or "log" in wanted)
+
+    def encode(events: List[Dict[str, Any]]) -> str:
+        return "".join(json.dumps(e) + "\n" for e in events if wanted is None or e["type"] in wanted)
+
+    async for chunk in chunks:
+        out = encode(parser.feed(chunk))
+        if out:
+            yield out
+    out = encode(parser.finish())
+    if out:
+        yield out
@@ -0,0 +1,183 @@
+"""
+Build Matrix - One Source, Many Boards
+Compiles the same firmware for several boards from board_definitions.json
+concurrently on the build worker pool, either collecting per-board results
+or streaming per-board NDJSON progress.
+"""
+
+import json
+import time
+import asyncio
+from typing import Dict, Any, AsyncIterator, List, Optional, Set
+
+from build_scheduler import build_scheduler, BuildCancelled
+from build_diagnostics import BuildLogParser
+from platformio_builder import PlatformIOBuilder
+from toolchain_registry import board_definitions
+
+def resolve_boards(boards: Optional[List[str]]) -> List[str]:
+    """Requested boards (default: every board in board_definitions.json). Raises ValueError on unknown ones."""
+    definitions = board_definitions.boards()
+    if not boards:
+        return list(definitions)
+    unknown = [b for b in boards if b not in definitions]
+    if unknown:
+        raise ValueError(f"Unknown boards: {unknown} (known: {', '.join(definitions)})")
+    # Keep order, drop duplicates
+    return list(dict.fromkeys(boards))
+
+def _board_project_id(project_id: str, board: str) -> str:
+    # One build directory per board so the boards really build in parallel
+    return f"{project_id}__{board}"
+
+def _firmware_size(builder: PlatformIOBuilder, project_id: str) -> Optional[int]:
+    build_dir = builder._project_dir(project_id) / ".pio" / "build" / "default"
+    for name in ("firmware.bin", "firmware.hex"):
+        path = build_dir / name
+        if path.is_file():
+            return path.stat().st_size
+    return None
+
+def _board_result(board: str, success: bool, digest: Dict[str, Any], size: Optional[int],
+                  started: float, job_id: Optional[str] = None, cached: bool = False,
+                  error: Optional[str] = None) -> Dict[str, Any]:
+    errors = [d for d in digest.get("diagnostics", []) if d.get("severity") == "error"]
+    if error and not errors:
+        errors = [{"message": error}]
+    return {
+        "board": board,
+        "success": success,
+        "cached": cached,
+        "firmware_size": size,
+        "memory": digest.get("memory", {}),
+        "errors": errors,
+        "warnings": digest.get("warnings", 0),
+        "duration_s": round(time.time() - started, 2),
+        "job_id": job_id,
+    }
+
+async def run_matrix(firmware_code: str, boards: List[str], project_id: str = "matrix",
+                     priority: int = 0) -> Dict[str, Any]:
+    """
+    Build every board concurrently and return per-board results. All jobs
+    are queued up front; if queueing fails part way (BuildQueueFull) or the
+    caller goes away, every job already submitted is cancelled.
+    """
+    builder = PlatformIOBuilder()
+    started = time.time()
+
+    def submit(board: str):
+        board_project = _board_project_id(project_id, board)
+        return build_scheduler.submit(
+            lambda token: builder.build_and_flash(
+                firmware_code=firmware_code,
+                board_type=board,
+                flash=False,
+                project_id=board_project,
+                cancel_token=token
+            ),
+            project_id=board_project,
+            kind="matrix",
+            priority=priority
+        )
+
+    async def collect(board: str, job) -> Dict[str, Any]:
+        try:
+            result = await asyncio.wrap_future(job.future)
+        except (BuildCancelled, RuntimeError) as e:
+            return _board_result(board, False, {}, None, started, job.job_id, error=str(e))
+        return _board_result(
+            board,
+            bool(result.get("success")),
+            result.get("diagnostics", {}),
+            _firmware_size(builder, job.project_id) if result.get("success") else None,
+            started,
+            job.job_id,
+            cached=bool(result.get("cached")),
+            error=result.get("error")
+        )
+
+    jobs = []
+    try:
+        for board in boards:
+            jobs.append((board, submit(board)))
+        results = await asyncio.gather(*[collect(board, job) for board, job in jobs])
+    finally:
+        # No-op for finished jobs; stops orphans after BuildQueueFull or a disconnect
+        for _, job in jobs:
+            build_scheduler.cancel(job.job_id)
+
+    return {
+        "success": all(r["success"] for r in results),
+        "boards": {r["board"]: r for r in results},
+        "duration_s": round(time.time() - started, 2),
+    }
+
+async def stream_matrix(firmware_code: str, boards: List[str], project_id: str = "matrix",
+                        priority: int = 0, wanted: Optional[Set[str]] = None) -> AsyncIterator[str]:
+    """
+    NDJSON: every build event tagged with "board", a "board_result" per board
+    as it finishes, then one "matrix_result". wanted filters the build event
+    types; board_result and matrix_result are always sent.
+    """
+    builder = PlatformIOBuilder()
+    started = time.time()
+    events: asyncio.Queue = asyncio.Queue()
+    include_log = wanted is None or "log" in wanted
+
+    async def one(board: str):
+        board_project = _board_project_id(project_id, board)
+        parser = BuildLogParser(include_log=include_log)
+        cached = False
+        chunks = build_scheduler.astream(
+            lambda token: builder.abuild_and_flash_stream(
+                firmware_code=firmware_code,
+                board_type=board,
+                flash=False,
+                project_id=board_project,
+                cancel_token=token
+            ),
+            project_id=board_project,
+            kind="matrix",
+            priority=priority
+        )
+        try:
+            async for chunk in chunks:
+                cached = cached or "Using cached build" in chunk
+                for event in parser.feed(chunk):
+                    await events.put({"board": board, **event})
+            for event in parser.finish():
+                await events.put({"board": board, **event})
+        except Exception as e:
+            await events.put({"type": "board_result",
+                              **_board_result(board, False, parser.summary(), None, started, error=str(e))})
+            return
+
+        success = parser.success is True
+        await events.put({"type": "board_result", **_board_result(
+            board, success, parser.summary(),
+            _firmware_size(builder, board_project) if success else None,
+            started, cached=cached
+        )})
+
+    tasks = [asyncio.create_task(one(board)) for board in boards]
+    results: Dict[str, Any] = {}
+    try:
+        while len(results) < len(boards):
+            event = await events.get()
+            if event["type"] == "board_result":
+                results[event["board"]] = event
+            elif wanted is not None and event["type"] not in wanted:
+                continue
+            yield json.dumps(event) + "\n"
+        yield json.dumps({
+            "type": "matrix_result",
+            "success": all(r["success"] for r in results.values()),
+            "boards": {board: {k: v for k, v in r.items() if k != "type"} for board, r in results.items()},
+            "duration_s": round(time.time() - started, 2),
+        }) + "\n"
+    finally:
+        # Client went away: cancelling the tasks closes their streams, which cancels the jobs
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,115 @@
+"""
+Build Runner - Asyncio Subprocess Streaming for pio
+Runs pio on the event loop instead of a threadpool thread per build and
+streams its output as batched, line-aligned chunks. The process tree is
+killed on client disconnect, timeout or cancellation.
+"""
+
+import os
+import time
+import codecs
+import asyncio
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+
+from build_scheduler import kill_process_tree
+
+# A chunk is flushed once it reaches CHUNK_BYTES or has waited FLUSH_INTERVAL
+CHUNK_BYTES = int(os.getenv("BUILD_LOG_CHUNK_BYTES", "4096"))
+FLUSH_INTERVAL = float(os.getenv("BUILD_LOG_FLUSH_MS", "100")) / 1000.0
+READ_SIZE = 64 * 1024
+
+class StreamedProcess:
+    """
+    One subprocess whose combined stdout/stderr is consumed with
+    `async for chunk in proc.chunks()`.
+
+    Output is only read from the pipe when the consumer asks for the next
+    chunk, so a slow client fills the OS pipe and pio blocks on write
+    instead of the log piling up in memory (backpressure).
+    """
+
+    def __init__(self, cmd: List[str], cwd: Path, timeout: float,
+                 cancel_token=None, collect: bool = False):
+        self.cmd = cmd
+        self.cwd = cwd
+        self.timeout = timeout
+        self.cancel_token = cancel_token
+        self.collect = collect
+        self.output: List[str] = []
+        self.returncode: Optional[int] = None
+        self.timed_out = False
+
+    @property
+    def log(self) -> str:
+        """Everything streamed so far (only when collect=True)."""
+        return "".join(self.output)
+
+    async def chunks(self) -> AsyncIterator[str]:
+        process = await asyncio.create_subprocess_exec(
+            *self.cmd,
+            cwd=str(self.cwd),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True
+        )
+        if self.cancel_token:
+            self.cancel_token.attach(process)
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        buffer = ""
+        buffered_since = 0.0
+        deadline = time.monotonic() + self.timeout
+
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    self.timed_out = True
+                    break
+                wait = deadline - now
+                if buffer:
+                    wait = min(wait, max(0.0, buffered_since + FLUSH_INTERVAL - now))
+
+                try:
+                    data = await asyncio.wait_for(process.stdout.read(READ_SIZE), timeout=wait)
+                except asyncio.TimeoutError:
+                    data = None  # Flush interval or deadline reached
+
+                if data == b"":
+                    buffer += decoder.decode(b"", final=True)
+                    break
+                if data:
+                    if not buffer:
+                        buffered_since = time.monotonic()
+                    buffer += decoder.decode(data)
+
+                if buffer and (len(buffer) >= CHUNK_BYTES or time.monotonic() - buffered_since >= FLUSH_INTERVAL):
+                    # Prefer ending on a line boundary; progress output (\r, no \n) goes out whole
+                    cut = len(buffer) if len(buffer) >= CHUNK_BYTES else (buffer.rfind("\n") + 1 or len(buffer))
+                    chunk, buffer = buffer[:cut], buffer[cut:]
+                    buffered_since = time.monotonic()
+                    yield self._emit(chunk)
+
+            if buffer:
+                yield self._emit(buffer)
+
+            if self.timed_out:
+                kill_process_tree(process)
+                yield self._emit(f"Process timed out after {self.timeout:g} seconds\n")
+            self.returncode = await process.wait()
+        finally:
+            # Client disconnected (CancelledError / aclose) or we bailed out early
+            if process.returncode is None:
+                kill_process_tree(process)
+                try:
+                    await asyncio.shield(process.wait())
+                except asyncio.CancelledError:
+                    pass
+            if self.cancel_token:
+                self.cancel_token.detach(process)
+
+    def _emit(self, chunk: str) -> str:
+        if self.collect:
+            self.output.append(chunk)
+        return chunk
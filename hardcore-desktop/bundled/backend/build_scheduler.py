@@ -0,0 +1,350 @@
+"""
+Build Scheduler - Bounded Worker Pool for PlatformIO Builds
+Runs builds and flashes on a fixed number of worker threads with a priority
+queue, queue-position reporting and cancellation. Jobs for the same project
+never run concurrently, since they share that project's build directory.
+"""
+
+import os
+import time
+import asyncio
+import uuid
+import signal
+import threading
+import concurrent.futures
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, AsyncIterator, Callable, List, Optional
+
+from metrics import registry
+
+class BuildQueueFull(Exception):
+    """The build queue is at capacity."""
+
+class BuildCancelled(Exception):
+    """The job was cancelled before it produced a result."""
+
+def kill_process_tree(process):
+    """
+    Kill a build subprocess and everything it spawned (pio -> scons -> gcc).
+    Processes started with start_new_session=True lead their own process
+    group; otherwise only the process itself is killed.
+    """
+    try:
+        if os.name == "posix" and os.getpgid(process.pid) == process.pid:
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (OSError, ProcessLookupError):
+        pass
+
+class CancelToken:
+    """
+    Cancellation handle passed to a running job. Builders attach their pio
+    subprocesses so cancel() can kill them mid-compile.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._processes: set = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def attach(self, process):
+        with self._lock:
+            self._processes.add(process)
+            if not self._event.is_set():
+                return
+        kill_process_tree(process)
+
+    def detach(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            processes = list(self._processes)
+        for process in processes:
+            kill_process_tree(process)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+@dataclass
+class BuildJob:
+    """One scheduled build/flash."""
+    job_id: str
+    project_id: str
+    kind: str
+    priority: int
+    seq: int
+    run: Callable[[CancelToken], Any]
+    status: str = QUEUED
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    token: CancelToken = field(default_factory=CancelToken)
+    future: concurrent.futures.Future = field(default_factory=concurrent.futures.Future)
+
+    def to_dict(self, position: int = 0) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "project_id": self.project_id,
+            "kind": self.kind,
+            "priority": self.priority,
+            "status": self.status,
+            "position": position,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+class BuildScheduler:
+    """
+    Priority queue (lower value first, FIFO within a level) drained by
+    max_workers threads. A worker skips jobs whose project is already
+    building, so different projects build in parallel while builds of the
+    same project are serialized.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int = 100, history: int = 200):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pending: List[BuildJob] = []
+        self._running: Dict[str, BuildJob] = {}  # project_id -> job
+        self._jobs: "OrderedDict[str, BuildJob]" = OrderedDict()
+        self._history = history
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._workers: List[threading.Thread] = []
+        print(f"[BuildScheduler] {self.max_workers} build workers, queue limit {self.max_queue}")
+
+    # ----- submission -----
+
+    def submit(self, run: Callable[[CancelToken], Any], project_id: str,
+               kind: str = "build", priority: int = 0) -> BuildJob:
+        """
+        Queue run(token) for a worker. Raises BuildQueueFull when full.
+        The job's future resolves to run's return value.
+        """
+        with self._cond:
+            if len(self._pending) >= self.max_queue:
+                raise BuildQueueFull(f"Build queue is full ({self.max_queue} waiting)")
+            self._seq += 1
+            job = BuildJob(
+                job_id=uuid.uuid4().hex[:12],
+                project_id=project_id,
+                kind=kind,
+                priority=priority,
+                seq=self._seq,
+                run=run
+            )
+            self._pending.append(job)
+            self._pending.sort(key=lambda j: (j.priority, j.seq))
+            self._remember(job)
+            self._ensure_workers()
+            self._cond.notify_all()
+        print(f"[BuildScheduler] Queued {kind} {job.job_id} for {project_id} (position {self.position(job)})")
+        return job
+
+    async def astream(self, run: Callable[[CancelToken], AsyncIterator[str]], project_id: str,
+                      kind: str = "flash", priority: int = 0, poll: float = 2.0) -> AsyncIterator[str]:
+        """
+        Schedule a streaming job and yield its output. run(token) returns an
+        async iterator that executes on the event loop; a worker thread only
+        holds the job's slot (keeping the pool bounded and per-project builds
+        serialized), so waiting clients and running log streams cost no
+        threadpool threads. While queued, yields a position line every `poll`
+        seconds. Closing this iterator (client went away) cancels the job.
+        """
+        loop = asyncio.get_running_loop()
+        started = asyncio.Event()
+        released = threading.Event()
+
+        def hold_slot(token: CancelToken):
+            loop.call_soon_threadsafe(started.set)
+            released.wait()
+
+        try:
+            job = self.submit(hold_slot, project_id, kind, priority)
+        except BuildQueueFull as e:
+            yield f"Error: {e}\n"
+            return
+
+        completed = False
+        try:
+            last_position = None
+            while not started.is_set():
+                try:
+                    await asyncio.wait_for(started.wait(), timeout=poll)
+                except asyncio.TimeoutError:
+                    if job.future.done():
+                        break  # Cancelled before it ever ran
+                    position = self.position(job)
+                    if position and position != last_position:
+                        yield f"Queued for build worker (position {position})...\n"
+                        last_position = position
+
+            if started.is_set():
+                async for chunk in run(job.token):
+                    yield chunk
+                    if job.token.cancelled:
+                        break
+            completed = True
+            if job.status == CANCELLED or job.token.cancelled:
+                yield "Build cancelled.\n"
+        finally:
+            if job.status == QUEUED:
+                self.cancel(job.job_id)
+            elif not completed:
+                # Client went away mid-build; record the job as cancelled
+                job.token.cancel()
+            released.set()
+
+    # ----- inspection / control -----
+
+    def get(self, job_id: str) -> Optional[BuildJob]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def position(self, job: BuildJob) -> int:
+        """1-based queue position, 0 once running or finished."""
+        with self._cond:
+            for index, pending in enumerate(self._pending, 1):
+                if pending is job:
+                    return index
+        return 0
+
+    def describe(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.get(job_id)
+        return job.to_dict(self.position(job)) if job else None
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job. Returns False if unknown or already finished."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in (QUEUED, RUNNING):
+                return False
+            if job.status == QUEUED:
+                self._pending.remove(job)
+                self._finish_locked(job, CANCELLED, error="Cancelled while queued")
+                self._settle(job, error=BuildCancelled(f"Build {job_id} cancelled"))
+                self._cond.notify_all()
+                print(f"[BuildScheduler] Cancelled queued {job.kind} {job_id}")
+                return True
+        # Running: kill its processes; the worker records the outcome
+        job.token.cancel()
+        print(f"[BuildScheduler] Cancelling running {job.kind} {job_id}")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "workers": self.max_workers,
+                "queued": len(self._pending),
+                "running": len(self._running),
+                "max_queue": self.max_queue,
+                "queue": [j.to_dict(i) for i, j in enumerate(self._pending, 1)],
+                "active": [j.to_dict() for j in self._running.values()],
+            }
+
+    # ----- internals -----
+
+    def _remember(self, job: BuildJob):
+        self._jobs[job.job_id] = job
+        while len(self._jobs) > self._history:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest.status in (QUEUED, RUNNING):
+                break
+            del self._jobs[oldest_id]
+
+    def _ensure_workers(self):
+        self._workers = [w for w in self._workers if w.is_alive()]
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._work, name=f"build-worker-{len(self._workers)}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def _next_job_locked(self) -> Optional[BuildJob]:
+        for job in self._pending:
+            if job.project_id not in self._running:
+                return job
+        return None
+
+    def _finish_locked(self, job: BuildJob, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+
+    @staticmethod
+    def _settle(job: BuildJob, result: Any = None, error: Optional[BaseException] = None):
+        # A waiter may have cancelled the future (asyncio.wrap_future propagates
+        # cancellation); that must not take the worker thread down with it
+        try:
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+        except concurrent.futures.InvalidStateError:
+            pass
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job_locked()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job_locked()
+                self._pending.remove(job)
+                self._running[job.project_id] = job
+                job.status = RUNNING
+                job.started_at = time.time()
+
+            print(f"[BuildScheduler] Running {job.kind} {job.job_id} for {job.project_id} "
+                  f"(waited {job.started_at - job.submitted_at:.1f}s)")
+            try:
+                result = job.run(job.token)
+                status, error = (CANCELLED, "Cancelled while running") if job.token.cancelled else (DONE, None)
+            except Exception as e:
+                result, status, error = None, FAILED, str(e)
+
+            with self._cond:
+                del self._running[job.project_id]
+                self._finish_locked(job, status, error)
+                self._cond.notify_all()
+
+            if status == DONE:
+                self._settle(job, result=result)
+            elif status == CANCELLED:
+                self._settle(job, error=BuildCancelled(f"Build {job.job_id} cancelled"))
+            else:
+                self._settle(job, error=RuntimeError(error))
+
+def _default_workers() -> int:
+    # pio/SCons already compiles with one job per core, so a few parallel
+    # builds saturate the machine; more only thrash the disk and RAM
+    return max(1, min(4, (os.cpu_count() or 2) // 2))
+
+build_scheduler = BuildScheduler(
+    max_workers=int(os.getenv("BUILD_WORKERS", str(_default_workers()))),
+    max_queue=int(os.getenv("BUILD_QUEUE_MAX", "100"))
+)
+
+def _collect_metrics():
+    stats = build_scheduler.stats()
+    return [
+        ("hardcore_build_queue_depth", "gauge", "Builds waiting for a worker", [({}, stats["queued"])]),
+        ("hardcore_build_workers_busy", "gauge", "Build workers currently running a job", [({}, stats["running"])]),
+    ]
+
+registry.register_collector(_collect_metrics)
@@ -0,0 +1,127 @@
+"""
+Code Patcher - SEARCH/REPLACE Edits for Existing Firmware
+Parses the edit blocks Gemini returns in edit mode, applies them to the
+current main.cpp (exact match first, then whitespace-tolerant) and checks
+the result is still structurally sound before it replaces the file.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import List, Tuple
+
+from context_packer import strip_literals
+
+_BLOCK_RE = re.compile(
+    r"^<{5,9} ?SEARCH[^\n]*\n(.*?)^={5,9}[ \t]*\n(.*?)^>{5,9} ?REPLACE[^\n]*$",
+    re.S | re.M
+)
+_ENTRY_POINTS = ("setup", "loop", "app_main")
+
+class PatchError(ValueError):
+    """An edit block could not be applied, or the result failed validation."""
+
+@dataclass
+class EditBlock:
+    search: str
+    replace: str
+
+def parse_edit_blocks(text: str) -> List[EditBlock]:
+    """All SEARCH/REPLACE blocks in a response, in order (empty if there are none)."""
+    return [EditBlock(search=m.group(1).rstrip("\n"), replace=m.group(2).rstrip("\n"))
+            for m in _BLOCK_RE.finditer(text or "")]
+
+def _trim_blank(lines: List[str]) -> List[str]:
+    start, end = 0, len(lines)
+    while start < end and not lines[start].strip():
+        start += 1
+    while end > start and not lines[end - 1].strip():
+        end -= 1
+    return lines[start:end]
+
+def _indent(line: str) -> str:
+    return line[:len(line) - len(line.lstrip())]
+
+def _find_lines(code_lines: List[str], search_lines: List[str], normalize) -> List[int]:
+    wanted = [normalize(line) for line in search_lines]
+    size = len(wanted)
+    return [i for i in range(len(code_lines) - size + 1)
+            if [normalize(line) for line in code_lines[i:i + size]] == wanted]
+
+def apply_edit(code: str, block: EditBlock) -> str:
+    """Apply one block; raises PatchError if SEARCH is missing or ambiguous."""
+    if not block.search.strip():
+        raise PatchError("Empty SEARCH section")
+
+    # 1. Exact text
+    occurrences = code.count(block.search)
+    if occurrences == 1:
+        return code.replace(block.search, block.replace, 1)
+    if occurrences > 1:
+        raise PatchError(f"SEARCH matches {occurrences} places: {block.search.splitlines()[0].strip()!r}")
+
+    # 2./3. Line by line, ignoring trailing whitespace, then indentation
+    code_lines = code.split("\n")
+    search_lines = _trim_blank(block.search.split("\n"))
+    replace_lines = _trim_blank(block.replace.split("\n"))
+    for normalize in (str.rstrip, str.strip):
+        matches = _find_lines(code_lines, search_lines, normalize)
+        if len(matches) > 1:
+            raise PatchError(f"SEARCH matches {len(matches)} places: {search_lines[0].strip()!r}")
+        if matches:
+            start = matches[0]
+            # Shift the replacement by however much the file's indentation differs from SEARCH's
+            have, given = _indent(code_lines[start]), _indent(search_lines[0])
+            if have != given:
+                replace_lines = [_reindent(line, given, have) for line in replace_lines]
+            return "\n".join(code_lines[:start] + replace_lines + code_lines[start + len(search_lines):])
+
+    raise PatchError(f"SEARCH not found: {search_lines[0].strip()!r}")
+
+def _reindent(line: str, old: str, new: str) -> str:
+    if not line.strip():
+        return line
+    if line.startswith(old):
+        return new + line[len(old):]
+    return line
+
+def _balance(code: str) -> Tuple[int, int]:
+    """(brace depth, paren depth) at the end of code; -1 if either ever went negative."""
+    braces = parens = 0
+    in_comment = False
+    for line in code.split("\n"):
+        stripped, in_comment = strip_literals(line, in_comment)
+        for ch in stripped:
+            braces += (ch == "{") - (ch == "}")
+            parens += (ch == "(") - (ch == ")")
+            if braces < 0 or parens < 0:
+                return -1, -1
+    return braces, parens
+
+def _defines(code: str, name: str) -> bool:
+    return re.search(rf"\b{name}\s*\([^;{{]*\)\s*\{{", code) is not None
+
+def validate_patched(original: str, patched: str, min_length: int = 50):
+    """Raise PatchError unless braces/parens still balance and no entry point was lost."""
+    if len(patched.strip()) < min_length:
+        raise PatchError("Patched code is empty or too short")
+    braces, parens = _balance(patched)
+    if (braces, parens) != (0, 0) and _balance(original) == (0, 0):
+        raise PatchError("Patched code has unbalanced braces or parentheses")
+    lost = [name for name in _ENTRY_POINTS if _defines(original, name) and not _defines(patched, name)]
+    if lost:
+        raise PatchError(f"Patch removed {', '.join(f'{n}()' for n in lost)}")
+
+def apply_edits(code: str, blocks: List[EditBlock]) -> str:
+    """Apply every block in order, then validate; all or nothing."""
+    if not blocks:
+        raise PatchError("No SEARCH/REPLACE blocks in response")
+    patched = code
+    for number, block in enumerate(blocks, 1):
+        try:
+            patched = apply_edit(patched, block)
+        except PatchError as e:
+            raise PatchError(f"Block {number}/{len(blocks)}: {e}")
+    if patched == code:
+        raise PatchError("Edit blocks did not change the code")
+    validate_patched(code, patched)
+    return patched
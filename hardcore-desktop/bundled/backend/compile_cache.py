@@ -0,0 +1,205 @@
+"""
+Compile Cache - Shared Object Cache Across Projects
+Points every generated platformio.ini at a shared SCons build_cache_dir per
+board and framework version, so the Arduino core is compiled once per board
+instead of once per project. Includes a pre-warm step and hit statistics.
+
+Usage:
+    python compile_cache.py --prewarm            # every board in board_definitions.json
+    python compile_cache.py --prewarm esp32 arduino_uno
+    python compile_cache.py --stats
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from metrics import registry, CACHE_REQUESTS
+
+# SCons prints one of these per object file; pio shortens compiles to "Compiling <obj>"
+_RETRIEVED_RE = re.compile(r"^Retrieved `[^']+' from cache", re.MULTILINE)
+_COMPILED_RE = re.compile(r"^Compiling \S+", re.MULTILINE)
+
+PREWARM_SKETCH = """#include <Arduino.h>
+
+void setup() {}
+
+void loop() {}
+"""
+PREWARM_MARKER = ".prewarmed"
+
+def _enabled() -> bool:
+    return os.getenv("COMPILE_CACHE_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+
+def cache_root() -> Path:
+    default_path = Path(__file__).parent.parent / "cache" / "compile"
+    return Path(os.getenv("COMPILE_CACHE_PATH", str(default_path)))
+
+def platform_version(platform: str) -> str:
+    """Installed version of a PlatformIO dev-platform (bundles the framework), or "unknown"."""
+    core_dir = Path(os.getenv("PLATFORMIO_CORE_DIR", str(Path.home() / ".platformio")))
+    manifest = core_dir / "platforms" / platform / "platform.json"
+    try:
+        return json.loads(manifest.read_text(encoding="utf-8")).get("version", "unknown")
+    except (OSError, ValueError):
+        return "unknown"
+
+def cache_dir_for(platform: str, board: str, framework: str) -> Path:
+    """Shared object cache directory for one board/framework/platform version."""
+    name = f"{platform}-{platform_version(platform)}-{board}-{framework}"
+    return cache_root() / re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+def platformio_section(platform: str, board: str, framework: str) -> str:
+    """[platformio] block for platformio.ini, or "" when the cache is disabled."""
+    if not _enabled():
+        return ""
+    # Forward slashes keep the path valid in the ini on Windows too
+    return f"[platformio]\nbuild_cache_dir = {cache_dir_for(platform, board, framework).as_posix()}\n\n"
+
+class CompileCacheStats:
+    """Object-level hit/miss counts parsed from pio run output."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self._lock = threading.Lock()
+
+    def record_build_output(self, output: str) -> Dict[str, int]:
+        hits = len(_RETRIEVED_RE.findall(output or ""))
+        misses = len(_COMPILED_RE.findall(output or ""))
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.builds += 1
+        if hits:
+            CACHE_REQUESTS.inc(hits, cache="compile", result="hit")
+        if misses:
+            CACHE_REQUESTS.inc(misses, cache="compile", result="miss")
+        return {"objects_from_cache": hits, "objects_compiled": misses}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "builds": self.builds,
+                "objects_from_cache": self.hits,
+                "objects_compiled": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+compile_stats = CompileCacheStats()
+
+def record_build_output(output: str) -> Dict[str, int]:
+    return compile_stats.record_build_output(output)
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+def stats() -> Dict[str, Any]:
+    """Hit counts since start plus per-board cache directory sizes."""
+    root = cache_root()
+    boards = []
+    if root.is_dir():
+        for entry in sorted(root.iterdir()):
+            if entry.is_dir():
+                boards.append({
+                    "name": entry.name,
+                    "bytes": _dir_size(entry),
+                    "prewarmed": (entry / PREWARM_MARKER).is_file(),
+                })
+    return {
+        "enabled": _enabled(),
+        "path": str(root),
+        **compile_stats.snapshot(),
+        "boards": boards,
+    }
+
+def is_prewarmed(builder, board_type: str) -> bool:
+    conf = builder.board_platformio_config(board_type)
+    return (cache_dir_for(conf["platform"], conf["board"], conf["framework"]) / PREWARM_MARKER).is_file()
+
+def prewarm_board(board_type: str, builder=None, cancel_token=None, timeout: float = 600) -> Dict[str, Any]:
+    """Compile an empty sketch for one board so its core objects land in the shared cache."""
+    from platformio_builder import PlatformIOBuilder
+
+    builder = builder or PlatformIOBuilder()
+    conf = builder.board_platformio_config(board_type)
+    cache_dir = cache_dir_for(conf["platform"], conf["board"], conf["framework"])
+
+    print(f"[CompileCache] Pre-warming {board_type} ({conf['platform']}/{conf['board']})")
+    start = time.time()
+    project_dir = builder._project_dir(f"_prewarm_{board_type}")
+    builder._prepare_project(project_dir, PREWARM_SKETCH, board_type, clean=True)
+    # Skip the artifact cache: a restored firmware.bin would not fill the object cache
+    result = builder._compile(project_dir, cancel_token, use_artifact_cache=False, timeout=timeout)
+    elapsed = round(time.time() - start, 1)
+    # The objects are in the shared cache now; the project itself is throwaway
+    shutil.rmtree(project_dir, ignore_errors=True)
+
+    if result.get("success"):
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        (cache_dir / PREWARM_MARKER).write_text(json.dumps({"prewarmed_at": time.time(), "seconds": elapsed}),
+                                                encoding="utf-8")
+        outcome = {"status": "prewarmed", "seconds": elapsed, "cache_dir": str(cache_dir)}
+    else:
+        error = result.get("error") or (result.get("stderr") or "").strip()[-500:]
+        outcome = {"status": "failed", "seconds": elapsed, "error": error}
+    print(f"[CompileCache] {board_type}: {outcome['status']} in {elapsed}s")
+    return outcome
+
+def prewarm(board_types: Optional[List[str]] = None, force: bool = False, builder=None) -> Dict[str, Any]:
+    """
+    Pre-warm each board (default: all in board_definitions.json). Boards
+    already pre-warmed for the installed platform version are skipped
+    unless force is set.
+    """
+    from platformio_builder import PlatformIOBuilder
+    from toolchain_registry import board_definitions
+
+    if not _enabled():
+        return {"enabled": False, "boards": {}}
+
+    builder = builder or PlatformIOBuilder()
+    definitions = board_definitions.boards()
+    results: Dict[str, Any] = {}
+
+    for board_type in board_types or list(definitions):
+        if board_type not in definitions:
+            results[board_type] = {"status": "unknown_board"}
+        elif is_prewarmed(builder, board_type) and not force:
+            results[board_type] = {"status": "cached"}
+        else:
+            results[board_type] = prewarm_board(board_type, builder)
+
+    return {"enabled": True, "boards": results}
+
+def _collect_metrics():
+    snapshot = compile_stats.snapshot()
+    return [
+        ("hardcore_compile_cache_hit_ratio", "gauge", "Object files restored from the shared compile cache / objects built",
+         [({}, snapshot["hit_rate"])]),
+    ]
+
+registry.register_collector(_collect_metrics)
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared PlatformIO compile cache")
+    parser.add_argument("--prewarm", nargs="*", metavar="BOARD", help="Pre-warm these boards (default: all)")
+    parser.add_argument("--force", action="store_true", help="Rebuild boards that are already pre-warmed")
+    parser.add_argument("--stats", action="store_true")
+    args = parser.parse_args()
+
+    if args.prewarm is not None:
+        print(json.dumps(prewarm(args.prewarm or None, force=args.force), indent=2))
+    if args.stats or args.prewarm is None:
+        print(json.dumps(stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
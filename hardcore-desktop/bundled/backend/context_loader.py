@@ -4,12 +4,21 @@ Loads existing project files, conversation history, and board specifications
 to provide the AI with full context for intelligent firmware generation.
 """
 
+import os
 import json
 import re
+import threading
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Callable, List, Optional, Tuple
 from dataclasses import dataclass, field
 
+from metrics import registry
+from history_store import HistoryStore, get_history_store
+from conversation_state import get_conversation_store
+
+# History entries handed to the AI as context
+HISTORY_CONTEXT_ENTRIES = int(os.getenv("HISTORY_CONTEXT_ENTRIES", "10"))
+
 @dataclass
 class ProjectContext:
     """Complete project context for AI reasoning."""
@@ -44,6 +53,80 @@ class ProjectContext:
             }
         }
 
+class ParsedFileCache:
+    """
+    Parsed project files keyed by path, valid while the file's (mtime, size)
+    is unchanged. Module-level so every ProjectContextLoader in the process
+    (main.py's and each StrictGeminiEngine's) shares it. Values are treated
+    as read-only; load() hands out copies.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Path, Tuple[Tuple[int, int], Any]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(path: Path) -> Optional[Tuple[int, int]]:
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path: Path, parse: Callable[[Path], Any]) -> Any:
+        """Cached parse(path), re-parsed only when the file changed. None if it does not exist."""
+        signature = self._signature(path)
+        if signature is None:
+            self.discard(path)
+            return None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry[0] == signature:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = parse(path)
+        with self._lock:
+            self._entries[path] = (signature, value)
+        return value
+
+    def put(self, path: Path, value: Any):
+        """Record what was just written, so a write within the mtime granularity is not missed."""
+        signature = self._signature(path)
+        with self._lock:
+            if signature is None:
+                self._entries.pop(path, None)
+            else:
+                self._entries[path] = (signature, value)
+
+    def discard(self, path: Path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = len(self._entries)
+        total = self.hits + self.misses
+        return {"entries": entries, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+parsed_file_cache = ParsedFileCache()
+
+def _collect_metrics():
+    stats = parsed_file_cache.stats()
+    return [
+        ("hardcore_context_cache_hit_ratio", "gauge", "Project file loads served without re-reading/re-parsing",
+         [({}, stats["hit_rate"])]),
+    ]
+
+registry.register_collector(_collect_metrics)
+
 class ProjectContextLoader:
     """
     Loads all relevant project context for AI reasoning.
@@ -55,6 +138,11 @@ class ProjectContextLoader:
             workspace_root = Path(__file__).parent.parent / "workspace"
         self.workspace_root = workspace_root
         print(f"[ContextLoader] Initialized with workspace: {self.workspace_root}")
+
+    @property
+    def history_store(self) -> HistoryStore:
+        # Opened on first use so constructing a loader never touches the disk
+        return get_history_store(self.workspace_root)
     
     def load(self, project_id: str = "current_project") -> ProjectContext:
         """
@@ -73,97 +161,92 @@ class ProjectContextLoader:
         context = ProjectContext(project_path=project_path)
         
         # Load existing code if present
+        # Each file is re-read and re-parsed only when its mtime/size changed
         main_cpp = project_path / "src" / "main.cpp"
-        if main_cpp.exists():
+        parsed_code = parsed_file_cache.get(main_cpp, self._parse_code)
+        if parsed_code is not None:
             print(f"[ContextLoader] Found existing main.cpp")
-            context.existing_code = self._load_file(main_cpp)
-            context.existing_pins = self._extract_pins_from_code(context.existing_code)
+            context.existing_code = parsed_code["code"]
+            context.existing_pins = dict(parsed_code["pins"])
             print(f"[ContextLoader] Extracted {len(context.existing_pins)} pin definitions")
         
         # Load PlatformIO config to detect board
         pio_ini = project_path / "platformio.ini"
-        if pio_ini.exists():
+        parsed_config = parsed_file_cache.get(pio_ini, self._parse_config)
+        if parsed_config is not None:
             print(f"[ContextLoader] Found platformio.ini")
-            context.platformio_config = self._load_file(pio_ini)
-            context.board_type = self._detect_board_from_config(context.platformio_config)
+            context.platformio_config = parsed_config["config"]
+            context.board_type = parsed_config["board_type"]
         
-        # Load conversation history
-        history_file = project_path / ".hardcore_history.json"
-        if history_file.exists():
-            context.conversation_history = self._load_history(history_file)
+        # Load conversation history (last N entries, indexed query)
+        self.history_store.migrate_legacy(project_id, project_path / ".hardcore_history.json")
+        context.conversation_history = self.history_store.recent(project_id, HISTORY_CONTEXT_ENTRIES)
+        if context.conversation_history:
             print(f"[ContextLoader] Loaded {len(context.conversation_history)} history entries")
             
-        # Load conversation state (with Auto-Expiry)
-        state_file = project_path / ".hardcore_state.json"
-        if state_file.exists():
-            state = self._load_state(state_file)
-            
-            # Check for expiry (1 hour)
-            is_expired = False
-            updated_at_str = state.get("updated_at")
-            if updated_at_str:
-                from datetime import datetime, timedelta
-                try:
-                    last_update = datetime.fromisoformat(updated_at_str)
-                    if datetime.now() - last_update > timedelta(hours=1):
-                        is_expired = True
-                        print(f"[ContextLoader] State EXPIRED (Last update: {updated_at_str}). Resetting.")
-                except Exception as e:
-                    print(f"[ContextLoader] Date parse error: {e}")
-            
-            if not is_expired:
-                # Backward compatibility: old snapshots used "AWAITING_CLARIFICATION"
-                # which we now normalize to "NEEDS_CLARIFICATION".
-                raw_state = state.get("conversation_state", "IDLE")
-                if raw_state == "AWAITING_CLARIFICATION":
-                    raw_state = "NEEDS_CLARIFICATION"
-
-                context.conversation_state = raw_state
-                context.last_ai_message_type = state.get("last_ai_message_type", "FINAL_OUTPUT")
-                context.pending_request = state.get("pending_request")
-                print(f"[ContextLoader] Loaded state: {context.conversation_state}")
-            else:
-                # Force reset in memory (file remains until next save overwrites it)
-                context.conversation_state = "IDLE"
-                context.pending_request = None
+        # Load conversation state (shared with /chat; stale state expires by the store's idle TTL)
+        self._migrate_state_file(project_id, project_path / ".hardcore_state.json")
+        state = get_conversation_store().get(project_id)
+        # Backward compatibility: old snapshots used "AWAITING_CLARIFICATION"
+        # which we now normalize to "NEEDS_CLARIFICATION".
+        raw_state = state.get("conversation_state", "IDLE")
+        if raw_state == "AWAITING_CLARIFICATION":
+            raw_state = "NEEDS_CLARIFICATION"
+        context.conversation_state = raw_state
+        context.last_ai_message_type = state.get("last_ai_message_type", "FINAL_OUTPUT")
+        context.pending_request = state.get("pending_request")
+        print(f"[ContextLoader] Loaded state: {context.conversation_state}")
         
         # Extract components from existing code
         if context.existing_code:
-            context.components = self._detect_components(context.existing_code)
+            context.components = list(parsed_code["components"])
             print(f"[ContextLoader] Detected components: {context.components}")
         
         print(f"[ContextLoader] Context loaded successfully")
         return context
     
     def save_state(self, project_id: str, context: ProjectContext):
-        """Save conversation state."""
-        project_path = self.workspace_root / project_id
-        project_path.mkdir(parents=True, exist_ok=True)
-        
-        state_file = project_path / ".hardcore_state.json"
+        """Save conversation state to the shared conversation-state store."""
+        get_conversation_store().update(
+            project_id,
+            conversation_state=context.conversation_state,
+            last_ai_message_type=context.last_ai_message_type,
+            pending_request=context.pending_request
+        )
+
+    def _migrate_state_file(self, project_id: str, state_file: Path):
+        """Move a pre-store .hardcore_state.json into the store (unless expired) and rename it."""
+        if not state_file.exists():
+            return
+        state = self._load_state(state_file)
         
-        state_data = {
-            "conversation_state": context.conversation_state,
-            "last_ai_message_type": context.last_ai_message_type,
-            "pending_request": context.pending_request,
-            "updated_at": self._get_timestamp()
-        }
+        # Check for expiry (1 hour)
+        is_expired = False
+        updated_at_str = state.get("updated_at")
+        if updated_at_str:
+            from datetime import datetime, timedelta
+            try:
+                last_update = datetime.fromisoformat(updated_at_str)
+                if datetime.now() - last_update > timedelta(hours=1):
+                    is_expired = True
+                    print(f"[ContextLoader] State EXPIRED (Last update: {updated_at_str}). Not migrating.")
+            except Exception as e:
+                print(f"[ContextLoader] Date parse error: {e}")
         
-        with open(state_file, 'w') as f:
-            json.dump(state_data, f, indent=2)
+        if state and not is_expired:
+            get_conversation_store().update(
+                project_id,
+                conversation_state=state.get("conversation_state", "IDLE"),
+                last_ai_message_type=state.get("last_ai_message_type", "FINAL_OUTPUT"),
+                pending_request=state.get("pending_request")
+            )
+        try:
+            state_file.rename(state_file.with_name(state_file.name + ".migrated"))
+        except OSError as e:
+            print(f"[ContextLoader] Warning: Could not rename {state_file}: {e}")
 
     def save_history(self, project_id: str, user_prompt: str, ai_response: Dict[str, Any]):
-        """Save interaction to conversation history with detailed context."""
-        project_path = self.workspace_root / project_id
-        project_path.mkdir(parents=True, exist_ok=True)
-        
-        history_file = project_path / ".hardcore_history.json"
-        
-        # Load existing history
-        history = []
-        if history_file.exists():
-            history = self._load_history(history_file)
-        
+        """Append an interaction to the project's conversation history."""
         # Extract action/summary from response
         action = "firmware_generated"
         if "code" in ai_response:
@@ -178,8 +261,8 @@ class ProjectContextLoader:
             elif "sensor" in code.lower():
                 action = "sensor_reading"
         
-        # Add new entry with more detail
-        history.append({
+        # Single indexed INSERT; the store applies the retention window
+        self.history_store.append(project_id, {
             "timestamp": self._get_timestamp(),
             "user_prompt": user_prompt,
             "action": action,
@@ -187,13 +270,6 @@ class ProjectContextLoader:
             "board": ai_response.get("pin_json", {}).get("mcu", "unknown"),
             "components": [conn.get("component") for conn in ai_response.get("pin_json", {}).get("connections", [])]
         })
-        
-        # Keep only last 10 entries for context
-        history = history[-10:]
-        
-        # Save
-        with open(history_file, 'w') as f:
-            json.dump(history, f, indent=2)
     
     def _load_file(self, path: Path) -> str:
         """Safely load a text file."""
@@ -203,6 +279,18 @@ class ProjectContextLoader:
             print(f"[ContextLoader] Warning: Could not load {path}: {e}")
             return ""
     
+    def _parse_code(self, path: Path) -> Dict[str, Any]:
+        code = self._load_file(path)
+        return {
+            "code": code,
+            "pins": self._extract_pins_from_code(code),
+            "components": self._detect_components(code) if code else [],
+        }
+
+    def _parse_config(self, path: Path) -> Dict[str, Any]:
+        config = self._load_file(path)
+        return {"config": config, "board_type": self._detect_board_from_config(config)}
+
     def _extract_pins_from_code(self, code: str) -> Dict[str, int]:
         """
         Extract all pin definitions from code.
@@ -239,15 +327,6 @@ class ProjectContextLoader:
             return board
         return 'unknown'  # default
     
-    def _load_history(self, history_file: Path) -> List[Dict[str, str]]:
-        """Load conversation history from JSON."""
-        try:
-            with open(history_file, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"[ContextLoader] Warning: Could not load history: {e}")
-            return []
-
     def _load_state(self, state_file: Path) -> Dict[str, Any]:
         """Load conversation state from JSON."""
         try:
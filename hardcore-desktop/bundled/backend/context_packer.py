@@ -0,0 +1,299 @@
+"""
+Context Packer - Relevance-Ranked Code Excerpts for the Prompt
+Splits the project's existing firmware into top-level blocks, scores them
+against the user request (keywords, pins, components) and packs the best
+ones into a token budget, instead of sending the first 800 characters.
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Set
+
+# ~4 characters per token, the same estimate the rate limiter uses
+CHARS_PER_TOKEN = 4
+CODE_TOKEN_BUDGET = int(os.getenv("CONTEXT_CODE_TOKEN_BUDGET", "700"))
+# Share of the budget kept for the list of omitted definitions
+OUTLINE_SHARE = 0.2
+MAX_PINS = int(os.getenv("CONTEXT_MAX_PINS", "12"))
+
+_STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "then", "than", "when", "from", "into", "make",
+    "add", "use", "using", "please", "can", "should", "want", "also", "code", "firmware", "change",
+    "update", "set", "get", "new", "now", "every", "after", "before", "more", "less", "its", "are",
+    "void", "int", "const", "return", "include", "define",
+}
+# Same families ContextLoader._detect_components reports
+_COMPONENT_WORDS = {
+    "servo": ("servo",),
+    "motor": ("motor", "pwm", "l298", "l293", "drv8833"),
+    "led": ("led", "digitalwrite", "blink"),
+    "sensor": ("sensor", "analogread", "adc"),
+    "i2c_device": ("wire", "i2c", "sda", "scl"),
+}
+# Structural entry points the model needs even when nothing else matches
+_ANCHORS = {"setup": 3.0, "loop": 3.0, "app_main": 3.0, "main": 2.0}
+
+_FUNCTION_RE = re.compile(r"([A-Za-z_]\w*)\s*\([^;{]*\)\s*(?:const\s*)?(?:override\s*)?\{?\s*$")
+_TYPE_RE = re.compile(r"\b(class|struct|enum|union|namespace)\s+(?:class\s+)?([A-Za-z_]\w*)")
+_WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+
+@dataclass
+class CodeBlock:
+    """A top-level function/type definition or a run of global lines."""
+    kind: str  # "preamble", "globals", "function", "type"
+    name: str
+    text: str
+    start_line: int
+    end_line: int
+    score: float = 0.0
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+    @property
+    def signature(self) -> str:
+        header = self.text.split("{", 1)[0]
+        return " ".join(header.split())
+
+@dataclass
+class PackedContext:
+    code: str
+    pins: Dict[str, int] = field(default_factory=dict)
+    included: List[str] = field(default_factory=list)
+    omitted: List[str] = field(default_factory=list)
+    tokens: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"included": self.included, "omitted": self.omitted, "tokens": self.tokens}
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def strip_literals(line: str, in_comment: bool):
+    """Line with comments and string/char literals blanked out, for brace counting."""
+    out = []
+    i = 0
+    while i < len(line):
+        if in_comment:
+            end = line.find("*/", i)
+            if end < 0:
+                return "".join(out), True
+            i = end + 2
+            in_comment = False
+            continue
+        ch = line[i]
+        if line.startswith("//", i):
+            break
+        if line.startswith("/*", i):
+            in_comment = True
+            i += 2
+            continue
+        if ch in "\"'":
+            end = i + 1
+            while end < len(line) and line[end] != ch:
+                end += 2 if line[end] == "\\" else 1
+            i = end + 1
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out), in_comment
+
+def _block_identity(header: str):
+    match = _TYPE_RE.search(header)
+    if match:
+        return "type", match.group(2)
+    match = _FUNCTION_RE.search(header.split("{", 1)[0].rstrip() + " {")
+    if match:
+        return "function", match.group(1)
+    return "globals", "globals"
+
+def split_blocks(code: str) -> List[CodeBlock]:
+    """
+    Top-level blocks in source order. Braces are matched with comments and
+    literals ignored; a signature on the line(s) before an Allman-style "{"
+    stays with its body. Preprocessor/global lines between definitions are
+    grouped into "preamble" (before the first definition) or "globals".
+    """
+    lines = code.splitlines()
+    blocks: List[CodeBlock] = []
+    loose: List[int] = []  # Line numbers of the pending run of top-level lines
+    depth = 0
+    in_comment = False
+    block_start: Optional[int] = None
+
+    def flush_loose(upto: Optional[int] = None):
+        nonlocal loose
+        keep = [n for n in loose if upto is None or n < upto]
+        if keep and any(lines[n].strip() for n in keep):
+            kind = "preamble" if not blocks else "globals"
+            blocks.append(CodeBlock(kind, kind, "\n".join(lines[n] for n in keep), keep[0] + 1, keep[-1] + 1))
+        loose = [n for n in loose if upto is not None and n >= upto]
+
+    def signature_start(n: int) -> int:
+        # Pull the signature (and doc comment) preceding a bare "{" into the block
+        start = n
+        while start - 1 in loose and lines[start - 1].strip() and not lines[start - 1].lstrip().startswith("#") \
+                and not lines[start - 1].rstrip().endswith(";"):
+            start -= 1
+        return start
+
+    for n, line in enumerate(lines):
+        stripped, in_comment = strip_literals(line, in_comment)
+        opens, closes = stripped.count("{"), stripped.count("}")
+        if depth == 0 and block_start is None:
+            if opens > closes:
+                start = signature_start(n)
+                flush_loose(upto=start)
+                loose = []
+                block_start = start
+            elif opens and opens == closes and not line.lstrip().startswith("#"):
+                # One-line definition ("int twice(int x) { return 2 * x; }", "struct P { int x; };")
+                start = signature_start(n) if stripped.lstrip().startswith("{") else n
+                text = "\n".join(lines[start:n + 1])
+                kind, name = _block_identity(text)
+                # "=" outside parentheses before the brace: an initializer ("struct P p = {1, 2};")
+                header = re.sub(r"\([^()]*\)", "", strip_literals(text.split("{", 1)[0], False)[0])
+                if kind == "globals" or "=" in header:
+                    loose.append(n)
+                else:
+                    flush_loose(upto=start)
+                    loose = []
+                    blocks.append(CodeBlock(kind, name, text, start + 1, n + 1))
+            else:
+                loose.append(n)
+        depth = max(0, depth + opens - closes)
+        if block_start is not None and depth == 0:
+            text = "\n".join(lines[block_start:n + 1])
+            kind, name = _block_identity(text)
+            blocks.append(CodeBlock(kind, name, text, block_start + 1, n + 1))
+            block_start = None
+
+    if block_start is not None:
+        # Unbalanced braces: keep the rest as one block rather than dropping it
+        text = "\n".join(lines[block_start:])
+        kind, name = _block_identity(text)
+        blocks.append(CodeBlock(kind, name, text, block_start + 1, len(lines)))
+    flush_loose()
+    return blocks
+
+def _identifier_words(text: str) -> Set[str]:
+    """Identifiers and their camelCase/snake_case parts, lowercased."""
+    words: Set[str] = set()
+    for token in _WORD_RE.findall(text):
+        words.add(token.lower())
+        for part in re.findall(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+", token):
+            words.add(part.lower())
+    return words
+
+def request_terms(request: str) -> Set[str]:
+    return {w for w in _identifier_words(request) if (len(w) >= 3 or w.isdigit()) and w not in _STOPWORDS}
+
+def score_block(block: CodeBlock, terms: Set[str], pins: Dict[str, int], components: List[str]) -> float:
+    words = _identifier_words(block.text)
+    name_words = _identifier_words(block.name)
+    score = _ANCHORS.get(block.name, 0.0) if block.kind == "function" else 0.0
+    if block.kind == "preamble":
+        score += 4.0  # includes/defines/pin constants: small and always needed
+
+    # Bare numbers only count through pins ("pin 13"), they match too much code otherwise
+    keywords = {t for t in terms if not t.isdigit()}
+    score += 2.0 * len(keywords & name_words)
+    score += 1.0 * len((keywords & words) - name_words)
+
+    for pin_name, number in pins.items():
+        if pin_name.lower() in words:
+            mentioned = pin_name.lower() in terms or str(number) in terms
+            score += 1.5 if mentioned else 0.25
+
+    for component in components:
+        keywords = _COMPONENT_WORDS.get(component, (component,))
+        if any(k in terms for k in keywords) and any(k in words for k in keywords):
+            score += 1.5
+
+    # Prefer dense matches: a huge block should not win on size alone
+    return score / (1.0 + block.tokens / 400.0)
+
+def pack_context(code: str, request: str, pins: Optional[Dict[str, int]] = None,
+                 components: Optional[List[str]] = None, budget: Optional[int] = None) -> PackedContext:
+    """
+    The most relevant blocks of `code` within `budget` tokens, in source
+    order, with "..." markers where blocks were left out and a list of the
+    omitted definitions so the model knows they exist and keeps them.
+    """
+    pins = pins or {}
+    components = components or []
+    budget = budget or CODE_TOKEN_BUDGET
+    terms = request_terms(request)
+
+    if estimate_tokens(code) <= budget:
+        return PackedContext(code=code, pins=_rank_pins(pins, code, terms), included=["<all>"],
+                             tokens=estimate_tokens(code))
+
+    blocks = split_blocks(code)
+    for block in blocks:
+        block.score = score_block(block, terms, pins, components)
+
+    code_budget = int(budget * (1 - OUTLINE_SHARE))
+    chosen: List[CodeBlock] = []
+    used = 0
+    for block in sorted(blocks, key=lambda b: b.score, reverse=True):
+        if block.score <= 0 and chosen:
+            break
+        if used + block.tokens <= code_budget:
+            chosen.append(block)
+            used += block.tokens
+
+    if not chosen and blocks:
+        # Nothing fits whole: cut the best block down to the budget
+        best = max(blocks, key=lambda b: b.score)
+        chosen = [CodeBlock(best.kind, best.name, best.text[:code_budget * CHARS_PER_TOKEN] + "\n// ... (truncated)",
+                            best.start_line, best.end_line, best.score)]
+        used = chosen[0].tokens
+
+    chosen.sort(key=lambda b: b.start_line)
+    omitted = [b for b in blocks if all(b.start_line != c.start_line for c in chosen)]
+    parts: List[str] = []
+    previous_end = 0
+    for block in chosen + [None]:
+        start = block.start_line if block else float("inf")
+        skipped = [b for b in omitted if previous_end < b.start_line < start]
+        if skipped:
+            parts.append(f"// ... (lines {skipped[0].start_line}-{skipped[-1].end_line} omitted)")
+        if block:
+            parts.append(block.text)
+            previous_end = block.end_line
+
+    outline_budget = budget - used
+    definitions = [b.signature for b in omitted if b.kind in ("function", "type")]
+    if definitions:
+        outline = ["// Also defined (unchanged unless the request needs them):"]
+        for shown, definition in enumerate(definitions):
+            line = f"//   {definition}"
+            if estimate_tokens("\n".join(outline + [line])) > outline_budget:
+                outline.append(f"//   ... and {len(definitions) - shown} more")
+                break
+            outline.append(line)
+        parts.append("\n".join(outline))
+
+    packed = "\n".join(parts)
+    selected_text = "\n".join(b.text for b in chosen)
+    return PackedContext(
+        code=packed,
+        pins=_rank_pins(pins, selected_text, terms),
+        included=[b.name for b in chosen],
+        omitted=[b.name for b in omitted],
+        tokens=estimate_tokens(packed)
+    )
+
+def _rank_pins(pins: Dict[str, int], text: str, terms: Set[str]) -> Dict[str, int]:
+    """Pins named in the request first, then pins used by the packed code, capped at MAX_PINS."""
+    words = _identifier_words(text)
+
+    def rank(item):
+        name, number = item
+        return (name.lower() in terms or str(number) in terms, name.lower() in words)
+
+    ranked = sorted(pins.items(), key=rank, reverse=True)
+    return dict(ranked[:MAX_PINS])
@@ -0,0 +1,315 @@
+"""
+Conversation State - Bounded Per-Project Chat State
+One store for the /chat state machine and ContextLoader's saved state, with
+LRU + idle-TTL eviction and pluggable backends: in-memory, SQLite (shared by
+every uvicorn worker on the machine) or a Redis-compatible server.
+"""
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Callable, Optional
+
+from metrics import registry
+
+try:
+    import redis
+except ImportError:  # Only needed for CONVERSATION_STATE_BACKEND=redis
+    redis = None
+
+# Idle time after which a project's state is dropped (the old .hardcore_state.json expired after 1 hour)
+STATE_TTL = float(os.getenv("CONVERSATION_STATE_TTL", "3600"))
+MAX_PROJECTS = int(os.getenv("CONVERSATION_STATE_MAX_PROJECTS", "1000"))
+
+def default_state() -> Dict[str, Any]:
+    return {
+        # /chat state machine
+        "state": "IDLE",  # IDLE, CLARIFYING, READY, GENERATING
+        "pending_request": None,  # Original build request
+        "board": None,
+        "driver": None,
+        "pins": {},
+        "behavior": None,
+        "last_question": None,
+        # ProjectContext lifecycle (ContextLoader.save_state)
+        "conversation_state": "IDLE",
+        "last_ai_message_type": "FINAL_OUTPUT",
+    }
+
+Updater = Callable[[Optional[Dict[str, Any]]], Dict[str, Any]]
+
+class MemoryStateBackend:
+    """OrderedDict in least-recently-used order; per process, lost on restart."""
+
+    name = "memory"
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._get_locked(key)
+
+    def update(self, key: str, updater: Updater) -> Dict[str, Any]:
+        with self._lock:
+            value = updater(self._get_locked(key))
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            self._evict_locked()
+            return value
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _get_locked(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > self.ttl:
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries[key] = (time.time(), entry[1])
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _evict_locked(self):
+        # Oldest access first, so expired entries are all at the front
+        cutoff = time.time() - self.ttl
+        while self._entries:
+            key, (accessed, _) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and accessed >= cutoff:
+                break
+            del self._entries[key]
+            self.evictions += 1
+
+class SQLiteStateBackend:
+    """
+    One row per project. update() is a BEGIN IMMEDIATE read-modify-write, so
+    uvicorn workers sharing the file never interleave partial updates.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, db_path: Path, ttl: float, max_entries: int):
+        self.db_path = Path(db_path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False,
+                                     isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_state (
+                project_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_conversation_state_access ON conversation_state(accessed_at)"
+        )
+        print(f"[ConversationState] SQLite backend at {self.db_path}")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = self._get_locked(key)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return value
+
+    def update(self, key: str, updater: Updater) -> Dict[str, Any]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = updater(self._get_locked(key))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO conversation_state (project_id, data, accessed_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), time.time())
+                )
+                self._evict_locked()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return value
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM conversation_state WHERE project_id = ?", (key,))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM conversation_state").fetchone()[0]
+
+    def _get_locked(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT data, accessed_at FROM conversation_state WHERE project_id = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > self.ttl:
+            self._conn.execute("DELETE FROM conversation_state WHERE project_id = ?", (key,))
+            self.evictions += 1
+            return None
+        self._conn.execute("UPDATE conversation_state SET accessed_at = ? WHERE project_id = ?", (now, key))
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return None
+
+    def _evict_locked(self):
+        expired = self._conn.execute(
+            "DELETE FROM conversation_state WHERE accessed_at < ?", (time.time() - self.ttl,)
+        ).rowcount
+        overflow = self._conn.execute(
+            "DELETE FROM conversation_state WHERE project_id IN ("
+            "SELECT project_id FROM conversation_state ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        ).rowcount
+        self.evictions += max(0, expired) + max(0, overflow)
+
+class RedisStateBackend:
+    """
+    Any Redis-compatible server (Redis, Valkey, KeyDB, ...). Keys expire after
+    the idle TTL; size-based LRU is the server's maxmemory-policy.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, ttl: float, prefix: str = "hardcore:state:"):
+        if redis is None:
+            raise RuntimeError("redis package not installed. Install with: pip install redis")
+        self.ttl = ttl
+        self.prefix = prefix
+        self.evictions = 0
+        self._client = redis.Redis.from_url(url)
+        self._client.ping()
+        print(f"[ConversationState] Redis backend at {url}")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        data = self._client.getex(self.prefix + key, ex=int(self.ttl))
+        return json.loads(data) if data else None
+
+    def update(self, key: str, updater: Updater) -> Dict[str, Any]:
+        name = self.prefix + key
+
+        def transaction(pipe):
+            data = pipe.get(name)
+            value = updater(json.loads(data) if data else None)
+            pipe.multi()
+            pipe.set(name, json.dumps(value), ex=int(self.ttl))
+            return value
+
+        # WATCH/MULTI: retried if another worker wrote the key in between
+        return self._client.transaction(transaction, name, value_from_callable=True)
+
+    def delete(self, key: str):
+        self._client.delete(self.prefix + key)
+
+    def count(self) -> int:
+        return sum(1 for _ in self._client.scan_iter(match=self.prefix + "*", count=500))
+
+class ConversationStateStore:
+    """
+    Per-project state dicts. get() returns a copy; changes go through
+    update()/reset(), which are atomic in every backend. lock(project_id)
+    serializes whole /chat turns for one project within this process.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._locks_guard = threading.Lock()
+
+    def get(self, project_id: str) -> Dict[str, Any]:
+        return {**default_state(), **(self.backend.get(project_id) or {})}
+
+    def update(self, project_id: str, **fields) -> Dict[str, Any]:
+        return self.backend.update(project_id, lambda current: {**default_state(), **(current or {}), **fields})
+
+    def reset(self, project_id: str, **fields) -> Dict[str, Any]:
+        """Back to the initial state; fields are applied on top (e.g. keep the board)."""
+        if not fields:
+            self.backend.delete(project_id)
+            return default_state()
+        return self.backend.update(project_id, lambda current: {**default_state(), **fields})
+
+    def lock(self, project_id: str) -> asyncio.Lock:
+        # Weak values: a lock disappears once no request holds or waits on it
+        with self._locks_guard:
+            lock = self._locks.get(project_id)
+            if lock is None:
+                lock = asyncio.Lock()
+                self._locks[project_id] = lock
+            return lock
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend.name,
+            "projects": self.backend.count(),
+            "evictions": self.backend.evictions,
+            "ttl_s": STATE_TTL,
+            "max_projects": MAX_PROJECTS if self.backend.name != "redis" else None,
+        }
+
+def _create_backend():
+    choice = os.getenv("CONVERSATION_STATE_BACKEND", "sqlite").strip().lower()
+    if choice == "redis":
+        try:
+            return RedisStateBackend(os.getenv("CONVERSATION_STATE_REDIS_URL", "redis://localhost:6379/0"), STATE_TTL)
+        except Exception as e:
+            print(f"[ConversationState] Redis unavailable ({e}), falling back to SQLite")
+            choice = "sqlite"
+    if choice == "sqlite":
+        default_path = Path(__file__).parent.parent / "workspace" / ".hardcore_state.db"
+        try:
+            return SQLiteStateBackend(Path(os.getenv("CONVERSATION_STATE_PATH", str(default_path))),
+                                      STATE_TTL, MAX_PROJECTS)
+        except Exception as e:
+            print(f"[ConversationState] SQLite unavailable ({e}), falling back to memory")
+    return MemoryStateBackend(STATE_TTL, MAX_PROJECTS)
+
+_store: Optional[ConversationStateStore] = None
+_store_lock = threading.Lock()
+
+def get_conversation_store() -> ConversationStateStore:
+    """Process-wide store; the backend is chosen by CONVERSATION_STATE_BACKEND (memory, sqlite, redis)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ConversationStateStore(_create_backend())
+        return _store
+
+def _collect_metrics():
+    if _store is None:
+        return []
+    return [
+        ("hardcore_conversation_state_projects", "gauge", "Projects with live conversation state",
+         [({"backend": _store.backend.name}, _store.backend.count())]),
+    ]
+
+registry.register_collector(_collect_metrics)
@@ -0,0 +1,193 @@
+"""
+Device Monitor - Background USB Serial Watcher
+Enumerates serial ports in-process with pyserial, diffs hotplug changes and
+keeps a classified board inventory in memory, so /boards never forks pio and
+WebSocket clients are told when a board is plugged in or removed.
+"""
+
+import os
+import time
+import asyncio
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from metrics import registry
+
+try:
+    from serial.tools import list_ports
+except ImportError:  # Falls back to polling `pio device list` (slowly)
+    list_ports = None
+
+POLL_INTERVAL = float(os.getenv("DEVICE_POLL_INTERVAL", "1.0"))
+# Forking pio costs a second or more, so the fallback polls far less often
+PIO_POLL_INTERVAL = float(os.getenv("DEVICE_PIO_POLL_INTERVAL", "10.0"))
+SUBSCRIBER_QUEUE_MAX = 100
+
+class DeviceMonitor:
+    """
+    A polling thread owns the inventory; readers get copies. Subscribers are
+    asyncio queues fed through their loop's call_soon_threadsafe. A
+    subscriber that falls SUBSCRIBER_QUEUE_MAX events behind misses events
+    until it drains, and can ask for a fresh snapshot.
+    """
+
+    def __init__(self):
+        self.source = "pyserial" if list_ports else "pio"
+        self.error: Optional[str] = None
+        self.scans = 0
+        self.scanned_at: Optional[float] = None
+        self._devices: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._subscribers: Dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._builder = None
+
+    # ----- lifecycle -----
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        if list_ports:
+            # Cheap enough to have the inventory ready before the first request
+            self.scan()
+        self._thread = threading.Thread(target=self._run, name="device-monitor", daemon=True)
+        self._thread.start()
+        print(f"[DeviceMonitor] Watching serial ports via {self.source}")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        interval = POLL_INTERVAL if list_ports else PIO_POLL_INTERVAL
+        while not self._stop.is_set():
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"[DeviceMonitor] Scan failed: {e}")
+            self._stop.wait(interval)
+
+    # ----- inventory -----
+
+    def devices(self) -> List[Dict[str, Any]]:
+        """Current inventory; scans once on demand if the monitor was never started."""
+        if self.scanned_at is None:
+            self.scan()
+        with self._lock:
+            return [dict(device) for device in self._devices.values()]
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            count = len(self._devices)
+        return {
+            "source": self.source,
+            "running": bool(self._thread and self._thread.is_alive()),
+            "devices": count,
+            "scans": self.scans,
+            "scanned_at": self.scanned_at,
+            "error": self.error,
+            "subscribers": len(self._subscribers),
+        }
+
+    def scan(self) -> List[Dict[str, Any]]:
+        """Enumerate ports once, update the inventory and publish attach/detach events."""
+        with self._scan_lock:
+            ports = self._enumerate()
+            with self._lock:
+                previous = self._devices
+                current = {key: previous.get(key) or self._describe(*key, vid_pid) for key, vid_pid in ports.items()}
+                self._devices = current
+                self.scans += 1
+                self.scanned_at = time.time()
+            events = [{"type": "detached", "device": dict(device)}
+                      for key, device in previous.items() if key not in current]
+            events += [{"type": "attached", "device": dict(device)}
+                       for key, device in current.items() if key not in previous]
+        for event in events:
+            print(f"[DeviceMonitor] {event['type'].capitalize()}: {event['device']['label']}")
+            self._publish(event)
+        return [dict(device) for device in current.values()]
+
+    def _get_builder(self):
+        if self._builder is None:
+            # Deferred: platformio_builder pulls in the whole build stack
+            from platformio_builder import PlatformIOBuilder
+            self._builder = PlatformIOBuilder()
+        return self._builder
+
+    def _enumerate(self) -> Dict[Tuple[str, str, str], Optional[str]]:
+        """(port, description, hwid) -> VID:PID for every wired serial port."""
+        builder = self._get_builder()
+        ports: Dict[Tuple[str, str, str], Optional[str]] = {}
+
+        if list_ports:
+            for info in list_ports.comports():
+                description = info.description or "Unknown Device"
+                hwid = info.hwid or ""
+                if builder._is_bluetooth(description, hwid):
+                    continue
+                vid_pid = f"{info.vid:04X}:{info.pid:04X}" if info.vid is not None and info.pid is not None else None
+                ports[(info.device, description, hwid)] = vid_pid
+            self.error = None
+            return ports
+
+        found = builder.detect_connected_boards()
+        if found and found[0].get("error"):
+            self.error = found[0]["error"]
+            return {}
+        self.error = None
+        for device in found:
+            ports[(device.get("port", ""), device.get("description", ""), device.get("hwid", ""))] = device.get("vid_pid")
+        return ports
+
+    def _describe(self, port: str, description: str, hwid: str, vid_pid: Optional[str]) -> Dict[str, Any]:
+        # Only runs for newly attached ports; known ones keep their classification
+        return self._get_builder()._describe_device(port, description, hwid, vid_pid)
+
+    # ----- push notifications -----
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue of attach/detach events for the calling event loop."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_MAX)
+        with self._lock:
+            self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def snapshot_event(self) -> Dict[str, Any]:
+        return {"type": "snapshot", "devices": self.devices(), "source": self.source, "error": self.error}
+
+    def _publish(self, event: Dict[str, Any]):
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, event)
+            except RuntimeError:
+                # Event loop already closed
+                self.unsubscribe(queue)
+
+    @staticmethod
+    def _deliver(queue: asyncio.Queue, event: Dict[str, Any]):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+device_monitor = DeviceMonitor()
+
+def device_monitor_enabled() -> bool:
+    return os.getenv("DEVICE_MONITOR_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+
+def _collect_metrics():
+    status = device_monitor.status()
+    return [
+        ("hardcore_serial_devices", "gauge", "Serial devices currently attached", [({}, status["devices"])]),
+    ]
+
+registry.register_collector(_collect_metrics)
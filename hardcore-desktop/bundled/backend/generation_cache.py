@@ -0,0 +1,188 @@
+"""
+Generation Cache - Content-Addressed Firmware Response Cache
+Stores validated firmware packages on disk (SQLite) keyed by a hash of
+everything that determines Gemini's output, so identical requests are
+answered locally without spending API quota.
+"""
+
+import os
+import json
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from metrics import registry, record_cache_lookup
+
+class GenerationCache:
+    """
+    SQLite-backed cache of firmware packages with LRU + size-based eviction.
+
+    Entries are evicted by least-recent access once either max_entries or
+    max_bytes is exceeded. A single connection is shared behind a lock so
+    the cache is safe to use from request threads and the event loop.
+    """
+
+    def __init__(self, db_path: Path, max_entries: int = 500, max_bytes: int = 64 * 1024 * 1024):
+        self.db_path = Path(db_path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS generation_cache (
+                key TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_generation_cache_access ON generation_cache(last_access)"
+        )
+        self._conn.commit()
+        print(f"[GenerationCache] Initialized at {self.db_path} "
+              f"(max {self.max_entries} entries / {self.max_bytes // (1024 * 1024)} MB)")
+
+    @staticmethod
+    def make_key(prompt: str, board: str, model: str, temperature: float,
+                 context_digest: str = "") -> str:
+        """
+        Build the cache key.
+
+        The prompt is whitespace/case-normalized; it already contains the
+        injected peripheral configuration section when the UI sent one.
+        context_digest covers the existing project code the prompt
+        references, so edit requests never return another project's result.
+        """
+        normalized_prompt = re.sub(r"\s+", " ", prompt).strip().lower()
+        material = json.dumps({
+            "prompt": normalized_prompt,
+            "board": (board or "").lower(),
+            "model": model,
+            "temperature": round(float(temperature), 3),
+            "context": context_digest,
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached payload for key, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM generation_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                record_cache_lookup("generation", hit=False)
+                return None
+            self._conn.execute(
+                "UPDATE generation_cache SET last_access = ?, hit_count = hit_count + 1 WHERE key = ?",
+                (time.time(), key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        record_cache_lookup("generation", hit=True)
+
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            self.invalidate(key)
+            return None
+
+    def put(self, key: str, payload: Dict[str, Any]):
+        """Store payload under key and evict old entries if over budget."""
+        data = json.dumps(payload)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generation_cache (key, payload, size, created_at, last_access, hit_count) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (key, data, len(data), now, now)
+            )
+            self._evict_locked()
+            self._conn.commit()
+
+    def invalidate(self, key: Optional[str] = None):
+        """Remove one entry, or clear the cache."""
+        with self._lock:
+            if key is None:
+                self._conn.execute("DELETE FROM generation_cache")
+            else:
+                self._conn.execute("DELETE FROM generation_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Entry count, total size and hit/miss counters."""
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generation_cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": count,
+            "bytes": total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def _evict_locked(self):
+        count, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generation_cache"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        # Walk from least recently used until both budgets are satisfied
+        doomed = []
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM generation_cache ORDER BY last_access ASC"
+        ):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            total -= size
+
+        self._conn.executemany("DELETE FROM generation_cache WHERE key = ?", doomed)
+        print(f"[GenerationCache] Evicted {len(doomed)} entries")
+
+_cache: Optional[GenerationCache] = None
+_cache_lock = threading.Lock()
+
+def _collect_metrics():
+    if _cache is None:
+        return []
+    stats = _cache.stats()
+    return [
+        ("hardcore_generation_cache_entries", "gauge", "Firmware packages in the generation cache", [({}, stats["entries"])]),
+        ("hardcore_generation_cache_bytes", "gauge", "Size of cached generation payloads", [({}, stats["bytes"])]),
+        ("hardcore_generation_cache_hit_ratio", "gauge", "Generation cache hits / lookups since start", [({}, stats["hit_rate"])]),
+    ]
+
+registry.register_collector(_collect_metrics)
+
+def get_generation_cache() -> Optional[GenerationCache]:
+    """Process-wide generation cache, or None when disabled via GENERATION_CACHE_ENABLED=0."""
+    global _cache
+    if os.getenv("GENERATION_CACHE_ENABLED", "1").strip().lower() in ("0", "false", "no"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            default_path = Path(__file__).parent.parent / "cache" / "generation_cache.db"
+            _cache = GenerationCache(
+                db_path=Path(os.getenv("GENERATION_CACHE_PATH", str(default_path))),
+                max_entries=int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "500")),
+                max_bytes=int(float(os.getenv("GENERATION_CACHE_MAX_MB", "64")) * 1024 * 1024)
+            )
+        return _cache
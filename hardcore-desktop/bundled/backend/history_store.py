@@ -0,0 +1,132 @@
+"""
+History Store - Append-Only Conversation History
+Keeps every project's conversation history in one SQLite table, so saving
+an interaction is a single indexed INSERT instead of a rewrite of the whole
+.hardcore_history.json, and concurrent requests never drop each other's entries.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+# Entries kept per project; older ones are deleted as new ones arrive
+RETENTION = int(os.getenv("HISTORY_RETENTION", "100"))
+
+class HistoryStore:
+    """
+    SQLite-backed history. Each append inserts the entry and trims the
+    project to `retention` entries in the same transaction. One connection
+    is shared behind a lock; WAL lets other processes read meanwhile.
+    """
+
+    def __init__(self, db_path: Path, retention: int = RETENTION):
+        self.db_path = Path(db_path)
+        self.retention = max(1, retention)
+        self._lock = threading.Lock()
+        self._migrated: set = set()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                project_id TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                entry TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_project ON history(project_id, id)")
+        self._conn.commit()
+        print(f"[HistoryStore] Initialized at {self.db_path} (keeping {self.retention} entries per project)")
+
+    def append(self, project_id: str, entry: Dict[str, Any]):
+        """Record one interaction and apply the retention window."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO history (project_id, created_at, entry) VALUES (?, ?, ?)",
+                (project_id, time.time(), json.dumps(entry))
+            )
+            self._trim_locked(project_id)
+
+    def recent(self, project_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """The last `limit` entries, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT entry FROM history WHERE project_id = ? ORDER BY id DESC LIMIT ?",
+                (project_id, limit)
+            ).fetchall()
+        entries = []
+        for (data,) in reversed(rows):
+            try:
+                entries.append(json.loads(data))
+            except ValueError:
+                continue
+        return entries
+
+    def count(self, project_id: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM history WHERE project_id = ?", (project_id,)
+            ).fetchone()[0]
+
+    def clear(self, project_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM history WHERE project_id = ?", (project_id,))
+
+    def migrate_legacy(self, project_id: str, history_file: Path):
+        """
+        Import a pre-SQLite .hardcore_history.json once, then rename it to
+        .migrated so it is neither imported twice nor read again.
+        """
+        if project_id in self._migrated:
+            return
+        self._migrated.add(project_id)
+        if not history_file.exists():
+            return
+        try:
+            with open(history_file, "r") as f:
+                entries = json.load(f)
+        except Exception as e:
+            print(f"[HistoryStore] Warning: Could not read legacy history {history_file}: {e}")
+            return
+        with self._lock, self._conn:
+            existing = self._conn.execute(
+                "SELECT COUNT(*) FROM history WHERE project_id = ?", (project_id,)
+            ).fetchone()[0]
+            if not existing and isinstance(entries, list):
+                now = time.time()
+                self._conn.executemany(
+                    "INSERT INTO history (project_id, created_at, entry) VALUES (?, ?, ?)",
+                    [(project_id, now, json.dumps(entry)) for entry in entries if isinstance(entry, dict)]
+                )
+                self._trim_locked(project_id)
+        try:
+            history_file.rename(history_file.with_name(history_file.name + ".migrated"))
+        except OSError as e:
+            print(f"[HistoryStore] Warning: Could not rename {history_file}: {e}")
+        print(f"[HistoryStore] Migrated {len(entries) if isinstance(entries, list) else 0} entries for {project_id}")
+
+    def _trim_locked(self, project_id: str):
+        # Everything at or below the (retention+1)-th newest id goes; uses the (project_id, id) index
+        self._conn.execute(
+            "DELETE FROM history WHERE project_id = ? AND id <= ("
+            "SELECT id FROM history WHERE project_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (project_id, project_id, self.retention)
+        )
+
+_stores: Dict[str, HistoryStore] = {}
+_stores_lock = threading.Lock()
+
+def get_history_store(workspace_root: Path) -> HistoryStore:
+    """Process-wide store for a workspace (HISTORY_DB_PATH overrides the location)."""
+    db_path = os.getenv("HISTORY_DB_PATH") or str(Path(workspace_root) / ".hardcore_history.db")
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            store = _stores[db_path] = HistoryStore(Path(db_path))
+        return store
@@ -1,5 +1,5 @@
 # main.py
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -8,6 +8,7 @@ import sys
 from pathlib import Path
 from dotenv import load_dotenv
 import json
+import asyncio
 import shutil
 import traceback
 import os
@@ -20,8 +21,17 @@ load_dotenv()
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
 
-from ai import StrictGeminiEngine, GeminiError
+from ai import StrictGeminiEngine, GeminiError, get_http_client
+from model_health import model_health
+from rate_limiter import get_rate_limiter
+from build_scheduler import build_scheduler, BuildQueueFull, BuildCancelled
+from build_diagnostics import ndjson_events, parse_event_filter
+from toolchain_prewarm import toolchain_prewarmer, prewarm_enabled
+from toolchain_registry import get_pio_executable, board_definitions, driver_database
+from device_monitor import device_monitor, device_monitor_enabled
+from metrics import registry, span
 from context_loader import ProjectContextLoader
+from conversation_state import get_conversation_store
 from hal_adapter import IntelligentHAL
 from firmware_gen import FirmwareAssembler
 from database import init_db
@@ -52,6 +62,44 @@ app.add_middleware(
 # Include Auth Router
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 
+@app.on_event("startup")
+async def load_toolchain_registry():
+    """Resolve pio and parse the board/driver definitions once, before the first request."""
+    get_pio_executable()
+    board_definitions.get()
+    driver_database.get()
+
+@app.on_event("startup")
+async def start_toolchain_prewarm():
+    """
+    Install toolchains and warm the compile cache in the background (TOOLCHAIN_PREWARM_ENABLED=0 to skip).
+    Not in production, where it would compete with real builds; POST /toolchains/prewarm still works there.
+    """
+    if prewarm_enabled() and not _is_production():
+        toolchain_prewarmer.start()
+
+@app.on_event("startup")
+async def start_device_monitor():
+    """Watch serial ports in the background so /boards answers from memory (DEVICE_MONITOR_ENABLED=0 to skip)."""
+    if device_monitor_enabled() and not _is_production():
+        device_monitor.start()
+
+@app.on_event("shutdown")
+async def close_gemini_client():
+    """Release pooled Gemini connections."""
+    await get_http_client().aclose()
+
+@app.on_event("shutdown")
+async def stop_toolchain_prewarm():
+    toolchain_prewarmer.stop()
+
+@app.on_event("shutdown")
+async def stop_device_monitor():
+    device_monitor.stop()
+
+def _is_production() -> bool:
+    return os.getenv("RENDER") is not None or os.getenv("VERCEL") is not None
+
 class HardwareCommandRequest(BaseModel):
     prompt: str
     board_type: str = "unknown"
@@ -62,6 +110,8 @@ class HardwareCommandRequest(BaseModel):
     # NEW: Detected board from USB detection (source of truth if present)
     detected_board: Optional[str] = None
     detected_port: Optional[str] = None
+    # Skip the generation cache lookup (result is still cached)
+    bypass_cache: bool = False
 
 # Global context loader instance (persists across requests)
 _context_loader = ProjectContextLoader()
@@ -90,11 +140,30 @@ async def get_api_key_status():
     has_key = bool(_user_api_key) or bool(os.getenv("LLM_API_KEY"))
     return {"configured": has_key}
 
+@app.get("/models/health")
+async def get_model_health():
+    """Per-model health scoreboard and circuit breaker state."""
+    return {"models": model_health.scoreboard()}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of stage timings, cache, queue and build metrics."""
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4")
+
 def get_active_api_key() -> Optional[str]:
     """Get the active API key (user-provided or env)."""
     global _user_api_key
     return _user_api_key or os.getenv("LLM_API_KEY")
 
+@app.get("/queue/status")
+async def get_queue_status(project_id: Optional[str] = None):
+    """Gemini quota queue for the active API key, with the project's position if given."""
+    limiter = get_rate_limiter(get_active_api_key() or "")
+    status = limiter.stats()
+    if project_id:
+        status["position"] = limiter.project_position(project_id)
+    return status
+
 # =====================================================
 # INTENT GATE AND STATE MACHINE (CRITICAL)
 # =====================================================
@@ -107,42 +176,8 @@ class ChatRequest(BaseModel):
     board_type: str = "unknown"
     detected_board: Optional[str] = None
 
-class ConversationState:
-    """In-memory conversation state manager."""
-    def __init__(self):
-        self.states: Dict[str, Dict[str, Any]] = {}
-    
-    def get(self, project_id: str) -> Dict[str, Any]:
-        if project_id not in self.states:
-            self.states[project_id] = {
-                "state": "IDLE",  # IDLE, CLARIFYING, READY, GENERATING
-                "pending_request": None,  # Original build request
-                "board": None,
-                "driver": None,
-                "pins": {},
-                "behavior": None,
-                "last_question": None,
-            }
-        return self.states[project_id]
-    
-    def update(self, project_id: str, **kwargs):
-        state = self.get(project_id)
-        state.update(kwargs)
-        return state
-    
-    def reset(self, project_id: str):
-        self.states[project_id] = {
-            "state": "IDLE",
-            "pending_request": None,
-            "board": None,
-            "driver": None,
-            "pins": {},
-            "behavior": None,
-            "last_question": None,
-        }
-
-# Global conversation state
-_conversation_state = ConversationState()
+# Global conversation state (bounded, shared with ContextLoader and across workers)
+_conversation_state = get_conversation_store()
 
 def classify_intent(message: str, current_state: str) -> str:
     """
@@ -203,6 +238,8 @@ def generate_small_talk_response(message: str) -> str:
         return "I can help you generate firmware for ESP32, Arduino, STM32, and more. Just describe what you want to build - for example: 'Make a robot move forward' or 'Blink an LED on GPIO 2'."
     return "I'm here to help you build hardware projects. Describe what you'd like to create, and I'll generate the firmware for you."
 
+BEHAVIOR_QUESTION = "Can you describe the behavior in more detail? (timing, sequence, etc.)"
+
 def generate_clarification_question(context: Dict[str, Any]) -> str:
     """Generate a clarification question based on missing context."""
     if not context.get("board"):
@@ -210,10 +247,11 @@ def generate_clarification_question(context: Dict[str, Any]) -> str:
     if not context.get("driver") and "motor" in context.get("pending_request", "").lower():
         return "What motor driver are you using? (L298N, L293D, DRV8833, etc.)"
     if not context.get("behavior"):
-        return "Can you describe the behavior in more detail? (timing, sequence, etc.)"
+        return BEHAVIOR_QUESTION
     return None
 
 @app.post("/chat")
+@span("chat", "total")
 async def chat_with_ai(
     request: ChatRequest,
     current_user: auth.User = Depends(auth.get_current_user_optional)
@@ -228,6 +266,11 @@ async def chat_with_ai(
     
     response_type: "text" | "clarification" | "code"
     """
+    # One turn at a time per project, so two tabs cannot interleave state transitions
+    async with _conversation_state.lock(request.project_id):
+        return await _chat_turn(request)
+
+async def _chat_turn(request: ChatRequest) -> Dict[str, Any]:
     try:
         print(f"\n[Chat] ===== CHAT REQUEST =====")
         print(f"[Chat] Message: {request.message}")
@@ -239,7 +282,8 @@ async def chat_with_ai(
         print(f"[Chat] Current State: {current_state}")
         
         # Classify intent
-        intent = classify_intent(request.message, current_state)
+        with span("chat", "intent"):
+            intent = classify_intent(request.message, current_state)
         print(f"[Chat] Intent: {intent}")
         
         # ===== SMALL TALK =====
@@ -257,6 +301,10 @@ async def chat_with_ai(
             # Update context with answer
             msg = request.message.lower()
             
+            # Record the behavior answer, otherwise the same question comes back forever
+            if ctx.get("last_question") == BEHAVIOR_QUESTION:
+                _conversation_state.update(request.project_id, behavior=request.message)
+            
             # Detect board from answer
             if "esp32" in msg:
                 _conversation_state.update(request.project_id, board="esp32dev")
@@ -340,23 +388,26 @@ async def chat_with_ai(
             _conversation_state.update(request.project_id, state="GENERATING")
             
             try:
-                ai_engine = StrictGeminiEngine()
-                firmware_package = ai_engine.generate_firmware(
-                    user_request=pending,
-                    board_type=board,
-                    project_id=request.project_id
-                )
+                ai_engine = StrictGeminiEngine(api_key=get_active_api_key())
+                with span("chat", "generation"):
+                    firmware_package = await ai_engine.agenerate_firmware(
+                        user_request=pending,
+                        board_type=board,
+                        project_id=request.project_id
+                    )
                 
                 # Validate and assemble
-                hal = IntelligentHAL(board)
-                resolved_pins, _ = hal.validate_and_resolve(firmware_package.pin_json)
+                with span("chat", "hal"):
+                    hal = IntelligentHAL(board)
+                    resolved_pins, _ = hal.validate_and_resolve(firmware_package.pin_json)
                 
-                assembler = FirmwareAssembler()
-                compiled = assembler.assemble(
-                    firmware_package=firmware_package.to_dict(),
-                    board_type=board,
-                    resolved_pins=resolved_pins
-                )
+                with span("chat", "assembly"):
+                    assembler = FirmwareAssembler()
+                    compiled = assembler.assemble(
+                        firmware_package=firmware_package.to_dict(),
+                        board_type=board,
+                        resolved_pins=resolved_pins
+                    )
                 
                 # Reset state
                 _conversation_state.reset(request.project_id)
@@ -396,7 +447,113 @@ async def chat_with_ai(
             "state": "IDLE",
         }
 
+def _effective_board(request: HardwareCommandRequest) -> str:
+    """Board source of truth: detected_board > board_type from API > default."""
+    return (
+        request.detected_board 
+        or (request.board_type if request.board_type not in ('unknown', 'none', '') else None)
+        or 'esp32dev'  # Safe default
+    )
+
+def _enhanced_prompt(request: HardwareCommandRequest) -> str:
+    """User prompt with the UI peripheral config injected, if provided."""
+    if request.peripheral_config:
+        peripheral_section = _format_peripheral_config(request.peripheral_config)
+        print(f"[Orchestrator] Injected peripheral config into prompt")
+        return f"{peripheral_section}\n\n{request.prompt}"
+    return request.prompt
+
+def _complete_execution(firmware_package, effective_board: str, request: HardwareCommandRequest) -> Dict[str, Any]:
+    """HAL validation, assembly and workspace save for a generated package."""
+    # ===== STAGE 2: HAL VALIDATION =====
+    print(f"\n[Orchestrator] STAGE 2: HAL Pin Validation")
+    with span("execute", "hal"):
+        hal = IntelligentHAL(effective_board)
+        resolved_pins, validation_issues = hal.validate_and_resolve(firmware_package.pin_json)
+
+    # ===== STAGE 3: FIRMWARE ASSEMBLY =====
+    print(f"\n[Orchestrator] STAGE 3: Firmware Assembly")
+    with span("execute", "assembly"):
+        assembler = FirmwareAssembler()
+        compiled_firmware = assembler.assemble(
+            firmware_package=firmware_package.to_dict(),
+            board_type=effective_board,
+            resolved_pins=resolved_pins
+        )
+
+    # Guardrail: never claim success without actual code
+    if not compiled_firmware.main_cpp or len(compiled_firmware.main_cpp.strip()) < 50:
+        print("[Orchestrator] Assembly produced empty/too-short firmware")
+        return {
+            "status": "error",
+            "message": "Firmware generation failed internal validation. Please try rephrasing your request.",
+            "is_chat": True,
+            "firmware": None,
+        }
+
+    # ===== STAGE 4: RESPONSE =====
+    print(f"\n[Orchestrator] STAGE 4: Final Response")
+
+    api_response = {
+        "status": "success",
+        "firmware": compiled_firmware.main_cpp,
+        "platformio_ini": compiled_firmware.platformio_ini,
+        "pin_block": firmware_package.pin_block,
+        "pin_json": firmware_package.pin_json,
+        "resolved_pins": resolved_pins,
+        "timeline": firmware_package.timeline,
+        "tests": firmware_package.tests,
+        "message": "Firmware Generated Successfully",
+        "is_chat": False,
+        "board_used": effective_board,
+    }
+
+    # Save to isolated project workspace
+    with span("execute", "workspace_save"):
+        _save_to_workspace(compiled_firmware, effective_board, request.project_id)
+
+    # History was already recorded by the engine (fresh, cached and streamed generations alike)
+
+    return api_response
+
+def _gemini_error_detail(e: GeminiError) -> Dict[str, Any]:
+    """Structured error body for a GeminiError."""
+    print(f"[Orchestrator]   GEMINI ERROR: {e.error_code}")
+    print(f"[Orchestrator]   Message: {e.message}")
+    print(f"[Orchestrator]   Attempts: {len(e.attempts)}")
+
+    error_response = {
+        "status": "error",
+        "error_code": e.error_code,
+        "message": e.message,
+        "metadata": {
+            "attempts": [
+                {
+                    "model": a.model,
+                    "status": a.status_code,
+                    "latency_ms": a.latency_ms,
+                    "error_snippet": a.error_snippet,
+                    "success": a.success
+                } for a in e.attempts
+            ],
+            "timestamp": datetime.now().isoformat()
+        }
+    }
+
+    # Determine specific remediation message
+    if e.error_code == "MODEL_NOT_SUPPORTED":
+        error_response["remediation"] = "Check API key or update GEMINI_MODEL_WHITELIST environment variable"
+    elif e.error_code == "RATE_LIMITED":
+        error_response["remediation"] = "Wait 60 seconds before retrying. Consider upgrading API quota."
+    elif e.error_code == "LLM_UNAVAILABLE":
+        error_response["remediation"] = "Verify API key is valid and has quota. Check Gemini API status."
+    elif e.error_code == "VALIDATION_FAILED":
+        error_response["remediation"] = "Gemini output was incomplete. Try rephrasing your request or try again."
+
+    return error_response
+
 @app.post("/execute")
+@span("execute", "total")
 async def execute_hardware_command(
     request: HardwareCommandRequest,
     current_user: auth.User = Depends(auth.get_current_user_optional)
@@ -414,125 +571,34 @@ async def execute_hardware_command(
         print(f"[Orchestrator] Project ID: {request.project_id}")
         print(f"[Orchestrator] Has Peripheral Config: {request.peripheral_config is not None}")
 
-        # ===== BOARD SOURCE OF TRUTH =====
-        # Priority: detected_board > board_type from API > "unknown"
-        effective_board = (
-            request.detected_board 
-            or (request.board_type if request.board_type not in ('unknown', 'none', '') else None)
-            or 'esp32dev'  # Safe default
-        )
+        effective_board = _effective_board(request)
         print(f"[Orchestrator] Effective Board: {effective_board}")
 
-        # ===== BUILD ENHANCED PROMPT =====
-        enhanced_prompt = request.prompt
-
-        # Inject peripheral config if provided
-        if request.peripheral_config:
-            peripheral_section = _format_peripheral_config(request.peripheral_config)
-            enhanced_prompt = f"{peripheral_section}\n\n{request.prompt}"
-            print(f"[Orchestrator] Injected peripheral config into prompt")
+        enhanced_prompt = _enhanced_prompt(request)
 
         # Initialize Engine
-        ai_engine = StrictGeminiEngine()
+        ai_engine = StrictGeminiEngine(api_key=get_active_api_key())
 
         # ===== AI GENERATION =====
         print(f"\n[Orchestrator] STAGE 1: AI Generation")
-        firmware_package = ai_engine.generate_firmware(
-            user_request=enhanced_prompt,
-            board_type=effective_board,
-            project_id=request.project_id
-        )
+        with span("execute", "generation"):
+            firmware_package = await ai_engine.agenerate_firmware(
+                user_request=enhanced_prompt,
+                board_type=effective_board,
+                project_id=request.project_id,
+                use_cache=not request.bypass_cache
+            )
 
         print(f"[Orchestrator]   ✓ Firmware generated successfully")
         print(f"[Orchestrator]   Model: {firmware_package.model_used}")
         print(f"[Orchestrator]   Confidence: {firmware_package.confidence}")
 
-        # ===== STAGE 2: HAL VALIDATION =====
-        print(f"\n[Orchestrator] STAGE 2: HAL Pin Validation")
-        hal = IntelligentHAL(effective_board)
-        resolved_pins, validation_issues = hal.validate_and_resolve(firmware_package.pin_json)
-
-        # ===== STAGE 3: FIRMWARE ASSEMBLY =====
-        print(f"\n[Orchestrator] STAGE 3: Firmware Assembly")
-        assembler = FirmwareAssembler()
-        compiled_firmware = assembler.assemble(
-            firmware_package=firmware_package.to_dict(),
-            board_type=effective_board,
-            resolved_pins=resolved_pins
-        )
-
-        # Guardrail: never claim success without actual code
-        if not compiled_firmware.main_cpp or len(compiled_firmware.main_cpp.strip()) < 50:
-            print("[Orchestrator] Assembly produced empty/too-short firmware")
-            return {
-                "status": "error",
-                "message": "Firmware generation failed internal validation. Please try rephrasing your request.",
-                "is_chat": True,
-                "firmware": None,
-            }
-
-        # ===== STAGE 4: RESPONSE =====
-        print(f"\n[Orchestrator] STAGE 4: Final Response")
-
-        api_response = {
-            "status": "success",
-            "firmware": compiled_firmware.main_cpp,
-            "platformio_ini": compiled_firmware.platformio_ini,
-            "pin_block": firmware_package.pin_block,
-            "pin_json": firmware_package.pin_json,
-            "resolved_pins": resolved_pins,
-            "timeline": firmware_package.timeline,
-            "tests": firmware_package.tests,
-            "message": "Firmware Generated Successfully",
-            "is_chat": False,
-            "board_used": effective_board,
-        }
-
-        # Save to isolated project workspace
-        _save_to_workspace(compiled_firmware, effective_board, request.project_id)
-
-        # Save to history for context persistence
-        _context_loader.save_history(request.project_id, request.prompt, firmware_package.to_dict())
-
-        return api_response
+        return _complete_execution(firmware_package, effective_board, request)
 
 
     except GeminiError as e:
         # Gemini-specific error - return HTTP 503 with structured error
-        print(f"[Orchestrator]   GEMINI ERROR: {e.error_code}")
-        print(f"[Orchestrator]   Message: {e.message}")
-        print(f"[Orchestrator]   Attempts: {len(e.attempts)}")
-
-        # Build structured error response
-        error_response = {
-            "status": "error",
-            "error_code": e.error_code,
-            "message": e.message,
-            "metadata": {
-                "attempts": [
-                    {
-                        "model": a.model,
-                        "status": a.status_code,
-                        "latency_ms": a.latency_ms,
-                        "error_snippet": a.error_snippet,
-                        "success": a.success
-                    } for a in e.attempts
-                ],
-                "timestamp": datetime.now().isoformat()
-            }
-        }
-
-        # Determine specific remediation message
-        if e.error_code == "MODEL_NOT_SUPPORTED":
-            error_response["remediation"] = "Check API key or update GEMINI_MODEL_WHITELIST environment variable"
-        elif e.error_code == "RATE_LIMITED":
-            error_response["remediation"] = "Wait 60 seconds before retrying. Consider upgrading API quota."
-        elif e.error_code == "LLM_UNAVAILABLE":
-            error_response["remediation"] = "Verify API key is valid and has quota. Check Gemini API status."
-        elif e.error_code == "VALIDATION_FAILED":
-            error_response["remediation"] = "Gemini output was incomplete. Try rephrasing your request or try again."
-
-        raise HTTPException(status_code=503, detail=error_response)
+        raise HTTPException(status_code=503, detail=_gemini_error_detail(e))
 
     except Exception as e:
         # Unexpected error
@@ -553,6 +619,52 @@ async def execute_hardware_command(
             }
         )
 
+@app.post("/execute/stream")
+async def execute_hardware_command_stream(
+    request: HardwareCommandRequest,
+    current_user: auth.User = Depends(auth.get_current_user_optional)
+):
+    """
+    Streaming variant of /execute. Returns NDJSON, one event per line:
+    queued (quota queue position), delta (raw text), section (partial
+    FirmwarePackage), result (same body as /execute) or error (same body
+    as the /execute error detail).
+    """
+    print(f"\n[Orchestrator] ===== STREAMING FIRMWARE GENERATION REQUEST =====")
+    print(f"[Orchestrator] Prompt: {request.prompt}")
+
+    effective_board = _effective_board(request)
+    enhanced_prompt = _enhanced_prompt(request)
+
+    @span("execute_stream", "total")
+    async def event_stream():
+        def line(event: Dict[str, Any]) -> str:
+            return json.dumps(event) + "\n"
+
+        try:
+            ai_engine = StrictGeminiEngine(api_key=get_active_api_key())
+            async for event in ai_engine.astream_firmware(
+                user_request=enhanced_prompt,
+                board_type=effective_board,
+                project_id=request.project_id,
+                use_cache=not request.bypass_cache
+            ):
+                if event["event"] != "complete":
+                    yield line(event)
+                    continue
+
+                firmware_package = event["firmware_package"]
+                result = await asyncio.to_thread(_complete_execution, firmware_package, effective_board, request)
+                yield line({"event": "result", **result})
+
+        except GeminiError as e:
+            yield line({"event": "error", **_gemini_error_detail(e)})
+        except Exception as e:
+            print(f"[Orchestrator]  UNEXPECTED STREAM ERROR: {e}")
+            yield line({"event": "error", "status": "error", "error_code": "INTERNAL_ERROR", "message": str(e)})
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
 def _format_peripheral_config(config: Dict[str, Any]) -> str:
     """
     Convert structured peripheral config (from UI) to AI-readable prompt section.
@@ -641,39 +753,16 @@ def _generate_user_message(package, issues) -> str:
     return msg
 
 def _save_to_workspace(firmware, board_type: str, project_id: str):
-    """Save generated files to project-specific workspace."""
-    from pathlib import Path
+    """Save generated files to the project's build directory (the one /build compiles)."""
     from platformio_builder import PlatformIOBuilder
-    import shutil
-    
-    builder = PlatformIOBuilder()
-    
-    # DYNAMIC WORKSPACE PATH
-    project_dir = builder.workspace / project_id
-    print(f"[Orchestrator] Saving project to: {project_dir}")
-    
-    # Clean and recreate (Or maybe just ensure exists? Recreating wipes history/mods... 
-    # For now, let's stick to current behavior of nuking validation output, 
-    # but ContextLoader persists state separately in same folder)
-    if project_dir.exists():
-        # Careful! We don't want to delete the .hardcore_state.json or history if we're just updating code
-        # But previous logic was shutil.rmtree. 
-        # Let's keep rmtree for now to align with "Antigravity behavior" of clean generation, 
-        # BUT we must preserve state/history if we want AI context to work across turns.
-        # Actually, ContextLoader works ON TOP of files. 
-        # Ideally we only overwrite source files.
-        pass
-    else:
-        project_dir.mkdir(parents=True, exist_ok=True)
-        
-    # Initialize PlatformIO structure (idempotent-ish)
-    builder._init_platformio_project(project_dir, board_type)
-    
-    # Write files
-    (project_dir / "src" / "main.cpp").write_text(firmware.main_cpp)
-    (project_dir / "src" / "resolved_pins.h").write_text(firmware.resolved_pins_h)
-    (project_dir / "platformio.ini").write_text(firmware.platformio_ini)
     
+    # The assembler's detected libraries become the lib_deps of the builder's platformio.ini
+    project_dir = PlatformIOBuilder().write_project(
+        project_id,
+        {"src/main.cpp": firmware.main_cpp, "src/resolved_pins.h": firmware.resolved_pins_h},
+        board_type,
+        lib_deps=firmware.dependencies
+    )
     print(f"[Orchestrator] Files saved to {project_dir}")
 
 # --- Remaining endpoints: build / flash / flash stream / ota / boards / drivers / zip download ---
@@ -681,20 +770,61 @@ def _save_to_workspace(firmware, board_type: str, project_id: str):
 # They call into your PlatformIOBuilder, UniversalFlasher, OTAFlasher, WirelessScanner, etc.
 # (I kept them minimal here — copy your existing implementations or keep as-is.)
 
+def _build_project_id(request: Dict[str, Any]) -> str:
+    """Build directory for a request; builds of different projects run in parallel."""
+    return request.get("project_id") or "current_project"
+
+async def _run_scheduled_build(request: Dict[str, Any], flash: bool) -> Dict[str, Any]:
+    """
+    Queue a build_and_flash on the build worker pool. With "wait": false the
+    job is returned immediately (poll GET /builds/{job_id}); otherwise the
+    request waits for the result.
+    """
+    from platformio_builder import PlatformIOBuilder
+    builder = PlatformIOBuilder()
+    firmware_code = request["firmware"]
+    board_type = request.get("board_type", "esp32")
+    clean = bool(request.get("clean", False))
+    project_id = _build_project_id(request)
+
+    try:
+        job = build_scheduler.submit(
+            lambda token: builder.build_and_flash(
+                firmware_code=firmware_code,
+                board_type=board_type,
+                flash=flash,
+                clean=clean,
+                project_id=project_id,
+                cancel_token=token
+            ),
+            project_id=project_id,
+            kind="flash" if flash else "build",
+            priority=int(request.get("priority", 0))
+        )
+    except BuildQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    if not request.get("wait", True):
+        return build_scheduler.describe(job.job_id)
+
+    try:
+        result = await asyncio.wrap_future(job.future)
+    except BuildCancelled as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except asyncio.CancelledError:
+        build_scheduler.cancel(job.job_id)
+        raise
+    return {**result, "job_id": job.job_id}
+
 @app.post("/build")
 async def build_firmware(
     request: Dict[str, Any],
     current_user: auth.User = Depends(auth.get_current_user)
 ):
     try:
-        from platformio_builder import PlatformIOBuilder
-        builder = PlatformIOBuilder()
-        result = builder.build_and_flash(
-            firmware_code=request["firmware"],
-            board_type=request.get("board_type", "esp32"),
-            flash=False
-        )
-        return result
+        return await _run_scheduled_build(request, flash=False)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -704,14 +834,166 @@ async def flash_firmware(
     current_user: auth.User = Depends(auth.get_current_user)
 ):
     try:
-        from platformio_builder import PlatformIOBuilder
-        builder = PlatformIOBuilder()
-        result = builder.build_and_flash(
-            firmware_code=request["firmware"],
-            board_type=request.get("board_type", "esp32"),
-            flash=True
-        )
-        return result
+        return await _run_scheduled_build(request, flash=True)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/builds")
+async def get_build_queue(current_user: auth.User = Depends(auth.get_current_user)):
+    """Build worker pool: queued jobs with positions and running jobs."""
+    return build_scheduler.stats()
+
+@app.get("/builds/{job_id}")
+async def get_build_job(job_id: str, current_user: auth.User = Depends(auth.get_current_user)):
+    job = build_scheduler.describe(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown build job")
+    if job["status"] == "done":
+        job["result"] = build_scheduler.get(job_id).future.result()
+    return job
+
+@app.delete("/builds/{job_id}")
+async def cancel_build_job(job_id: str, current_user: auth.User = Depends(auth.get_current_user)):
+    """Cancel a queued build, or kill a running one."""
+    if not build_scheduler.cancel(job_id):
+        raise HTTPException(status_code=404, detail="No queued or running build with that id")
+    return build_scheduler.describe(job_id)
+
+@app.get("/build/cache/stats")
+async def get_build_cache_stats(current_user: auth.User = Depends(auth.get_current_user)):
+    """Firmware artifact cache and shared compile (object) cache statistics."""
+    import compile_cache
+    from build_cache import get_build_cache
+    artifact_cache = get_build_cache()
+    return {
+        "artifacts": artifact_cache.stats() if artifact_cache else {"enabled": False},
+        "compile": compile_cache.stats(),
+    }
+
+def _log_stream_response(chunks, request: Dict[str, Any]) -> StreamingResponse:
+    """
+    Raw text log by default; with "format": "ndjson" a stream of parsed build
+    events, optionally limited by "events" (e.g. "diagnostic,memory,result").
+    """
+    if request.get("format", "text") != "ndjson":
+        return StreamingResponse(chunks, media_type="text/plain")
+    try:
+        wanted = parse_event_filter(request.get("events"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(ndjson_events(chunks, wanted), media_type="application/x-ndjson")
+
+def _scheduled_log_stream(request: Dict[str, Any], flash: bool):
+    from platformio_builder import PlatformIOBuilder
+    builder = PlatformIOBuilder()
+    firmware_code = request["firmware"]
+    board_type = request.get("board_type", "esp32")
+    clean = bool(request.get("clean", False))
+    project_id = _build_project_id(request)
+    return build_scheduler.astream(
+        lambda token: builder.abuild_and_flash_stream(
+            firmware_code=firmware_code,
+            board_type=board_type,
+            flash=flash,
+            clean=clean,
+            project_id=project_id,
+            cancel_token=token
+        ),
+        project_id=project_id,
+        kind="flash" if flash else "build",
+        priority=int(request.get("priority", 0))
+    )
+
+@app.post("/build/stream")
+async def build_firmware_stream(
+    request: Dict[str, Any],
+    current_user: auth.User = Depends(auth.get_current_user)
+):
+    try:
+        return _log_stream_response(_scheduled_log_stream(request, flash=False), request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/toolchains/status")
+async def get_toolchain_status():
+    """Resolved pio CLI and progress of the background toolchain pre-warm, per board."""
+    return {
+        "pio_executable": get_pio_executable(),
+        "platforms": board_definitions.platforms(),
+        **toolchain_prewarmer.status(),
+    }
+
+@app.post("/toolchains/prewarm")
+async def start_toolchain_prewarm_now(
+    request: Dict[str, Any],
+    current_user: auth.User = Depends(auth.get_current_user)
+):
+    """Re-run the pre-warm, optionally for specific boards and ignoring already-warm ones (force)."""
+    started = toolchain_prewarmer.start(request.get("boards"), force=bool(request.get("force", False)))
+    if not started:
+        raise HTTPException(status_code=409, detail="Toolchain pre-warm is already running")
+    return toolchain_prewarmer.status()
+
+async def _cancel_on_disconnect(http_request: Request, coro, poll: float = 1.0):
+    """
+    Await coro, cancelling it if the client disconnects first. Plain
+    (non-streaming) handlers are not cancelled by the server on disconnect.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                print("[Orchestrator] Client disconnected, cancelling request")
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+@app.post("/build/matrix")
+async def build_matrix(
+    request: Dict[str, Any],
+    http_request: Request,
+    current_user: auth.User = Depends(auth.get_current_user)
+):
+    """
+    Compile one firmware for several boards in parallel on the build pool.
+    Body: firmware, boards (default: all known boards), project_id, priority,
+    and "stream": true for per-board NDJSON progress (filter with "events").
+    """
+    from build_matrix import resolve_boards, run_matrix, stream_matrix
+    try:
+        boards = resolve_boards(request.get("boards"))
+        wanted = parse_event_filter(request.get("events"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if "firmware" not in request:
+        raise HTTPException(status_code=400, detail="firmware is required")
+    if len(boards) > build_scheduler.max_queue:
+        raise HTTPException(status_code=429, detail="More boards than the build queue can hold")
+
+    project_id = request.get("project_id") or "matrix"
+    priority = int(request.get("priority", 0))
+    try:
+        if request.get("stream"):
+            return StreamingResponse(
+                stream_matrix(request["firmware"], boards, project_id, priority, wanted),
+                media_type="application/x-ndjson"
+            )
+        # Disconnecting cancels run_matrix, which cancels every board's job
+        return await _cancel_on_disconnect(http_request,
+                                           run_matrix(request["firmware"], boards, project_id, priority))
+    except HTTPException:
+        raise
+    except BuildQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -721,16 +1003,9 @@ async def flash_firmware_stream(
     current_user: auth.User = Depends(auth.get_current_user)
 ):
     try:
-        from platformio_builder import PlatformIOBuilder
-        builder = PlatformIOBuilder()
-        return StreamingResponse(
-            builder.build_and_flash_stream(
-                firmware_code=request["firmware"],
-                board_type=request.get("board_type", "esp32"),
-                flash=True
-            ),
-            media_type="text/plain"
-        )
+        return _log_stream_response(_scheduled_log_stream(request, flash=True), request)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -742,14 +1017,27 @@ async def flash_universal(
     try:
         from universal_flasher import UniversalFlasher
         flasher = UniversalFlasher()
-        return StreamingResponse(
-            flasher.flash(
-                firmware_code=request["firmware"],
-                board_type=request.get("board_type", "esp32"),
-                port=request.get("port")
+        firmware_code = request["firmware"]
+        board_type = request.get("board_type", "esp32")
+        port = request.get("port")
+        project_id = _build_project_id(request)
+        return _log_stream_response(
+            build_scheduler.astream(
+                lambda token: flasher.aflash(
+                    firmware_code=firmware_code,
+                    board_type=board_type,
+                    port=port,
+                    project_id=project_id,
+                    cancel_token=token
+                ),
+                project_id=project_id,
+                kind="flash",
+                priority=int(request.get("priority", 0))
             ),
-            media_type="text/plain"
+            request
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -760,7 +1048,6 @@ async def flash_ota(
 ):
     try:
         from ota_flasher import OTAFlasher
-        from platformio_builder import PlatformIOBuilder
         import os
 
         firmware_code = request.get("firmware")
@@ -772,8 +1059,10 @@ async def flash_ota(
         if not device_ip:
             raise HTTPException(status_code=400, detail="device_ip is required")
 
-        builder = PlatformIOBuilder()
-        build_result = builder.build_and_flash(firmware_code, board_type, flash=False)
+        build_result = await _run_scheduled_build(
+            {**request, "firmware": firmware_code, "board_type": board_type, "wait": True},
+            flash=False
+        )
 
         if not build_result.get("success"):
             raise HTTPException(status_code=500, detail=f"Compilation failed: {build_result.get('error', 'Unknown error')}")
@@ -803,32 +1092,98 @@ async def flash_ota(
 async def detect_boards(
     current_user: auth.User = Depends(auth.get_current_user)
 ):
-    import os
-    is_production = os.getenv("RENDER") is not None or os.getenv("VERCEL") is not None
-    if is_production:
+    if _is_production():
         return {
             "devices": [],
             "message": "Board detection is not available in production. Please run locally with PlatformIO installed."
         }
     try:
-        from platformio_builder import PlatformIOBuilder
-        builder = PlatformIOBuilder()
-        devices = builder.detect_connected_boards()
-        if not devices:
-            return {"devices": [], "message": "No boards detected. Make sure your board is connected and drivers are installed."}
-        if devices and devices[0].get("error"):
-            error_msg = devices[0].get('error', '')
+        # Served from the device monitor's inventory; only the very first call may scan
+        if device_monitor.scanned_at is None:
+            devices = await asyncio.to_thread(device_monitor.devices)
+        else:
+            devices = device_monitor.devices()
+        error_msg = device_monitor.error or ""
+        if error_msg and not devices:
             if 'pio' in error_msg.lower() or 'platformio' in error_msg.lower():
                 return {"devices": [], "message": "PlatformIO is not installed. Install it with: pip install platformio"}
-            return {"devices": devices, "message": f"Detection issue: {error_msg}"}
+            return {"devices": [], "message": f"Detection issue: {error_msg}"}
+        if not devices:
+            return {"devices": [], "message": "No boards detected. Make sure your board is connected and drivers are installed."}
         return {"devices": devices}
-    except FileNotFoundError as e:
-        if 'pio' in str(e).lower():
-            return {"devices": [], "message": "PlatformIO is not installed. Please install it with: pip install platformio"}
-        raise
     except Exception as e:
         return {"devices": [], "error": str(e), "message": "Failed to detect boards."}
 
+@app.get("/boards/monitor")
+async def device_monitor_status(
+    current_user: auth.User = Depends(auth.get_current_user)
+):
+    return device_monitor.status()
+
+async def _authenticate_websocket(websocket: WebSocket, timeout: float = 5.0) -> bool:
+    """
+    Accept the socket and check the same JWT the HTTP routes require, sent
+    as ?token=... or as the first message ({"token": ...} or the bare
+    token). Browsers apply no CORS to WebSockets, so without this any page
+    could connect. Closes with 1008 and returns False when it is invalid.
+    """
+    await websocket.accept()
+    token = websocket.query_params.get("token")
+    if not token:
+        try:
+            message = await asyncio.wait_for(websocket.receive_text(), timeout=timeout)
+        except (asyncio.TimeoutError, WebSocketDisconnect):
+            message = ""
+        try:
+            token = json.loads(message).get("token")
+        except (ValueError, AttributeError):
+            token = message.strip()
+        if token and token.lower().startswith("bearer "):
+            token = token[7:].strip()
+
+    def lookup():
+        db = auth.SessionLocal()
+        try:
+            return auth.user_from_token(token, db)
+        finally:
+            db.close()
+
+    if await asyncio.to_thread(lookup) is None:
+        try:
+            await websocket.close(code=1008, reason="Could not validate credentials")
+        except RuntimeError:
+            pass  # Client already gone
+        return False
+    return True
+
+@app.websocket("/ws/devices")
+async def device_events(websocket: WebSocket):
+    """
+    Requires a token (see _authenticate_websocket). Pushes
+    {"type": "snapshot", "devices": [...]} on connect, then
+    {"type": "attached"|"detached", "device": {...}} as boards come and go.
+    Send "refresh" to get a new snapshot.
+    """
+    if not await _authenticate_websocket(websocket):
+        return
+    queue = device_monitor.subscribe()
+
+    async def forward():
+        while True:
+            await websocket.send_json(await queue.get())
+
+    sender = asyncio.create_task(forward())
+    try:
+        await queue.put(await asyncio.to_thread(device_monitor.snapshot_event))
+        while True:
+            if await websocket.receive_text() == "refresh":
+                await queue.put(device_monitor.snapshot_event())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        device_monitor.unsubscribe(queue)
+
 @app.post("/install-drivers")
 async def install_drivers_endpoint(
     current_user: auth.User = Depends(auth.get_current_user)
@@ -0,0 +1,335 @@
+"""
+Metrics - Stage Timing Spans and Prometheus-Style Exposition
+Process-wide counters, gauges and histograms plus a span() timer for every
+pipeline stage, rendered in the Prometheus text format by GET /metrics so we
+can see where the seconds go in production.
+"""
+
+import time
+import inspect
+import functools
+import threading
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
+
+# Seconds; spans range from sub-millisecond parsing to multi-minute first builds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    """Shared label handling for all metric types."""
+    type_name = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+                    for k, v in sorted(self._values.items())]
+
+class Gauge(_Metric):
+    """Value that goes up and down (queue depth, in-flight work)."""
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def track_inprogress(self, **labels) -> "_Tracked":
+        """Context manager / decorator that holds the gauge +1 while work runs."""
+        return _Tracked(lambda: self.inc(**labels), lambda ok: self.dec(**labels))
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+                    for k, v in sorted(self._values.items())]
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram with _sum and _count."""
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[Tuple, List[float]] = {}  # key -> per-bucket counts + [sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self, **labels) -> Dict[str, float]:
+        """sum/count for one label set (0s if never observed)."""
+        with self._lock:
+            series = self._series.get(self._key(labels))
+        if not series:
+            return {"sum": 0.0, "count": 0}
+        return {"sum": series[-2], "count": int(series[-1])}
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for index, bound in enumerate(self.buckets):
+                    le = 'le="' + _format_value(bound) + '"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(series[index])}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(series[-1])}")
+        return lines
+
+class _Tracked:
+    """
+    Runs on_enter/on_exit(ok) around a block. Usable as a context manager or
+    as a decorator on sync, async, generator and async-generator functions.
+    """
+
+    def __init__(self, on_enter: Callable[[], None], on_exit: Callable[[bool], None]):
+        self._on_enter = on_enter
+        self._on_exit = on_exit
+
+    def __enter__(self):
+        self._on_enter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._on_exit(exc_type is None)
+        return False
+
+    def _fresh(self) -> "_Tracked":
+        return _Tracked(self._on_enter, self._on_exit)
+
+    def __call__(self, fn):
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def async_gen_wrapper(*args, **kwargs):
+                with self._fresh():
+                    async for item in fn(*args, **kwargs):
+                        yield item
+            return async_gen_wrapper
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                with self._fresh():
+                    yield from fn(*args, **kwargs)
+            return gen_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with self._fresh():
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self._fresh():
+                return fn(*args, **kwargs)
+        return wrapper
+
+class Span(_Tracked):
+    """
+    Times one pipeline stage into hardcore_stage_duration_seconds.
+
+    outcome is "ok" unless the block raises, the span is marked with
+    fail(), or (as a decorator with success_key) the wrapped function
+    returns a dict whose success_key is falsy.
+    """
+
+    def __init__(self, pipeline: str, stage: str, success_key: Optional[str] = None):
+        self.pipeline = pipeline
+        self.stage = stage
+        self.success_key = success_key
+        self._start = 0.0
+        self._failed = False
+        super().__init__(self._begin, self._end)
+
+    def _begin(self):
+        self._start = time.perf_counter()
+        self._failed = False
+
+    def _end(self, ok: bool):
+        outcome = "ok" if ok and not self._failed else "error"
+        STAGE_SECONDS.observe(time.perf_counter() - self._start,
+                              pipeline=self.pipeline, stage=self.stage, outcome=outcome)
+
+    def fail(self):
+        """Record this span as an error without raising."""
+        self._failed = True
+
+    def _fresh(self) -> "Span":
+        return Span(self.pipeline, self.stage, self.success_key)
+
+    def __call__(self, fn):
+        if not self.success_key or inspect.isgeneratorfunction(fn) or inspect.isasyncgenfunction(fn):
+            return super().__call__(fn)
+
+        success_key = self.success_key
+
+        def check(span: "Span", result):
+            if isinstance(result, dict) and not result.get(success_key):
+                span.fail()
+            return result
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with self._fresh() as span:
+                    return check(span, await fn(*args, **kwargs))
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self._fresh() as span:
+                return check(span, fn(*args, **kwargs))
+        return wrapper
+
+# Collector: returns [(name, type, help, [(labels dict, value), ...]), ...] at scrape time
+Collector = Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]]]
+
+class MetricsRegistry:
+    """Named metrics plus scrape-time collectors for state owned elsewhere."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, help_text: str, labelnames: Iterable[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, help_text, labelnames, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.type_name}")
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def gauge(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def register_collector(self, collector: Collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"[Metrics] Collector failed: {e}")
+                continue
+            for name, type_name, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in samples:
+                    names = tuple(labels)
+                    lines.append(f"{name}{_format_labels(names, tuple(labels[n] for n in names))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+# Shared by every module in this process
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "hardcore_stage_duration_seconds",
+    "Wall-clock duration of pipeline stages",
+    ("pipeline", "stage", "outcome")
+)
+
+CACHE_REQUESTS = registry.counter(
+    "hardcore_cache_requests_total",
+    "Cache lookups by cache and result (hit/miss)",
+    ("cache", "result")
+)
+
+def span(pipeline: str, stage: str, success_key: Optional[str] = None) -> Span:
+    """Time a stage: `with span("execute", "hal"):` or `@span("build", "compile", success_key="success")`."""
+    return Span(pipeline, stage, success_key)
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
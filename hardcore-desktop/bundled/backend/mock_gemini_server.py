@@ -0,0 +1,334 @@
+"""
+Mock Gemini Server - Deterministic Local Stand-In for the Gemini API
+Serves the models, generateContent and streamGenerateContent endpoints from
+recorded responses with configurable latency, 429 rate and truncation, so the
+pipeline can be load-tested without spending real quota.
+
+Usage:
+    python mock_gemini_server.py --port 8765 --latency-ms 800 --rate-429 0.05
+    GEMINI_API_BASE=http://127.0.0.1:8765 python main.py
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from dataclasses import dataclass, field, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlparse
+
+# Built-in recordings. A recording is chosen by the first entry whose "match"
+# keywords all appear in the (lowercased) prompt; entries without "match"
+# are the fallback. --recordings loads a JSON list in the same format.
+DEFAULT_RECORDINGS: List[Dict[str, Any]] = [
+    {
+        "name": "chat",
+        "match": ["reply in 2-3 sentences"],
+        "text": "I can help you build that! Tell me which board you're using and what the hardware should do."
+    },
+    {
+        "name": "servo_sweep",
+        "match": ["servo"],
+        "text": """```cpp
+#include <Arduino.h>
+#include <ESP32Servo.h>
+
+#define SERVO_PIN 18
+
+Servo servo;
+
+void setup() {
+  Serial.begin(115200);
+  servo.attach(SERVO_PIN);
+  Serial.println("Servo sweep started");
+}
+
+void loop() {
+  for (int angle = 0; angle <= 180; angle += 5) {
+    servo.write(angle);
+    delay(20);
+  }
+  for (int angle = 180; angle >= 0; angle -= 5) {
+    servo.write(angle);
+    delay(20);
+  }
+}
+```
+
+PIN CONNECTIONS
+Servo Signal -> GPIO 18
+Servo VCC -> 5V
+Servo GND -> GND
+
+<!--PIN-CONNECTIONS-JSON-->
+{"mcu": "esp32", "connections": [{"component": "Servo", "pins": [{"mcu_pin": 18, "component_pin": "Signal", "type": "PWM"}]}]}
+
+// TIMELINE: sweeps 0-180-0 degrees in 5 degree steps every 20ms
+
+TEST CHECKLIST:
+- Servo sweeps smoothly end to end
+- Serial prints "Servo sweep started"
+"""
+    },
+    {
+        "name": "led_blink",
+        "text": """```cpp
+#include <Arduino.h>
+
+#define LED_PIN 2
+
+void setup() {
+  Serial.begin(115200);
+  pinMode(LED_PIN, OUTPUT);
+  Serial.println("Blink started");
+}
+
+void loop() {
+  digitalWrite(LED_PIN, HIGH);
+  delay(500);
+  digitalWrite(LED_PIN, LOW);
+  delay(500);
+}
+```
+
+PIN CONNECTIONS
+LED Anode -> GPIO 2 (through 220 ohm resistor)
+LED Cathode -> GND
+
+<!--PIN-CONNECTIONS-JSON-->
+{"mcu": "esp32", "connections": [{"component": "LED", "pins": [{"mcu_pin": 2, "component_pin": "Anode", "type": "GPIO"}]}]}
+
+// TIMELINE: LED toggles every 500ms
+
+TEST CHECKLIST:
+- LED blinks at 1 Hz
+- Serial prints "Blink started"
+"""
+    },
+]
+
+DEFAULT_MODELS = ["gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.0-flash", "gemini-2.0-flash-lite"]
+
+@dataclass
+class MockGeminiConfig:
+    """Behaviour knobs; all rates are probabilities in [0, 1]."""
+    latency_ms: float = 800.0           # Mean time to first byte
+    jitter_ms: float = 200.0            # Uniform +/- jitter around latency_ms
+    rate_429: float = 0.0               # Fraction of generate calls answered with 429
+    truncate_rate: float = 0.0          # Fraction of responses cut short (finishReason MAX_TOKENS)
+    truncate_fraction: float = 0.6      # How much of the text a truncated response keeps
+    stream_chunk_chars: int = 120       # Characters per SSE chunk
+    stream_chunk_delay_ms: float = 30.0 # Pause between SSE chunks
+    seed: int = 1234
+    models: List[str] = field(default_factory=lambda: list(DEFAULT_MODELS))
+
+class MockGeminiState:
+    """Shared config, recordings and counters for all handler threads."""
+
+    def __init__(self, config: MockGeminiConfig, recordings: List[Dict[str, Any]]):
+        self.config = config
+        self.recordings = recordings
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self.counters: Dict[str, int] = {}
+
+    def next_rng(self) -> random.Random:
+        """RNG for the next request; the n-th request always makes the same decisions for a seed."""
+        with self._lock:
+            self._sequence += 1
+            return random.Random(f"{self.config.seed}:{self._sequence}")
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def select(self, prompt: str) -> Dict[str, Any]:
+        prompt_lower = prompt.lower()
+        fallback = None
+        for recording in self.recordings:
+            keywords = recording.get("match")
+            if not keywords:
+                fallback = fallback or recording
+                continue
+            if all(k.lower() in prompt_lower for k in keywords):
+                return recording
+        return fallback or self.recordings[-1]
+
+    def update(self, changes: Dict[str, Any]):
+        with self._lock:
+            for key, value in changes.items():
+                if hasattr(self.config, key):
+                    setattr(self.config, key, type(getattr(self.config, key))(value))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"config": asdict(self.config), "requests": self._sequence, "counters": dict(self.counters)}
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    """Routes: GET /v1(beta)/models, POST /v1(beta)/models/{m}:generateContent|:streamGenerateContent."""
+
+    state: MockGeminiState = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    # ----- routing -----
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.endswith("/models"):
+            self.state.count("models")
+            return self._send_json(200, {"models": [
+                {"name": f"models/{m}", "supportedGenerationMethods": ["generateContent", "countTokens"]}
+                for m in self.state.config.models
+            ]})
+        if path == "/mock/stats":
+            return self._send_json(200, self.state.stats())
+        self._send_json(404, {"error": {"code": 404, "message": f"Unknown path {path}", "status": "NOT_FOUND"}})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._read_json()
+
+        if path == "/mock/config":
+            self.state.update(body)
+            return self._send_json(200, self.state.stats())
+
+        model, _, method = path.rsplit("/", 1)[-1].partition(":")
+        if method not in ("generateContent", "streamGenerateContent"):
+            return self._send_json(404, {"error": {"code": 404, "message": f"Unknown method {method}", "status": "NOT_FOUND"}})
+        if model not in self.state.config.models:
+            self.state.count("unsupported_model")
+            return self._send_json(404, {"error": {
+                "code": 404, "message": f"models/{model} is not found for API version v1", "status": "NOT_FOUND"
+            }})
+
+        rng = self.state.next_rng()
+        config = self.state.config
+        time.sleep(max(0.0, config.latency_ms + rng.uniform(-config.jitter_ms, config.jitter_ms)) / 1000.0)
+
+        if rng.random() < config.rate_429:
+            self.state.count("rate_limited")
+            return self._send_json(429, {"error": {
+                "code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED"
+            }})
+
+        text, finish_reason = self._response_text(body, rng)
+        self.state.count(method)
+        if method == "generateContent":
+            return self._send_json(200, self._candidate(text, finish_reason, model))
+        self._send_stream(text, finish_reason, model)
+
+    # ----- helpers -----
+
+    def _response_text(self, body: Dict[str, Any], rng: random.Random) -> Tuple[str, str]:
+        prompt = " ".join(
+            part.get("text", "")
+            for content in body.get("contents", [])
+            for part in content.get("parts", [])
+        )
+        text = self.state.select(prompt)["text"]
+        if rng.random() < self.state.config.truncate_rate:
+            self.state.count("truncated")
+            return text[:int(len(text) * self.state.config.truncate_fraction)], "MAX_TOKENS"
+        return text, "STOP"
+
+    @staticmethod
+    def _candidate(text: str, finish_reason: Optional[str], model: str) -> Dict[str, Any]:
+        candidate: Dict[str, Any] = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+        if finish_reason:
+            candidate["finishReason"] = finish_reason
+        return {"candidates": [candidate], "modelVersion": model}
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def _send_json(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, text: str, finish_reason: str, model: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        size = max(1, self.state.config.stream_chunk_chars)
+        chunks = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        try:
+            for index, chunk in enumerate(chunks):
+                last = index == len(chunks) - 1
+                event = self._candidate(chunk, finish_reason if last else None, model)
+                self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+                self.wfile.flush()
+                if not last:
+                    time.sleep(self.state.config.stream_chunk_delay_ms / 1000.0)
+        except (BrokenPipeError, ConnectionResetError):
+            self.state.count("client_disconnected")
+
+def load_recordings(path: Optional[str]) -> List[Dict[str, Any]]:
+    """Recordings from a JSON file (list of {"name", "match", "text"}), or the built-ins."""
+    if not path:
+        return DEFAULT_RECORDINGS
+    recordings = json.loads(Path(path).read_text(encoding="utf-8"))
+    if not isinstance(recordings, list) or not recordings:
+        raise ValueError(f"{path} must contain a non-empty JSON list of recordings")
+    return recordings
+
+def start_mock_server(config: Optional[MockGeminiConfig] = None, host: str = "127.0.0.1", port: int = 0,
+                      recordings: Optional[List[Dict[str, Any]]] = None) -> Tuple[ThreadingHTTPServer, str]:
+    """Start the mock in a daemon thread. Returns (server, base_url); port 0 picks a free port."""
+    state = MockGeminiState(config or MockGeminiConfig(), recordings or DEFAULT_RECORDINGS)
+    handler = type("BoundMockGeminiHandler", (MockGeminiHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://{host}:{server.server_address[1]}"
+    print(f"[MockGemini] Serving on {base_url}")
+    return server, base_url
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Gemini API stand-in for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=800.0)
+    parser.add_argument("--jitter-ms", type=float, default=200.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--recordings", help="JSON file with recorded responses")
+    args = parser.parse_args()
+
+    config = MockGeminiConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_429=args.rate_429,
+        truncate_rate=args.truncate_rate,
+        seed=args.seed
+    )
+    server, base_url = start_mock_server(config, args.host, args.port, load_recordings(args.recordings))
+    print(f"[MockGemini] Set GEMINI_API_BASE={base_url} to use it")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
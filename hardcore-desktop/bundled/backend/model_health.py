@@ -0,0 +1,255 @@
+"""
+Model Health - Per-Model Scoreboard and Circuit Breaker
+Tracks rolling latency, error rate and rate limiting for each Gemini model
+from recorded generation attempts, so requests start on the healthiest
+model and skip models that are known to be down or throttled.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional
+
+from metrics import registry
+
+# Breaker states
+CLOSED = "CLOSED"        # Healthy, requests flow
+OPEN = "OPEN"            # Failing, requests skipped until cooldown ends
+HALF_OPEN = "HALF_OPEN"  # Cooldown over, one probe request allowed
+
+# Status used for hedge losers; says nothing about the model's health
+CANCELLED_STATUS = 499
+
+@dataclass
+class ModelStats:
+    """Rolling health data for one model."""
+    model: str
+    samples: deque = field(default_factory=lambda: deque(maxlen=50))  # (timestamp, success, status, latency_ms)
+    state: str = CLOSED
+    consecutive_failures: int = 0
+    opened_at: float = 0.0
+    cooldown: float = 0.0
+    open_reason: Optional[str] = None
+    probe_in_flight: bool = False
+    probe_claimed_at: float = 0.0
+    probe_owner: Optional[object] = None
+    total_requests: int = 0
+    total_rate_limited: int = 0
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for s in self.samples if not s[1]) / len(self.samples)
+
+    def rate_limited_count(self) -> int:
+        return sum(1 for s in self.samples if s[2] == 429)
+
+    def latency_percentile(self, fraction: float) -> Optional[float]:
+        latencies = sorted(s[3] for s in self.samples if s[1])
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(round(fraction * (len(latencies) - 1))))
+        return float(latencies[index])
+
+class ModelHealthTracker:
+    """
+    Process-wide health tracker with a circuit breaker per model.
+
+    A breaker opens after `failure_threshold` consecutive failures, when
+    the windowed error rate passes `error_rate_threshold`, or immediately
+    on a 429. After its cooldown a single probe is let through
+    (HALF_OPEN): success closes the breaker, failure reopens it with a
+    doubled cooldown. A probe that never reports back (crashed thread,
+    lost process) frees its slot after `probe_timeout` seconds.
+    """
+
+    def __init__(self,
+                 window: int = 50,
+                 failure_threshold: int = 3,
+                 error_rate_threshold: float = 0.5,
+                 min_samples: int = 4,
+                 cooldown: float = 30.0,
+                 rate_limit_cooldown: float = 60.0,
+                 max_cooldown: float = 600.0,
+                 probe_timeout: float = 300.0):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_samples = min_samples
+        self.base_cooldown = cooldown
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self._models: Dict[str, ModelStats] = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, model: str) -> ModelStats:
+        if model not in self._models:
+            self._models[model] = ModelStats(model=model, samples=deque(maxlen=self.window))
+        return self._models[model]
+
+    def record(self, attempt) -> None:
+        """Record a GenerationAttempt (anything with model/status_code/latency_ms/success)."""
+        with self._lock:
+            stats = self._stats(attempt.model)
+            stats.probe_in_flight = False
+            stats.probe_owner = None
+            if attempt.status_code == CANCELLED_STATUS:
+                return
+
+            stats.samples.append((time.time(), attempt.success, attempt.status_code, attempt.latency_ms))
+            stats.total_requests += 1
+
+            if attempt.success:
+                stats.consecutive_failures = 0
+                if stats.state != CLOSED:
+                    print(f"[ModelHealth] {attempt.model}: breaker CLOSED")
+                stats.state = CLOSED
+                stats.cooldown = 0.0
+                stats.open_reason = None
+                return
+
+            stats.consecutive_failures += 1
+            if attempt.status_code == 429:
+                stats.total_rate_limited += 1
+                self._open(stats, "rate limited (429)", self.rate_limit_cooldown)
+            elif stats.state == HALF_OPEN:
+                self._open(stats, "probe failed", stats.cooldown * 2)
+            elif stats.consecutive_failures >= self.failure_threshold:
+                self._open(stats, f"{stats.consecutive_failures} consecutive failures", self.base_cooldown)
+            elif len(stats.samples) >= self.min_samples and stats.error_rate() >= self.error_rate_threshold:
+                self._open(stats, f"error rate {stats.error_rate():.0%}", self.base_cooldown)
+
+    def _open(self, stats: ModelStats, reason: str, cooldown: float):
+        stats.state = OPEN
+        stats.opened_at = time.time()
+        stats.cooldown = min(max(cooldown, self.base_cooldown), self.max_cooldown)
+        stats.open_reason = reason
+        print(f"[ModelHealth] {stats.model}: breaker OPEN for {stats.cooldown:.0f}s ({reason})")
+
+    def _refresh_state(self, stats: ModelStats):
+        if stats.state == OPEN and time.time() - stats.opened_at >= stats.cooldown:
+            stats.state = HALF_OPEN
+        if stats.probe_in_flight and time.time() - stats.probe_claimed_at >= self.probe_timeout:
+            print(f"[ModelHealth] {stats.model}: probe never reported back, releasing it")
+            stats.probe_in_flight = False
+            stats.probe_owner = None
+
+    def is_available(self, model: str) -> bool:
+        """True if a request may be sent to model right now."""
+        with self._lock:
+            stats = self._models.get(model)
+            if stats is None:
+                return True
+            self._refresh_state(stats)
+            if stats.state == CLOSED:
+                return True
+            if stats.state == HALF_OPEN and not stats.probe_in_flight:
+                return True
+            return False
+
+    def acquire(self, model: str, owner: Optional[object] = None) -> bool:
+        """
+        Like is_available, but claims the HALF_OPEN probe slot. record()
+        clears the claim; callers release(model, owner) in a finally so a
+        call that never records (cancelled, crashed) does not keep it.
+        """
+        with self._lock:
+            stats = self._models.get(model)
+            if stats is None:
+                return True
+            self._refresh_state(stats)
+            if stats.state == CLOSED:
+                return True
+            if stats.state == HALF_OPEN and not stats.probe_in_flight:
+                stats.probe_in_flight = True
+                stats.probe_claimed_at = time.time()
+                stats.probe_owner = owner
+                return True
+            return False
+
+    def release(self, model: str, owner: Optional[object] = None) -> None:
+        """Give back a probe slot claimed by acquire() whose outcome was never recorded."""
+        with self._lock:
+            stats = self._models.get(model)
+            if stats is not None and stats.probe_in_flight and stats.probe_owner is owner:
+                stats.probe_in_flight = False
+                stats.probe_owner = None
+
+    def retry_after(self, models: List[str]) -> float:
+        """Seconds until the first of models leaves OPEN."""
+        now = time.time()
+        with self._lock:
+            waits = [
+                max(0.0, s.opened_at + s.cooldown - now)
+                for m in models
+                for s in [self._models.get(m)]
+                if s is not None and s.state == OPEN
+            ]
+        return min(waits) if waits else 0.0
+
+    def rank(self, models: List[str]) -> List[str]:
+        """
+        Order models healthiest first: available before open, then by
+        error rate, then by median latency. Ties keep the given order.
+        """
+        def score(item):
+            position, model = item
+            with self._lock:
+                stats = self._models.get(model)
+                if stats is None:
+                    return (0, 0.0, 0.0, position)
+                self._refresh_state(stats)
+                unavailable = 1 if stats.state == OPEN else 0
+                p50 = stats.latency_percentile(0.5)
+                return (unavailable, round(stats.error_rate(), 2), p50 or 0.0, position)
+
+        return [m for _, m in sorted(enumerate(models), key=score)]
+
+    def scoreboard(self) -> Dict[str, Any]:
+        """Snapshot of every tracked model for the /models/health endpoint."""
+        now = time.time()
+        board = {}
+        with self._lock:
+            for model, stats in self._models.items():
+                self._refresh_state(stats)
+                board[model] = {
+                    "state": stats.state,
+                    "open_reason": stats.open_reason,
+                    "retry_after_s": round(max(0.0, stats.opened_at + stats.cooldown - now), 1)
+                        if stats.state == OPEN else 0.0,
+                    "window_requests": len(stats.samples),
+                    "error_rate": round(stats.error_rate(), 3),
+                    "rate_limited_in_window": stats.rate_limited_count(),
+                    "consecutive_failures": stats.consecutive_failures,
+                    "latency_p50_ms": stats.latency_percentile(0.5),
+                    "latency_p95_ms": stats.latency_percentile(0.95),
+                    "total_requests": stats.total_requests,
+                    "total_rate_limited": stats.total_rate_limited,
+                }
+        return board
+
+# Shared by every StrictGeminiEngine in this process
+model_health = ModelHealthTracker(
+    window=int(os.getenv("GEMINI_HEALTH_WINDOW", "50")),
+    failure_threshold=int(os.getenv("GEMINI_BREAKER_FAILURES", "3")),
+    error_rate_threshold=float(os.getenv("GEMINI_BREAKER_ERROR_RATE", "0.5")),
+    cooldown=float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30")),
+    rate_limit_cooldown=float(os.getenv("GEMINI_BREAKER_429_COOLDOWN", "60")),
+    probe_timeout=float(os.getenv("GEMINI_BREAKER_PROBE_TIMEOUT", "300")),
+)
+
+_BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+def _collect_metrics():
+    board = model_health.scoreboard()
+    return [
+        ("hardcore_model_breaker_state", "gauge", "Circuit breaker per model (0=closed, 1=half-open, 2=open)",
+         [({"model": m}, _BREAKER_STATE_VALUES[row["state"]]) for m, row in board.items()]),
+        ("hardcore_model_error_rate", "gauge", "Windowed Gemini error rate per model",
+         [({"model": m}, row["error_rate"]) for m, row in board.items()]),
+    ]
+
+registry.register_collector(_collect_metrics)
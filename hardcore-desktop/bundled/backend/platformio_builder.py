@@ -1,9 +1,23 @@
 import os
+import re
+import asyncio
 import subprocess
 import shutil
+import tempfile
 import json
+import configparser
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
+
+from metrics import registry, span
+from build_cache import get_build_cache, toolchain_version
+from build_scheduler import kill_process_tree
+from build_runner import StreamedProcess
+from build_diagnostics import parse_build_log
+from toolchain_registry import get_pio_executable, board_definitions, driver_database
+import compile_cache
+
+BUILDS_IN_FLIGHT = registry.gauge("hardcore_builds_in_flight", "PlatformIO builds/flashes currently running")
 
 class PlatformIOBuilder:
     """Handles firmware compilation and flashing using PlatformIO."""
@@ -12,7 +26,10 @@ class PlatformIOBuilder:
         self.workspace = Path(workspace_dir)
         self.workspace.mkdir(exist_ok=True)
     
-    def build_and_flash(self, firmware_code: str, board_type: str = "esp32", flash: bool = False) -> Dict[str, Any]:
+    @BUILDS_IN_FLIGHT.track_inprogress()
+    def build_and_flash(self, firmware_code: str, board_type: str = "esp32", flash: bool = False,
+                        clean: bool = False, project_id: str = "current_project",
+                        cancel_token=None) -> Dict[str, Any]:
         """
         Compile firmware and optionally flash to connected board.
         
@@ -20,33 +37,26 @@ class PlatformIOBuilder:
             firmware_code: Generated firmware code
             board_type: Target board (esp32, arduino, etc.)
             flash: Whether to flash to board after compilation
+            clean: Wipe the project (including .pio object files) first
+            project_id: Build directory under the workspace (one per project)
+            cancel_token: build_scheduler.CancelToken that can kill pio mid-run
         
         Returns:
             Dictionary with build status and logs
         """
         try:
-            # Create PlatformIO project
-            project_dir = self.workspace / "current_project"
-            if project_dir.exists():
-                shutil.rmtree(project_dir)
-            project_dir.mkdir()
-            
-            # Initialize PlatformIO project
-            self._init_platformio_project(project_dir, board_type)
-            
-            # Write firmware code
-            main_file = project_dir / "src" / "main.cpp"
-            main_file.write_text(firmware_code)
+            project_dir = self._project_dir(project_id)
+            self._prepare_project(project_dir, firmware_code, board_type, clean)
             
             # Build
-            build_result = self._compile(project_dir)
+            build_result = self._compile(project_dir, cancel_token)
             
             if not build_result["success"]:
                 return build_result
             
-            # Flash if requested
+            # Flash if requested (artifacts are fresh or restored from cache, skip SCons)
             if flash:
-                flash_result = self._flash(project_dir)
+                flash_result = self._flash(project_dir, skip_build=True, cancel_token=cancel_token)
                 return {**build_result, **flash_result}
             
             return build_result
@@ -58,68 +68,213 @@ class PlatformIOBuilder:
                 "stage": "setup"
             }
     
-    def _init_platformio_project(self, project_dir: Path, board_type: str):
-        """Initialize PlatformIO project with platformio.ini."""
+    def _project_dir(self, project_id: str) -> Path:
+        """Per-project build directory; project_id is sanitized to a single path component."""
+        safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", project_id or "").strip(".") or "current_project"
+        return self.workspace / safe_id
+    
+    def write_project(self, project_id: str, files: Dict[str, str], board_type: str = "esp32",
+                      lib_deps: Optional[List[str]] = None) -> Path:
+        """
+        Save sources into the project's build directory (the one builds compile).
+        
+        Args:
+            project_id: Project whose build directory to write
+            files: Paths relative to the project (e.g. "src/main.cpp") -> content
+            board_type: Target board for platformio.ini
+            lib_deps: Libraries for platformio.ini; None keeps the current ones
+        
+        Returns:
+            The project directory
+        """
+        project_dir = self._project_dir(project_id)
+        paths = {}
+        for name in files:
+            paths[name] = (project_dir / name).resolve()
+            if project_dir.resolve() not in paths[name].parents:
+                raise ValueError(f"File path outside the project: {name}")
+        
+        project_dir.mkdir(parents=True, exist_ok=True)
+        self._init_platformio_project(project_dir, board_type, lib_deps=lib_deps)
+        for name, content in files.items():
+            # Unchanged files keep their mtime; each write is atomic
+            self._write_if_changed(paths[name], content)
+        return project_dir
+    
+    def _run_process(self, cmd: list, cwd: Path, timeout: float, cancel_token=None) -> subprocess.CompletedProcess:
+        """subprocess.run(capture_output=True) whose process a CancelToken can kill."""
+        process = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                   start_new_session=True)
+        if cancel_token:
+            cancel_token.attach(process)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_tree(process)
+            process.communicate()
+            raise
+        finally:
+            if cancel_token:
+                cancel_token.detach(process)
+        return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+    
+    def _prepare_project(self, project_dir: Path, firmware_code: str, board_type: str,
+                         clean: bool = False) -> bool:
+        """
+        Bring project_dir up to date for a build. Returns True if any file changed.
         
-        # Load board definitions
-        base_dir = Path(__file__).parent.parent
-        board_def_path = base_dir / "orchestrator" / "board_definitions.json"
+        Incremental by default: files are only rewritten when their content
+        changed and .pio is kept, so SCons reuses the compiled framework and
+        library objects and only recompiles what the edit touched.
+        """
+        if clean and project_dir.exists():
+            print(f"[PlatformIOBuilder] Clean build: removing {project_dir}")
+            shutil.rmtree(project_dir)
+        project_dir.mkdir(parents=True, exist_ok=True)
         
+        ini_changed = self._init_platformio_project(project_dir, board_type)
+        code_changed = self._write_if_changed(project_dir / "src" / "main.cpp", firmware_code)
+        
+        if ini_changed or code_changed:
+            print(f"[PlatformIOBuilder] Updated: "
+                  f"{', '.join(n for n, c in (('platformio.ini', ini_changed), ('main.cpp', code_changed)) if c)}")
+        else:
+            print(f"[PlatformIOBuilder] Sources unchanged, reusing previous build")
+        return ini_changed or code_changed
+    
+    @staticmethod
+    def _write_if_changed(path: Path, content: str) -> bool:
+        """
+        Write content only if it differs from what is on disk. Unchanged
+        files keep their mtime, which is what lets SCons skip rebuilding them.
+        The new content goes to a temp file that replaces path in one step,
+        so a build running meanwhile never compiles a half-written file.
+        """
+        try:
+            if path.read_text(encoding="utf-8") == content:
+                return False
+        except (FileNotFoundError, UnicodeDecodeError):
+            pass
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        return True
+    
+    def board_platformio_config(self, board_type: str) -> Dict[str, Any]:
+        """PlatformIO platform/board/framework/upload settings for a board type."""
         # Defaults
-        platform = "espressif32"
-        board = "esp32dev"
-        framework = "arduino"
-        upload_protocol = None
-        upload_speed = None
+        conf = {
+            "platform": "espressif32",
+            "board": "esp32dev",
+            "framework": "arduino",
+            "upload_protocol": None,
+            "upload_speed": None,
+        }
+        conf.update({k: v for k, v in board_definitions.platformio_config(board_type).items() if k in conf})
+        return conf
+    
+    def _init_platformio_project(self, project_dir: Path, board_type: str,
+                                 lib_deps: Optional[List[str]] = None) -> bool:
+        """
+        Initialize PlatformIO project with platformio.ini. Returns True if it changed.
         
-        if board_def_path.is_file():
-            try:
-                with board_def_path.open() as f:
-                    defs = json.load(f)
-                    if board_type in defs:
-                        conf = defs[board_type].get("platformio", {})
-                        platform = conf.get("platform", platform)
-                        board = conf.get("board", board)
-                        framework = conf.get("framework", framework)
-                        upload_protocol = conf.get("upload_protocol")
-                        upload_speed = conf.get("upload_speed")
-            except Exception as e:
-                print(f"Error loading board definitions: {e}")
-
-        ini_content = f"""[env:default]
-platform = {platform}
-board = {board}
-framework = {framework}
+        This is the project's only platformio.ini writer. lib_deps=None keeps the
+        libraries (and build_flags) already in the file, so building what
+        /execute saved leaves the ini, and with it the incremental build, untouched.
+        """
+        conf = self.board_platformio_config(board_type)
+        ini_path = project_dir / "platformio.ini"
+        options = self._ini_env_options(ini_path)
+        if lib_deps is not None:
+            options["lib_deps"] = list(lib_deps)
+        
+        # Shared object cache: the framework core is compiled once per board, not per project
+        ini_content = compile_cache.platformio_section(conf["platform"], conf["board"], conf["framework"])
+        ini_content += f"""[env:default]
+platform = {conf['platform']}
+board = {conf['board']}
+framework = {conf['framework']}
 monitor_speed = 115200
 """
-        if upload_protocol:
-            ini_content += f"upload_protocol = {upload_protocol}\n"
-        if upload_speed:
-            ini_content += f"upload_speed = {upload_speed}\n"
+        if conf["upload_protocol"]:
+            ini_content += f"upload_protocol = {conf['upload_protocol']}\n"
+        if conf["upload_speed"]:
+            ini_content += f"upload_speed = {conf['upload_speed']}\n"
+        for option in ("lib_deps", "build_flags"):
+            if options.get(option):
+                ini_content += f"{option} =\n" + "".join(f"    {value}\n" for value in options[option])
         
-        (project_dir / "platformio.ini").write_text(ini_content)
         (project_dir / "src").mkdir(exist_ok=True)
+        return self._write_if_changed(ini_path, ini_content)
     
-    def _compile(self, project_dir: Path) -> Dict[str, Any]:
-        """Compile firmware using PlatformIO."""
+    @staticmethod
+    def _ini_env_options(ini_path: Path) -> Dict[str, List[str]]:
+        """lib_deps/build_flags of the first [env:*] section of an existing platformio.ini."""
+        parser = configparser.ConfigParser(interpolation=None, strict=False)
         try:
-            pio_exe = os.path.expanduser(r"~\AppData\Roaming\Python\Python312\Scripts\pio.exe")
-            if not os.path.isfile(pio_exe):
-                pio_exe = "pio"  # fallback to PATH
-            result = subprocess.run(
-                [pio_exe, "run"],
-                cwd=project_dir,
-                capture_output=True,
-                text=True,
-                timeout=120
-            )
+            parser.read_string(ini_path.read_text(encoding="utf-8"))
+        except (OSError, UnicodeDecodeError, configparser.Error):
+            return {}
+        for section in parser.sections():
+            if section.startswith("env:"):
+                return {
+                    option: [v.strip() for v in parser.get(section, option).splitlines() if v.strip()]
+                    for option in ("lib_deps", "build_flags") if parser.has_option(section, option)
+                }
+        return {}
+    
+    @span("build", "compile", success_key="success")
+    def _compile(self, project_dir: Path, cancel_token=None, use_artifact_cache: bool = True,
+                 timeout: float = 120) -> Dict[str, Any]:
+        """Compile firmware using PlatformIO, or restore it from the build cache."""
+        build_dir = project_dir / ".pio" / "build" / "default"
+        firmware_path = str(build_dir / "firmware.bin")
+        try:
+            pio_exe = get_pio_executable()
+            
+            cache = get_build_cache() if use_artifact_cache else None
+            cache_key = self._build_cache_key(project_dir, pio_exe) if cache else None
+            if cache_key:
+                cached = cache.get(cache_key)
+                if cached and cache.restore(cache_key, build_dir):
+                    print(f"[PlatformIOBuilder] Build cache hit ({cache_key[:12]}), skipping pio run")
+                    return {
+                        "success": True,
+                        "stage": "compile",
+                        "stdout": cached.get("stdout", ""),
+                        "stderr": cached.get("stderr", ""),
+                        "diagnostics": parse_build_log(cached.get("stdout", "") + "\n" + cached.get("stderr", "")),
+                        "firmware_path": firmware_path,
+                        "cached": True
+                    }
+            
+            result = self._run_process([pio_exe, "run"], project_dir, timeout=timeout, cancel_token=cancel_token)
+            
+            if cancel_token and cancel_token.cancelled:
+                return {
+                    "success": False,
+                    "error": "Build cancelled",
+                    "stage": "compile"
+                }
+            
+            if result.returncode == 0 and cache_key:
+                cache.put(cache_key, build_dir, result.stdout, result.stderr)
             
             return {
                 "success": result.returncode == 0,
                 "stage": "compile",
                 "stdout": result.stdout,
                 "stderr": result.stderr,
-                "firmware_path": str(project_dir / ".pio" / "build" / "default" / "firmware.bin")
+                "diagnostics": parse_build_log(result.stdout + "\n" + result.stderr),
+                "firmware_path": firmware_path,
+                "cached": False,
+                "compile_cache": compile_cache.record_build_output(result.stdout)
             }
             
         except FileNotFoundError:
@@ -131,7 +286,7 @@ monitor_speed = 115200
         except subprocess.TimeoutExpired:
             return {
                 "success": False,
-                "error": "Compilation timeout (>120 seconds)",
+                "error": f"Compilation timeout (>{timeout:g} seconds)",
                 "stage": "compile"
             }
         except Exception as e:
@@ -141,18 +296,19 @@ monitor_speed = 115200
                 "stage": "compile"
             }
     
-    def _flash(self, project_dir: Path) -> Dict[str, Any]:
-        """Flash compiled firmware to connected board."""
+    @span("build", "flash", success_key="flash_success")
+    def _flash(self, project_dir: Path, skip_build: bool = False, cancel_token=None) -> Dict[str, Any]:
+        """
+        Flash compiled firmware to connected board. skip_build uploads the
+        existing artifacts as-is (nobuild target) instead of re-running SCons.
+        """
         try:
-            pio_exe = os.path.expanduser(r"~\AppData\Roaming\Python\Python312\Scripts\pio.exe")
-            if not os.path.isfile(pio_exe):
-                pio_exe = "pio"
-            result = subprocess.run(
-                [pio_exe, "run", "--target", "upload"],
-                cwd=project_dir,
-                capture_output=True,
-                text=True,
-                timeout=60
+            pio_exe = get_pio_executable()
+            result = self._run_process(
+                [pio_exe, "run"] + self._upload_targets(skip_build),
+                project_dir,
+                timeout=60,
+                cancel_token=cancel_token
             )
             
             return {
@@ -167,49 +323,83 @@ monitor_speed = 115200
                 "flash_error": str(e)
             }
     
-    def build_and_flash_stream(self, firmware_code: str, board_type: str = "esp32", flash: bool = False):
+    def _upload_targets(self, skip_build: bool) -> list:
+        if skip_build:
+            return ["--target", "nobuild", "--target", "upload"]
+        return ["--target", "upload"]
+    
+    def _build_cache_key(self, project_dir: Path, pio_exe: str) -> Optional[str]:
+        """Artifact cache key for the project's current sources, board and toolchain."""
+        def read(name: str) -> str:
+            path = project_dir / name
+            return path.read_text(encoding="utf-8") if path.is_file() else ""
+        
+        main_cpp = read("src/main.cpp")
+        if not main_cpp:
+            return None
+        platformio_ini = read("platformio.ini")
+        board_match = re.search(r'^\s*board\s*=\s*(\S+)', platformio_ini, re.MULTILINE)
+        return get_build_cache().make_key(
+            main_cpp=main_cpp,
+            resolved_pins_h=read("src/resolved_pins.h"),
+            platformio_ini=platformio_ini,
+            board=board_match.group(1) if board_match else "",
+            toolchain_version=toolchain_version(pio_exe)
+        )
+    
+    def _start_stream_build(self, firmware_code: str, board_type: str, clean: bool,
+                            project_id: str) -> Tuple[Path, str, Optional[str], bool]:
+        """
+        Setup for a streaming build: write the project, resolve pio and try
+        the artifact cache. Returns (project_dir, pio_exe, cache_key,
+        restored). Blocking, so it runs in a thread.
+        """
+        project_dir = self._project_dir(project_id)
+        self._prepare_project(project_dir, firmware_code, board_type, clean)
+        pio_exe = get_pio_executable()
+        
+        cache = get_build_cache()
+        cache_key = self._build_cache_key(project_dir, pio_exe) if cache else None
+        restored = bool(cache_key and cache.get(cache_key)
+                        and cache.restore(cache_key, project_dir / ".pio" / "build" / "default"))
+        return (project_dir, pio_exe, cache_key, restored)
+    
+    def _finish_stream_build(self, project_dir: Path, cache_key: Optional[str], log: str, succeeded: bool):
+        """Feed the compile log to the compile cache stats and store a successful build's artifacts."""
+        compile_cache.record_build_output(log)
+        if succeeded and cache_key:
+            get_build_cache().put(cache_key, project_dir / ".pio" / "build" / "default", log)
+    
+    @BUILDS_IN_FLIGHT.track_inprogress()
+    async def abuild_and_flash_stream(self, firmware_code: str, board_type: str = "esp32", flash: bool = False,
+                                      clean: bool = False, project_id: str = "current_project",
+                                      cancel_token=None):
         """
-        Compile and flash with real-time output streaming.
-        Yields log lines as strings.
+        Compile and optionally flash with real-time output streaming. pio runs
+        under asyncio, output arrives in batched chunks, and closing the
+        generator (client disconnect) kills pio.
         """
         try:
-            # Create PlatformIO project
-            project_dir = self.workspace / "current_project"
-            if project_dir.exists():
-                shutil.rmtree(project_dir)
-            project_dir.mkdir()
-            
-            # Initialize PlatformIO project
-            self._init_platformio_project(project_dir, board_type)
-            
-            # Write firmware code
-            main_file = project_dir / "src" / "main.cpp"
-            main_file.write_text(firmware_code)
-            
             # Build
             yield "Starting build process...\n"
-            pio_exe = os.path.expanduser(r"~\AppData\Roaming\Python\Python312\Scripts\pio.exe")
-            if not os.path.isfile(pio_exe):
-                pio_exe = "pio"
-
-            # Compile process
-            process = subprocess.Popen(
-                [pio_exe, "run"],
-                cwd=project_dir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
+            # File writes, tree hashing and artifact copies stay off the event loop
+            project_dir, pio_exe, cache_key, restored = await asyncio.to_thread(
+                self._start_stream_build, firmware_code, board_type, clean, project_id
             )
             
-            for line in process.stdout:
-                yield line
+            if restored:
+                yield f"Using cached build ({cache_key[:12]}), sources unchanged since it was compiled\n"
+            else:
+                compile_proc = StreamedProcess([pio_exe, "run"], project_dir, timeout=120,
+                                               cancel_token=cancel_token, collect=True)
+                async for chunk in compile_proc.chunks():
+                    yield chunk
 
-            process.wait()
-            if process.returncode != 0:
-                yield "Build failed!\n"
-                return
+                await asyncio.to_thread(self._finish_stream_build, project_dir, cache_key,
+                                        compile_proc.log, compile_proc.returncode == 0)
+                if compile_proc.returncode != 0:
+                    yield "Build failed!\n"
+                    return
 
             if not flash:
                 yield "Build successful!\n"
@@ -217,25 +407,18 @@ monitor_speed = 115200
 
             # Flash process
             yield "Starting flash process...\n"
-            process = subprocess.Popen(
-                [pio_exe, "run", "--target", "upload"],
-                cwd=project_dir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
-            )
-
-            for line in process.stdout:
-                yield line
+            flash_proc = StreamedProcess([pio_exe, "run"] + self._upload_targets(skip_build=True),
+                                         project_dir, timeout=60, cancel_token=cancel_token)
+            async for chunk in flash_proc.chunks():
+                yield chunk
             
-            process.wait()
-            if process.returncode == 0:
+            if flash_proc.returncode == 0:
                 yield "Flash successful!\n"
             else:
                 yield "Flash failed!\n"
 
+        except FileNotFoundError:
+            yield "Error: PlatformIO not found. Install with: pip install platformio\n"
         except Exception as e:
             yield f"Error: {str(e)}\n"
 
@@ -264,32 +447,126 @@ monitor_speed = 115200
         
         return suggestions
 
+    @staticmethod
+    def _is_bluetooth(description: str, hwid: str) -> bool:
+        return "bluetooth" in description.lower() or "bth" in hwid.lower() or "BTHENUM" in hwid
+
+    @staticmethod
+    def _parse_vid_pid(hwid: str) -> Optional[str]:
+        """VID:PID from a hardware id, in any of the formats pio/pyserial report."""
+        # Handle "VID:PID=1A86:7523" format (USB)
+        if "VID:PID=" in hwid:
+            return hwid.split("VID:PID=")[1].split()[0]
+
+        # Handle "VID&000105D6_PID&000A" format (Bluetooth)
+        if "VID&" in hwid and "PID&" in hwid:
+            try:
+                vid_match = hwid.split("VID&")[1].split("_")[0]
+                pid_match = hwid.split("PID&")[1].split("\\")[0].split("_")[0]
+                # Convert to hex format
+                return f"{int(vid_match, 16):04X}:{int(pid_match, 16):04X}"
+            except ValueError:
+                pass
+
+        # Handle "1A86:7523" format (direct)
+        for part in hwid.split():
+            if ":" in part and len(part) == 9 and all(c in "0123456789abcdefABCDEF:" for c in part):
+                return part
+        return None
+
+    def _describe_device(self, port: str, description: str, hwid: str,
+                         vid_pid: Optional[str] = None) -> Dict[str, Any]:
+        """Board type, driver and pins for one serial port, from its description and VID:PID."""
+        vid_pid = vid_pid or self._parse_vid_pid(hwid)
+        board_type = "unknown"
+        driver_url = None
+        pins = None
+
+        # Try to infer from description first (for Bluetooth and other devices)
+        description_lower = description.lower()
+        hwid_lower = hwid.lower()
+
+        if "bluetooth" in description_lower or "bth" in hwid_lower:
+            # Bluetooth device - can't determine board type from BT alone,
+            # the VID/PID lookup below may still find it
+            pass
+        elif "ch340" in description_lower or "ch341" in description_lower:
+            # CH340 USB-to-Serial - common on Arduino clones
+            board_type = "arduino_nano"  # Most common with CH340
+        elif "cp210" in description_lower or "cp21" in description_lower:
+            # CP210x USB-to-Serial - common on ESP32
+            board_type = "esp32"
+        elif "ftdi" in description_lower or "ft232" in description_lower:
+            # FTDI - could be various boards, but often Arduino
+            board_type = "arduino_uno"
+        elif "arduino" in description_lower:
+            if "nano" in description_lower:
+                board_type = "arduino_nano"
+            elif "mega" in description_lower:
+                board_type = "arduino_mega"
+            else:
+                board_type = "arduino_uno"
+        elif "esp32" in description_lower or "esp-32" in description_lower:
+            board_type = "esp32"
+        elif "stm32" in description_lower:
+            if "f4" in description_lower:
+                board_type = "stm32f4"
+            elif "f7" in description_lower:
+                board_type = "stm32f7"
+            elif "l4" in description_lower:
+                board_type = "stm32l4"
+            else:
+                board_type = "stm32f4"  # Default
+
+        # Try VID/PID lookup if available
+        if vid_pid and board_type == "unknown":
+            try:
+                vid, pid = vid_pid.split(":")
+                product_entry = driver_database.lookup(vid, pid)
+                if product_entry:
+                    raw_name = product_entry.get("name", "unknown")
+                    # Normalize name: remove (CH340) suffix and handle spaces
+                    board_type = raw_name.replace(" (CH340)", "").lower().replace(" ", "_")
+
+                    # Map common variations
+                    if "nano" in board_type:
+                        board_type = "arduino_nano"
+                    elif "uno" in board_type:
+                        board_type = "arduino_uno"
+                    elif "mega" in board_type:
+                        board_type = "arduino_mega"
+                    elif "esp32" in board_type or "esp-32" in board_type:
+                        board_type = "esp32"
+
+                    driver_url = product_entry.get("driver_url")
+
+                if board_type:
+                    pins = board_definitions.pins(board_type)
+            except Exception as e:
+                print(f"Error parsing VID/PID {vid_pid}: {e}")
+
+        return {
+            "port": port,
+            "description": description,
+            "hwid": hwid,
+            "vid_pid": vid_pid,
+            "board_type": board_type,
+            "driver_url": driver_url,
+            "pins": pins,
+            "label": f"{description} ({port})",
+            "needs_manual_selection": board_type == "unknown",
+            "suggested_boards": self._suggest_boards(description, hwid) if board_type == "unknown" else []
+        }
+
     def detect_connected_boards(self) -> list:
-        """Detect connected boards via serial ports with detailed info.
+        """Detect connected boards by asking `pio device list`.
         Returns a list of dicts with keys: port, description, board_type, driver_url (optional), pins (optional).
+        The /boards endpoint serves device_monitor's in-process inventory instead; this is
+        the fallback when pyserial is not available.
         """
-        log_path = r"C:\Users\shriv\.gemini\antigravity\scratch\Protoforge\Hardcore.ai\orchestrator\debug_log.txt"
-        with open(log_path, "a") as log:
-            log.write("detect_connected_boards called\n")
-
-        # Load driver DB and board definitions (relative to project root)
-        base_dir = Path(__file__).parent.parent  # project root
-        driver_path = base_dir / "orchestrator" / "driver_db.json"
-        board_def_path = base_dir / "orchestrator" / "board_definitions.json"
-        driver_db = {}
-        board_defs = {}
-        if driver_path.is_file():
-            with driver_path.open() as f:
-                driver_db = json.load(f)
-        if board_def_path.is_file():
-            with board_def_path.open() as f:
-                board_defs = json.load(f)
         devices = []
         try:
-            # Use explicit path if available
-            pio_exe = os.path.expanduser(r"~\AppData\Roaming\Python\Python312\Scripts\pio.exe")
-            if not os.path.isfile(pio_exe):
-                pio_exe = "pio"
+            pio_exe = get_pio_executable()
 
             # Use PlatformIO JSON device list if available
             result = subprocess.run(
@@ -298,179 +575,24 @@ monitor_speed = 115200
                 text=True,
                 timeout=10,
             )
-            
-            with open("debug_log.txt", "a") as log:
-                log.write(f"PIO JSON Result: {result.returncode}\nStdout: {result.stdout}\nStderr: {result.stderr}\n")
 
             if result.returncode == 0 and result.stdout.strip():
                 data = json.loads(result.stdout)
                 for d in data:
-                    # Filter out Bluetooth devices - only show USB/wired connections
                     hwid = d.get("hwid", "")
                     description = d.get("description", "")
-                    
-                    # Skip Bluetooth devices
-                    if "bluetooth" in description.lower() or "bth" in hwid.lower() or "BTHENUM" in hwid:
-                        with open("debug_log.txt", "a") as log:
-                            log.write(f"Skipping Bluetooth device: {description} on {d.get('port')}\n")
+                    # Filter out Bluetooth devices - only show USB/wired connections
+                    if self._is_bluetooth(description, hwid):
                         continue
-                    hwid = d.get("hwid", "")
-                    description = d.get("description", "")
-                    port = d.get("port", "")
-                    # Parse VID:PID from hwid - handle multiple formats
-                    vid_pid = None
-                    vid = None
-                    pid = None
-                    
-                    # Handle "VID:PID=1A86:7523" format (USB)
-                    if "VID:PID=" in hwid:
-                        vid_pid = hwid.split("VID:PID=")[1].split()[0]
-                    
-                    # Handle "VID&000105D6_PID&000A" format (Bluetooth)
-                    elif "VID&" in hwid and "PID&" in hwid:
-                        try:
-                            vid_match = hwid.split("VID&")[1].split("_")[0]
-                            pid_match = hwid.split("PID&")[1].split("\\")[0].split("_")[0]
-                            # Convert to hex format
-                            vid = f"{int(vid_match, 16):04X}"
-                            pid = f"{int(pid_match, 16):04X}"
-                            vid_pid = f"{vid}:{pid}"
-                        except:
-                            pass
-                    
-                    # Handle "1A86:7523" format (direct)
-                    if not vid_pid:
-                        for part in hwid.split():
-                            if ":" in part and len(part) == 9 and all(c in "0123456789abcdefABCDEF:" for c in part):
-                                vid_pid = part
-                                break
-                    
-                    with open("debug_log.txt", "a") as log:
-                        log.write(f"Processing HWID: {hwid}, Parsed VID:PID: {vid_pid}\n")
-
-                    board_type = "unknown"
-                    driver_url = None
-                    pins = None
-                    
-                    # Try to infer from description first (for Bluetooth and other devices)
-                    description_lower = description.lower()
-                    hwid_lower = hwid.lower()
-                    
-                    if "bluetooth" in description_lower or "bth" in hwid_lower:
-                        # Bluetooth device - can't determine board type from BT alone
-                        # But we can check if it has VID/PID in the hwid
-                        if vid_pid:
-                            # Try to look it up
-                            pass  # Will be handled by VID/PID lookup below
-                        else:
-                            board_type = "unknown"
-                    elif "ch340" in description_lower or "ch341" in description_lower:
-                        # CH340 USB-to-Serial - common on Arduino clones
-                        board_type = "arduino_nano"  # Most common with CH340
-                    elif "cp210" in description_lower or "cp21" in description_lower:
-                        # CP210x USB-to-Serial - common on ESP32
-                        board_type = "esp32"
-                    elif "ftdi" in description_lower or "ft232" in description_lower:
-                        # FTDI - could be various boards, but often Arduino
-                        board_type = "arduino_uno"
-                    elif "arduino" in description_lower:
-                        if "nano" in description_lower:
-                            board_type = "arduino_nano"
-                        elif "mega" in description_lower:
-                            board_type = "arduino_mega"
-                        else:
-                            board_type = "arduino_uno"
-                    elif "esp32" in description_lower or "esp-32" in description_lower:
-                        board_type = "esp32"
-                    elif "stm32" in description_lower:
-                        if "f4" in description_lower:
-                            board_type = "stm32f4"
-                        elif "f7" in description_lower:
-                            board_type = "stm32f7"
-                        elif "l4" in description_lower:
-                            board_type = "stm32l4"
-                        else:
-                            board_type = "stm32f4"  # Default
-                    
-                    # Try VID/PID lookup if available
-                    if vid_pid and board_type == "unknown":
-                        try:
-                            vid, pid = vid_pid.split(":")
-                            # Try both lowercase and uppercase keys
-                            vid_key_lower = f"0x{vid.lower()}"
-                            vid_key_upper = f"0x{vid.upper()}"
-                            
-                            with open("debug_log.txt", "a") as log:
-                                log.write(f"Loading DB from: {driver_path}\n")
-
-                            vendor_entry = driver_db.get(vid_key_lower) or driver_db.get(vid_key_upper)
-                            
-                            if vendor_entry:
-                                pid_key_lower = f"0x{pid.lower()}"
-                                pid_key_upper = f"0x{pid.upper()}"
-                                
-                                product_entry = vendor_entry.get(pid_key_lower) or vendor_entry.get(pid_key_upper)
-                                
-                                if product_entry:
-                                    with open("debug_log.txt", "a") as log:
-                                        log.write(f"Found product entry: {product_entry}\n")
-
-                                    raw_name = product_entry.get("name", "unknown")
-                                    # Normalize name: remove (CH340) suffix and handle spaces
-                                    board_type = raw_name.replace(" (CH340)", "").lower().replace(" ", "_")
-                                    
-                                    # Map common variations
-                                    if "nano" in board_type:
-                                        board_type = "arduino_nano"
-                                    elif "uno" in board_type:
-                                        board_type = "arduino_uno"
-                                    elif "mega" in board_type:
-                                        board_type = "arduino_mega"
-                                    elif "esp32" in board_type or "esp-32" in board_type:
-                                        board_type = "esp32"
-                                    
-                                    with open("debug_log.txt", "a") as log:
-                                        log.write(f"Raw Name: '{raw_name}', Normalized: '{board_type}'\n")
-
-                                    driver_url = product_entry.get("driver_url")
-                            
-                            with open("debug_log.txt", "a") as log:
-                                log.write(f"  Lookup result - Board: {board_type}\n")
-
-                            if board_type and board_type in board_defs:
-                                pins = board_defs[board_type].get("pins")
-                        except Exception as e:
-                            with open("debug_log.txt", "a") as log:
-                                log.write(f"  Error parsing VID/PID {vid_pid}: {e}\n")
-                            print(f"Error parsing VID/PID {vid_pid}: {e}")
-                    
-                    devices.append({
-                        "port": port,
-                        "description": description,
-                        "hwid": hwid,
-                        "board_type": board_type,
-                        "driver_url": driver_url,
-                        "pins": pins,
-                        "label": f"{description} ({port})",
-                        "needs_manual_selection": board_type == "unknown",
-                        "suggested_boards": self._suggest_boards(description, hwid) if board_type == "unknown" else []
-                    })
-            
+                    devices.append(self._describe_device(d.get("port", ""), description, hwid))
                 return devices
-                
+
         except Exception as e:
-            with open("debug_log.txt", "a") as log:
-                log.write(f"JSON detection failed: {e}\n")
-            pass
-        
+            print(f"[PlatformIO] JSON device detection failed: {e}")
+
         # Fallback to text parsing (unchanged)
         try:
-            with open("debug_log.txt", "a") as log:
-                log.write("Falling back to text parsing\n")
-
-            pio_exe = os.path.expanduser(r"~\AppData\Roaming\Python\Python312\Scripts\pio.exe")
-            if not os.path.isfile(pio_exe):
-                pio_exe = "pio"
+            pio_exe = get_pio_executable()
                 
             result = subprocess.run(
                 [pio_exe, "device", "list"],
@@ -511,9 +633,8 @@ monitor_speed = 115200
             return devices
         except Exception as e:
             error_msg = str(e)
-            with open("debug_log.txt", "a") as log:
-                log.write(f"Board detection error: {error_msg}\n")
-            
+            print(f"[PlatformIO] Board detection error: {error_msg}")
+
             # Return helpful error message
             return [{
                 "error": error_msg,
@@ -0,0 +1,347 @@
+"""
+Rate Limiter - Client-Side Quota Scheduling for the Gemini API Key
+Token buckets for requests/min and tokens/min per API key, fronted by a
+bounded priority queue that schedules fairly across projects, so bursts
+of /execute calls wait their turn instead of colliding into 429 storms.
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional
+
+from metrics import registry
+
+class RateLimitQueueFull(Exception):
+    """The per-key request queue is at capacity."""
+
+class RateLimitTimeout(Exception):
+    """A queued request waited longer than the queue timeout."""
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously up to capacity (None = unlimited)."""
+
+    def __init__(self, capacity: Optional[float], refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_per_second)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        if self.capacity is None:
+            return 0.0
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill_locked()
+            if self._tokens >= amount:
+                return 0.0
+            return (amount - self._tokens) / self.refill_per_second
+
+    def take(self, amount: float):
+        if self.capacity is None:
+            return
+        with self._lock:
+            self._refill_locked()
+            self._tokens -= min(amount, self.capacity)
+
+    @property
+    def available(self) -> Optional[float]:
+        if self.capacity is None:
+            return None
+        with self._lock:
+            self._refill_locked()
+            return self._tokens
+
+@dataclass
+class Ticket:
+    """A queued request waiting for quota."""
+    project_id: str
+    tokens: int
+    priority: int
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+class KeyRateLimiter:
+    """
+    Requests/min + tokens/min limiter for one API key.
+
+    Async callers queue in a bounded priority queue: lower `priority`
+    values are served first, and within a priority level projects are
+    served round-robin so one busy project cannot starve the others.
+    A single dispatcher task releases tickets as quota refills.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float], tokens_per_minute: Optional[float],
+                 max_queue: int = 50, queue_timeout: float = 120.0):
+        # None disables that bucket; the queue and 429 pauses still apply
+        self.requests = TokenBucket(requests_per_minute, (requests_per_minute or 0) / 60.0)
+        self.tokens = TokenBucket(tokens_per_minute, (tokens_per_minute or 0) / 60.0)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        # priority -> project_id -> FIFO of tickets (project order = round-robin order)
+        self._queues: Dict[int, "OrderedDict[str, deque]"] = {}
+        self._queued = 0
+        self._paused_until = 0.0
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    # ----- async API -----
+
+    def submit(self, project_id: str, tokens: int, priority: int = 0) -> Ticket:
+        """Enqueue a request. Raises RateLimitQueueFull when the queue is at capacity."""
+        self._ensure_dispatcher()
+        if self._queued >= self.max_queue:
+            raise RateLimitQueueFull(f"Gemini request queue is full ({self.max_queue} waiting)")
+
+        ticket = Ticket(
+            project_id=project_id,
+            tokens=tokens,
+            priority=priority,
+            future=self._loop.create_future()
+        )
+        projects = self._queues.setdefault(priority, OrderedDict())
+        projects.setdefault(project_id, deque()).append(ticket)
+        self._queued += 1
+        self._wakeup.set()
+        return ticket
+
+    async def wait(self, ticket: Ticket, timeout: Optional[float] = None):
+        """Wait until ticket is granted. Raises RateLimitTimeout after the queue timeout."""
+        timeout = self.queue_timeout if timeout is None else timeout
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise RateLimitTimeout(f"Waited {timeout:.0f}s for Gemini quota")
+        finally:
+            if not ticket.future.done():
+                ticket.future.cancel()
+                self._remove(ticket)
+
+    async def wait_with_updates(self, ticket: Ticket, interval: float = 1.0):
+        """
+        Async generator form of wait(): yields the ticket's queue position
+        every `interval` seconds while it is still waiting.
+        """
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while not ticket.future.done():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RateLimitTimeout(f"Waited {self.queue_timeout:.0f}s for Gemini quota")
+                await asyncio.wait({ticket.future}, timeout=min(interval, remaining))
+                position = self.position(ticket)
+                if position:
+                    yield position
+        finally:
+            if not ticket.future.done():
+                ticket.future.cancel()
+                self._remove(ticket)
+
+    async def acquire(self, project_id: str, tokens: int, priority: int = 0):
+        """submit() + wait()."""
+        await self.wait(self.submit(project_id, tokens, priority))
+
+    def try_acquire_now(self, tokens: int) -> bool:
+        """Take quota only if nobody is queued and it is available immediately (used for hedges)."""
+        if self._queued or time.monotonic() < self._paused_until:
+            return False
+        if self.requests.wait_time(1) or self.tokens.wait_time(tokens):
+            return False
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        return True
+
+    def position(self, ticket: Ticket) -> int:
+        """1-based position of ticket in dispatch order (0 if no longer queued)."""
+        for index, queued in enumerate(self._dispatch_order(), 1):
+            if queued is ticket:
+                return index
+        return 0
+
+    def project_position(self, project_id: str) -> int:
+        """Position of the project's next request, 0 if it has none queued."""
+        for index, queued in enumerate(self._dispatch_order(), 1):
+            if queued.project_id == project_id:
+                return index
+        return 0
+
+    # ----- sync API -----
+
+    def acquire_blocking(self, tokens: int, timeout: Optional[float] = None):
+        """
+        Blocking acquire for the sync generation path. Respects the same
+        buckets but does not take part in the fair queue.
+        """
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+        while True:
+            wait = max(
+                self._paused_until - time.monotonic(),
+                self.requests.wait_time(1),
+                self.tokens.wait_time(tokens)
+            )
+            if wait <= 0:
+                self.requests.take(1)
+                self.tokens.take(tokens)
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeout("Timed out waiting for Gemini quota")
+            time.sleep(min(wait, 1.0))
+
+    # ----- shared -----
+
+    def pause(self, seconds: float):
+        """Hold all dispatching, e.g. after the API returned 429."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        by_project: Dict[str, int] = {}
+        for projects in self._queues.values():
+            for project_id, tickets in projects.items():
+                by_project[project_id] = by_project.get(project_id, 0) + len(tickets)
+        return {
+            "queued": self._queued,
+            "max_queue": self.max_queue,
+            "by_project": by_project,
+            "requests_available": None if self.requests.capacity is None else round(self.requests.available, 2),
+            "requests_per_minute": self.requests.capacity,
+            "tokens_available": None if self.tokens.capacity is None else int(self.tokens.available),
+            "tokens_per_minute": None if self.tokens.capacity is None else int(self.tokens.capacity),
+            "paused_for_s": round(max(0.0, self._paused_until - time.monotonic()), 1),
+        }
+
+    # ----- internals -----
+
+    def _ensure_dispatcher(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Tickets from a previous (closed) loop can never be granted
+            self._queues.clear()
+            self._queued = 0
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._dispatcher = None
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    def _dispatch_order(self) -> List[Ticket]:
+        """Order in which queued tickets would be granted."""
+        order = []
+        for priority in sorted(self._queues):
+            lanes = [list(tickets) for tickets in self._queues[priority].values()]
+            depth = 0
+            while any(depth < len(lane) for lane in lanes):
+                for lane in lanes:
+                    if depth < len(lane):
+                        order.append(lane[depth])
+                depth += 1
+        return order
+
+    def _next_ticket(self) -> Optional[Ticket]:
+        for priority in sorted(self._queues):
+            projects = self._queues[priority]
+            for project_id in list(projects):
+                tickets = projects[project_id]
+                while tickets and tickets[0].future.done():
+                    tickets.popleft()
+                    self._queued -= 1
+                if tickets:
+                    return tickets[0]
+                del projects[project_id]
+            if not projects:
+                del self._queues[priority]
+        return None
+
+    def _remove(self, ticket: Ticket):
+        projects = self._queues.get(ticket.priority)
+        if not projects or ticket.project_id not in projects:
+            return
+        tickets = projects[ticket.project_id]
+        try:
+            tickets.remove(ticket)
+            self._queued -= 1
+        except ValueError:
+            return
+        if not tickets:
+            del projects[ticket.project_id]
+
+    async def _dispatch(self):
+        while True:
+            ticket = self._next_ticket()
+            if ticket is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            wait = max(
+                self._paused_until - time.monotonic(),
+                self.requests.wait_time(1),
+                self.tokens.wait_time(ticket.tokens)
+            )
+            if wait > 0:
+                # Re-evaluate early if a higher-priority request arrives
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.requests.take(1)
+            self.tokens.take(ticket.tokens)
+            self._remove(ticket)
+            # Round-robin: the served project goes to the back of its priority lane
+            projects = self._queues.get(ticket.priority)
+            if projects and ticket.project_id in projects:
+                projects.move_to_end(ticket.project_id)
+            ticket.future.set_result(None)
+
+def _limit_from_env(name: str) -> Optional[float]:
+    """Per-minute limit from the environment; unset, empty or 0 means no limit."""
+    value = os.getenv(name, "").strip()
+    if not value or float(value) <= 0:
+        return None
+    return float(value)
+
+_limiters: Dict[str, KeyRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(api_key: str) -> KeyRateLimiter:
+    """Shared limiter for api_key (user key from settings or LLM_API_KEY)."""
+    digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    with _limiters_lock:
+        if digest not in _limiters:
+            # Off unless configured: quotas depend on the key's tier (the free
+            # tier is GEMINI_RPM=10, GEMINI_TPM=250000), and a paid key must
+            # not be throttled to it. A 429 still pauses the key either way.
+            _limiters[digest] = KeyRateLimiter(
+                requests_per_minute=_limit_from_env("GEMINI_RPM"),
+                tokens_per_minute=_limit_from_env("GEMINI_TPM"),
+                max_queue=int(os.getenv("GEMINI_QUEUE_MAX", "50")),
+                queue_timeout=float(os.getenv("GEMINI_QUEUE_TIMEOUT", "120"))
+            )
+        return _limiters[digest]
+
+def _collect_metrics():
+    with _limiters_lock:
+        limiters = {digest[:8]: limiter.stats() for digest, limiter in _limiters.items()}
+    return [
+        ("hardcore_gemini_queue_depth", "gauge", "Requests waiting for Gemini quota per API key",
+         [({"key": key}, stats["queued"]) for key, stats in limiters.items()]),
+        ("hardcore_gemini_requests_available", "gauge", "Requests/min bucket level per API key",
+         [({"key": key}, stats["requests_available"]) for key, stats in limiters.items()
+          if stats["requests_available"] is not None]),
+    ]
+
+registry.register_collector(_collect_metrics)
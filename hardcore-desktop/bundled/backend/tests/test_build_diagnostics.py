@@ -0,0 +1,184 @@
+"""Build Diagnostics - parser tests against real pio/GCC/ld output."""
+
+import sys
+import asyncio
+import json
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from build_diagnostics import BuildLogParser, ndjson_events, parse_build_log, parse_event_filter
+
+LD_UNDEFINED = (
+    "/home/dev/.platformio/packages/toolchain-xtensa-esp32/bin/../lib/gcc/xtensa-esp32-elf/8.4.0/"
+    "../../../../xtensa-esp32-elf/bin/ld: .pio/build/esp32dev/src/main.cpp.o:(.literal._Z4loopv+0x0): "
+    "undefined reference to `foo'"
+)
+LD_UNDEFINED_WINDOWS = (
+    "c:/users/dev/.platformio/packages/toolchain-xtensa-esp32/bin/../lib/gcc/xtensa-esp32-elf/8.4.0/"
+    "../../../../xtensa-esp32-elf/bin/ld.exe: .pio/build/esp32dev/src/main.cpp.o:(.literal._Z4loopv+0x0): "
+    "undefined reference to `foo'"
+)
+LD_IN_FUNCTION = [
+    "/usr/bin/ld: .pio/build/native/src/main.cpp.o: in function `loop':",
+    "main.cpp:(.text.loop+0x4): undefined reference to `readSensor()'",
+]
+AVR_LTO_IN_FUNCTION = [
+    "/tmp/ccQ2fLrR.ltrans0.ltrans.o: In function `main':",
+    "<artificial>:(.text.startup+0x8a): undefined reference to `setupMotor()'",
+    "collect2: error: ld returned 1 exit status",
+]
+GCC_ERROR_LOG = """\
+Processing esp32dev (platform: espressif32; board: esp32dev; framework: arduino)
+--------------------------------------------------------------------------------
+Compiling .pio/build/esp32dev/src/main.cpp.o
+src/main.cpp: In function 'void loop()':
+src/main.cpp:12:5: error: 'ledPin' was not declared in this scope
+     digitalWrite(ledPin, HIGH);
+     ^~~~~~~~~~~~
+src/main.cpp:14:9: warning: unused variable 'x' [-Wunused-variable]
+*** [.pio/build/esp32dev/src/main.cpp.o] Error 1
+========================= [FAILED] Took 3.21 seconds =========================
+"""
+SUCCESS_LOG = """\
+Compiling .pio/build/esp32dev/src/main.cpp.o
+Retrieved `.pio/build/esp32dev/FrameworkArduino/Esp.cpp.o' from cache
+Linking .pio/build/esp32dev/firmware.elf
+Retrieving maximum program size .pio/build/esp32dev/firmware.elf
+Checking size .pio/build/esp32dev/firmware.elf
+RAM:   [=         ]   6.5% (used 21312 bytes from 327680 bytes)
+Flash: [==        ]  20.1% (used 263417 bytes from 1310720 bytes)
+Building .pio/build/esp32dev/firmware.bin
+========================= [SUCCESS] Took 12.34 seconds =========================
+"""
+
+def diagnostics(lines):
+    parser = BuildLogParser(include_log=False)
+    events = parser.feed("\n".join(lines) + "\n") + parser.finish()
+    return parser, [e for e in events if e["type"] == "diagnostic"]
+
+class LinkerTests(unittest.TestCase):
+    def test_ld_undefined_reference(self):
+        parser, found = diagnostics([LD_UNDEFINED])
+        self.assertEqual(parser.errors, 1)
+        self.assertEqual(found[0]["severity"], "error")
+        self.assertEqual(found[0]["file"], "src/main.cpp")
+        self.assertEqual(found[0]["message"], "undefined reference to `foo'")
+
+    def test_ld_exe_on_windows(self):
+        parser, found = diagnostics([LD_UNDEFINED_WINDOWS])
+        self.assertEqual(parser.errors, 1)
+        self.assertEqual(found[0]["file"], "src/main.cpp")
+
+    def test_in_function_line_is_context(self):
+        parser, found = diagnostics(LD_IN_FUNCTION)
+        self.assertEqual(parser.errors, 1)
+        self.assertEqual(found[0]["function"], "loop")
+        self.assertEqual(found[0]["file"], "main.cpp")
+        self.assertIn("readSensor()", found[0]["message"])
+
+    def test_avr_lto_undefined_reference(self):
+        parser, found = diagnostics(AVR_LTO_IN_FUNCTION)
+        self.assertEqual([d["message"] for d in found],
+                         ["undefined reference to `setupMotor()'", "ld returned 1 exit status"])
+        self.assertIsNone(found[0]["file"])
+        self.assertEqual(found[0]["function"], "main")
+
+    def test_multiple_definition(self):
+        parser, found = diagnostics([
+            "/usr/bin/ld: .pio/build/uno/src/helpers.cpp.o: in function `blink()':",
+            "helpers.cpp:(.text+0x0): multiple definition of `blink()'; "
+            ".pio/build/uno/src/main.cpp.o:main.cpp:(.text+0x0): first defined here",
+        ])
+        self.assertEqual(parser.errors, 1)
+        self.assertTrue(found[0]["message"].startswith("multiple definition of `blink()'"))
+
+    def test_region_overflow(self):
+        parser, found = diagnostics([
+            "/home/dev/.platformio/packages/toolchain-xtensa-esp32/xtensa-esp32-elf/bin/ld: "
+            "region `dram0_0_seg' overflowed by 1504 bytes",
+        ])
+        self.assertEqual(parser.errors, 1)
+        self.assertEqual(found[0]["message"], "region `dram0_0_seg' overflowed by 1504 bytes")
+
+    def test_ld_warning(self):
+        parser, found = diagnostics(["/usr/bin/ld: warning: firmware.elf has a LOAD segment with RWX permissions"])
+        self.assertEqual((parser.errors, parser.warnings), (0, 1))
+        self.assertEqual(found[0]["severity"], "warning")
+
+    def test_linker_error_survives_event_filter(self):
+        async def collect():
+            async def chunks():
+                yield "Linking .pio/build/esp32dev/firmware.elf\n"
+                yield LD_UNDEFINED + "\n"
+                yield "Build failed!\n"
+            return [json.loads(line) async for out in ndjson_events(chunks(), parse_event_filter("diagnostic,result"))
+                    for line in out.splitlines()]
+
+        events = asyncio.run(collect())
+        self.assertEqual([e["type"] for e in events], ["diagnostic", "result"])
+        self.assertEqual(events[1]["errors"], 1)
+        self.assertFalse(events[1]["success"])
+
+class CompileTests(unittest.TestCase):
+    def test_gcc_error_and_warning(self):
+        parser = BuildLogParser(include_log=False)
+        events = parser.feed(GCC_ERROR_LOG) + parser.finish()
+        found = [e for e in events if e["type"] == "diagnostic"]
+        self.assertEqual((parser.errors, parser.warnings), (1, 1))
+        self.assertEqual(found[0], {
+            "type": "diagnostic", "severity": "error", "file": "src/main.cpp", "line": 12, "column": 5,
+            "message": "'ledPin' was not declared in this scope", "function": "void loop()",
+        })
+        self.assertEqual(found[1]["severity"], "warning")
+        self.assertEqual(found[1]["line"], 14)
+        self.assertEqual(events[-1]["type"], "result")
+        self.assertFalse(events[-1]["success"])
+
+    def test_gcc_context_lines_are_not_diagnostics(self):
+        _, found = diagnostics(["src/main.cpp: In function 'void setup()':", "src/main.cpp: At global scope:"])
+        self.assertEqual(found, [])
+
+    def test_chunk_boundaries(self):
+        parser = BuildLogParser(include_log=False)
+        events = []
+        for i in range(0, len(GCC_ERROR_LOG), 7):
+            events += parser.feed(GCC_ERROR_LOG[i:i + 7])
+        events += parser.finish()
+        self.assertEqual(parser.errors, 1)
+        self.assertEqual(sum(1 for e in events if e["type"] == "diagnostic"), 2)
+
+class SummaryTests(unittest.TestCase):
+    def test_success_log(self):
+        parser = BuildLogParser(include_log=False)
+        events = parser.feed(SUCCESS_LOG) + parser.finish()
+        self.assertEqual(parser.memory["ram"], {"percent": 6.5, "used": 21312, "total": 327680})
+        self.assertEqual(parser.memory["flash"], {"percent": 20.1, "used": 263417, "total": 1310720})
+        stages = [e for e in events if e["type"] == "stage" and e["status"] != "started"]
+        self.assertEqual(stages, [{"type": "stage", "stage": "build", "status": "success", "duration_s": 12.34}])
+        self.assertTrue(events[-1]["success"])
+        self.assertEqual([u["cached"] for u in parser.units], [False, True])
+
+    def test_failed_marker(self):
+        parser = BuildLogParser(include_log=False)
+        events = parser.feed("==== [FAILED] Took 1.50 seconds ====\n") + parser.finish()
+        self.assertEqual(events[0]["status"], "failed")
+
+    def test_parse_build_log_summary(self):
+        summary = parse_build_log(SUCCESS_LOG)
+        self.assertEqual(summary["errors"], 0)
+        self.assertEqual(summary["units_compiled"], 1)
+        self.assertEqual(summary["units_cached"], 1)
+
+    def test_event_filter_rejects_unknown(self):
+        with self.assertRaises(ValueError):
+            parse_event_filter("diagnostic,bogus")
+
+    def test_plain_lines_are_logs(self):
+        parser = BuildLogParser()
+        events = parser.feed("Library Manager: Installing Servo\nLooking for dependencies: ld.cpp\n")
+        self.assertEqual([e["type"] for e in events], ["log", "log"])
+
+if __name__ == "__main__":
+    unittest.main()
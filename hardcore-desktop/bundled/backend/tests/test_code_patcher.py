@@ -0,0 +1,148 @@
+"""Code Patcher - SEARCH/REPLACE parsing, matching and validation tests."""
+
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from code_patcher import EditBlock, PatchError, apply_edit, apply_edits, parse_edit_blocks, validate_patched
+
+SKETCH = """\
+#include <Arduino.h>
+
+const int LED_PIN = 13;
+
+void setup() {
+  pinMode(LED_PIN, OUTPUT);
+}
+
+void loop() {
+  digitalWrite(LED_PIN, HIGH);
+  delay(500);
+  digitalWrite(LED_PIN, LOW);
+  delay(500);
+}
+"""
+RESPONSE = """\
+Slowing the blink down:
+
+<<<<<<< SEARCH
+  delay(500);
+  digitalWrite(LED_PIN, LOW);
+=======
+  delay(1000);
+  digitalWrite(LED_PIN, LOW);
+>>>>>>> REPLACE
+
+<<<<<<< SEARCH
+const int LED_PIN = 13;
+=======
+const int LED_PIN = 2;
+>>>>>>> REPLACE
+"""
+
+class ParseTests(unittest.TestCase):
+    def test_blocks_in_order(self):
+        blocks = parse_edit_blocks(RESPONSE)
+        self.assertEqual(len(blocks), 2)
+        self.assertEqual(blocks[0].search, "  delay(500);\n  digitalWrite(LED_PIN, LOW);")
+        self.assertEqual(blocks[1].replace, "const int LED_PIN = 2;")
+
+    def test_no_blocks(self):
+        self.assertEqual(parse_edit_blocks("Here is the full file:\n```cpp\nvoid setup() {}\n```"), [])
+        self.assertEqual(parse_edit_blocks(None), [])
+
+class ApplyEditTests(unittest.TestCase):
+    def test_exact_match(self):
+        patched = apply_edit(SKETCH, EditBlock("const int LED_PIN = 13;", "const int LED_PIN = 2;"))
+        self.assertIn("const int LED_PIN = 2;", patched)
+        self.assertNotIn("LED_PIN = 13", patched)
+
+    def test_trailing_whitespace_tolerated(self):
+        code = SKETCH.replace("pinMode(LED_PIN, OUTPUT);", "pinMode(LED_PIN, OUTPUT);   ")
+        patched = apply_edit(code, EditBlock("  pinMode(LED_PIN, OUTPUT);\n}", "  pinMode(LED_PIN, INPUT);\n}"))
+        self.assertIn("  pinMode(LED_PIN, INPUT);\n}", patched)
+        self.assertNotIn("OUTPUT", patched)
+
+    def test_indentation_tolerated_and_replacement_reindented(self):
+        block = EditBlock(
+            "digitalWrite(LED_PIN, HIGH);\ndelay(500);",
+            "digitalWrite(LED_PIN, HIGH);\nif (fast) {\n  delay(100);\n}"
+        )
+        patched = apply_edit(SKETCH, block)
+        self.assertIn("  digitalWrite(LED_PIN, HIGH);\n  if (fast) {\n    delay(100);\n  }\n  digitalWrite(LED_PIN, LOW);",
+                      patched)
+
+    def test_ambiguous_search(self):
+        with self.assertRaisesRegex(PatchError, "matches 2 places"):
+            apply_edit(SKETCH, EditBlock("  delay(500);", "  delay(250);"))
+
+    def test_ambiguous_after_normalizing(self):
+        with self.assertRaisesRegex(PatchError, "matches 2 places"):
+            apply_edit(SKETCH, EditBlock("delay(500);", "delay(250);"))
+
+    def test_missing_search(self):
+        with self.assertRaisesRegex(PatchError, "SEARCH not found: 'tone\\(8, 440\\);'"):
+            apply_edit(SKETCH, EditBlock("tone(8, 440);", "noTone(8);"))
+
+    def test_empty_search(self):
+        with self.assertRaisesRegex(PatchError, "Empty SEARCH"):
+            apply_edit(SKETCH, EditBlock("  \n", "int x;"))
+
+class ValidateTests(unittest.TestCase):
+    def test_valid_patch(self):
+        validate_patched(SKETCH, SKETCH.replace("500", "250"))
+
+    def test_lost_setup(self):
+        patched = SKETCH.replace("void setup() {\n  pinMode(LED_PIN, OUTPUT);\n}\n", "")
+        with self.assertRaisesRegex(PatchError, r"removed setup\(\)"):
+            validate_patched(SKETCH, patched)
+
+    def test_lost_loop(self):
+        patched = SKETCH.replace("void loop() {", "void tick() {")
+        with self.assertRaisesRegex(PatchError, r"removed loop\(\)"):
+            validate_patched(SKETCH, patched)
+
+    def test_unbalanced_braces(self):
+        patched = SKETCH.replace("  delay(500);\n}", "  delay(500);\n", 1)
+        with self.assertRaisesRegex(PatchError, "unbalanced"):
+            validate_patched(SKETCH, patched)
+
+    def test_unbalanced_parens(self):
+        with self.assertRaisesRegex(PatchError, "unbalanced"):
+            validate_patched(SKETCH, SKETCH.replace("delay(500);", "delay((500);", 1))
+
+    def test_braces_in_comments_and_strings_ignored(self):
+        patched = SKETCH.replace("delay(500);", 'Serial.println("}"); // {', 1)
+        validate_patched(SKETCH, patched)
+
+    def test_too_short(self):
+        with self.assertRaisesRegex(PatchError, "too short"):
+            validate_patched(SKETCH, "void setup() {}")
+
+class ApplyEditsTests(unittest.TestCase):
+    def test_applies_every_block(self):
+        patched = apply_edits(SKETCH, parse_edit_blocks(RESPONSE))
+        self.assertIn("const int LED_PIN = 2;", patched)
+        self.assertIn("  delay(1000);\n  digitalWrite(LED_PIN, LOW);", patched)
+
+    def test_failing_block_is_numbered(self):
+        blocks = parse_edit_blocks(RESPONSE) + [EditBlock("tone(8, 440);", "noTone(8);")]
+        with self.assertRaisesRegex(PatchError, "^Block 3/3: SEARCH not found"):
+            apply_edits(SKETCH, blocks)
+
+    def test_no_blocks(self):
+        with self.assertRaisesRegex(PatchError, "No SEARCH/REPLACE blocks"):
+            apply_edits(SKETCH, [])
+
+    def test_no_change(self):
+        with self.assertRaisesRegex(PatchError, "did not change"):
+            apply_edits(SKETCH, [EditBlock("const int LED_PIN = 13;", "const int LED_PIN = 13;")])
+
+    def test_validation_runs_on_result(self):
+        with self.assertRaisesRegex(PatchError, "unbalanced"):
+            apply_edits(SKETCH, [EditBlock("void loop() {", "void loop() {{")])
+
+if __name__ == "__main__":
+    unittest.main()
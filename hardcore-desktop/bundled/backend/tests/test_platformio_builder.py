@@ -0,0 +1,94 @@
+"""PlatformIO Builder - project directory and platformio.ini tests (no pio run)."""
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from firmware_gen import FirmwareAssembler
+from platformio_builder import PlatformIOBuilder
+
+SERVO_SKETCH = """\
+#include <Arduino.h>
+#include <ESP32Servo.h>
+#include <Servo.h>
+
+Servo arm;
+
+void setup() {
+  arm.attach(13);
+}
+
+void loop() {
+  arm.write(90);
+  delay(1000);
+}
+"""
+
+class ProjectIniTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.builder = PlatformIOBuilder(self._tmp.name)
+        self.project_dir = self.builder._project_dir("servo")
+        self.ini = self.project_dir / "platformio.ini"
+        self.firmware = FirmwareAssembler().assemble({"code": SERVO_SKETCH, "pin_json": {}}, "esp32")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def execute(self):
+        # What /execute's _save_to_workspace writes
+        self.builder.write_project(
+            "servo",
+            {"src/main.cpp": self.firmware.main_cpp, "src/resolved_pins.h": self.firmware.resolved_pins_h},
+            "esp32",
+            lib_deps=self.firmware.dependencies
+        )
+
+    def build(self):
+        with mock.patch.object(self.builder, "_compile", return_value={"success": True}):
+            result = self.builder.build_and_flash(self.firmware.main_cpp, "esp32", project_id="servo")
+        self.assertTrue(result["success"])
+
+    def test_execute_then_build_keeps_ini_unchanged(self):
+        self.execute()
+        self.build()
+        first = self.ini.stat().st_mtime_ns
+        content = self.ini.read_text(encoding="utf-8")
+        self.execute()
+        self.build()
+        self.assertEqual(self.ini.stat().st_mtime_ns, first)
+        self.assertEqual(self.ini.read_text(encoding="utf-8"), content)
+
+    def test_generated_lib_deps_survive_build(self):
+        self.execute()
+        self.build()
+        content = self.ini.read_text(encoding="utf-8")
+        self.assertIn("[env:default]", content)
+        self.assertIn("lib_deps =\n    ESP32Servo\n", content)
+
+    def test_new_lib_deps_replace_old(self):
+        self.execute()
+        self.builder._init_platformio_project(self.project_dir, "esp32", lib_deps=["Wire"])
+        content = self.ini.read_text(encoding="utf-8")
+        self.assertIn("lib_deps =\n    Wire\n", content)
+        self.assertNotIn("ESP32Servo", content)
+
+    def test_existing_build_flags_kept(self):
+        self.execute()
+        self.ini.write_text(self.ini.read_text(encoding="utf-8") + "build_flags =\n    -DDEBUG=1\n",
+                            encoding="utf-8")
+        self.builder._init_platformio_project(self.project_dir, "esp32")
+        content = self.ini.read_text(encoding="utf-8")
+        self.assertIn("build_flags =\n    -DDEBUG=1\n", content)
+        self.assertIn("ESP32Servo", content)
+
+    def test_write_project_stays_inside_project(self):
+        with self.assertRaises(ValueError):
+            self.builder.write_project("servo", {"../other/src/main.cpp": SERVO_SKETCH})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,215 @@
+"""
+Toolchain Prewarm - Background Platform Install and Cache Warm-Up
+Walks board_definitions.json when the backend starts, installs each board's
+PlatformIO platform and packages and compiles a trivial sketch, so the first
+user build for a board does not spend minutes downloading toolchains.
+"""
+
+import os
+import time
+import threading
+import concurrent.futures
+from typing import Dict, Any, List, Optional
+
+import compile_cache
+from build_scheduler import build_scheduler, BuildCancelled, BuildQueueFull, RUNNING
+from platformio_builder import PlatformIOBuilder
+from toolchain_registry import get_pio_executable, board_definitions
+
+# User builds default to priority 0; lower runs first
+PREWARM_PRIORITY = 100
+INSTALL_TIMEOUT = float(os.getenv("TOOLCHAIN_INSTALL_TIMEOUT", "1800"))
+COMPILE_TIMEOUT = float(os.getenv("TOOLCHAIN_PREWARM_COMPILE_TIMEOUT", "900"))
+# While the build queue is full, retry with backoff for this long before failing the board
+QUEUE_FULL_TIMEOUT = float(os.getenv("TOOLCHAIN_PREWARM_QUEUE_FULL_TIMEOUT", "600"))
+
+# Board states
+PENDING = "pending"
+INSTALLING = "installing"
+COMPILING = "compiling"
+READY = "ready"
+FAILED = "failed"
+
+class ToolchainPrewarmer:
+    """
+    Runs one low-priority job at a time on the build pool, so it never
+    occupies more than one worker. A compile step that is running while user
+    builds wait for a worker is cancelled and re-queued behind them.
+    """
+
+    def __init__(self):
+        self.state = "idle"
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.current: Optional[str] = None
+        self.boards: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self, board_types: Optional[List[str]] = None, force: bool = False) -> bool:
+        """Start the background walk. Returns False if one is already running."""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return False
+            definitions = board_definitions.boards()
+            builder = PlatformIOBuilder()
+            self.boards = {
+                board: {"platform": builder.board_platformio_config(board)["platform"], "status": PENDING}
+                for board in (board_types or list(definitions)) if board in definitions
+            }
+            self.state = "running"
+            self.started_at = time.time()
+            self.finished_at = None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(builder, force),
+                                            name="toolchain-prewarm", daemon=True)
+            self._thread.start()
+        print(f"[ToolchainPrewarm] Started for {len(self.boards)} boards")
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            boards = {name: dict(info) for name, info in self.boards.items()}
+            done = sum(1 for info in boards.values() if info["status"] in (READY, FAILED))
+            return {
+                "state": self.state,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "current": self.current,
+                "progress": {"done": done, "total": len(boards)},
+                "boards": boards,
+            }
+
+    # ----- internals -----
+
+    def _update(self, board: str, **fields):
+        with self._lock:
+            self.boards[board].update(fields)
+
+    def _run(self, builder: PlatformIOBuilder, force: bool):
+        failure: Optional[str] = None
+        try:
+            self._walk(builder, force)
+        except Exception as e:
+            failure = str(e)
+            print(f"[ToolchainPrewarm] Walk aborted: {e}")
+        finally:
+            # Whatever happened, no board is left looking busy and the walk gets an end state
+            with self._lock:
+                for info in self.boards.values():
+                    if info["status"] in (INSTALLING, COMPILING):
+                        info.update(status=FAILED, error=failure or "Pre-warm stopped")
+                self.current = None
+                self.state = "failed" if failure else "stopped" if self._stop.is_set() else "done"
+                self.finished_at = time.time()
+            print(f"[ToolchainPrewarm] {self.state}: {self.status()['progress']}")
+
+    def _walk(self, builder: PlatformIOBuilder, force: bool):
+        pio_missing = False
+        for board in list(self.boards):
+            if self._stop.is_set():
+                break
+            with self._lock:
+                self.current = board
+            if pio_missing:
+                self._update(board, status=FAILED, error="PlatformIO not found")
+                continue
+            if compile_cache.is_prewarmed(builder, board) and not force:
+                self._update(board, status=READY, cached=True)
+                continue
+
+            start = time.time()
+            self._update(board, status=INSTALLING)
+            installed = self._run_step(board, lambda token: self._install_packages(builder, board, token))
+            if not installed.get("success"):
+                pio_missing = "not found" in (installed.get("error") or "")
+                self._update(board, status=FAILED, error=installed.get("error"), seconds=round(time.time() - start, 1))
+                continue
+
+            self._update(board, status=COMPILING)
+            compiled = self._run_step(
+                board,
+                lambda token: compile_cache.prewarm_board(board, builder, token, timeout=COMPILE_TIMEOUT),
+                preemptible=True
+            )
+            if compiled.get("status") == "prewarmed":
+                self._update(board, status=READY, cached=False, seconds=round(time.time() - start, 1))
+            else:
+                self._update(board, status=FAILED, error=compiled.get("error"), seconds=round(time.time() - start, 1))
+
+    def _run_step(self, board: str, run, preemptible: bool = False) -> Dict[str, Any]:
+        """Run one step as a low-priority build job; re-queue it if preempted by user builds."""
+        project_id = f"_prewarm_{board}"
+        while not self._stop.is_set():
+            job = self._submit(run, project_id)
+            if job is None:
+                if self._stop.is_set():
+                    break
+                return {"success": False, "error": f"Build queue stayed full for {QUEUE_FULL_TIMEOUT:.0f}s"}
+            preempted = False
+            while True:
+                try:
+                    return job.future.result(timeout=1.0) or {}
+                except BuildCancelled:
+                    break
+                except RuntimeError as e:
+                    return {"success": False, "error": str(e)}
+                except concurrent.futures.TimeoutError:
+                    pass
+                if self._stop.is_set():
+                    build_scheduler.cancel(job.job_id)
+                elif preemptible and not preempted and job.status == RUNNING and self._user_builds_waiting():
+                    print(f"[ToolchainPrewarm] Yielding worker to user builds, re-queueing {board}")
+                    preempted = True
+                    build_scheduler.cancel(job.job_id)
+            if not preempted:
+                break
+        return {"success": False, "error": "Pre-warm stopped"}
+
+    def _submit(self, run, project_id: str):
+        """Queue a prewarm job, backing off while the build queue is full. None if it never fit."""
+        deadline = time.time() + QUEUE_FULL_TIMEOUT
+        delay = 5.0
+        while not self._stop.is_set():
+            try:
+                return build_scheduler.submit(run, project_id, kind="prewarm", priority=PREWARM_PRIORITY)
+            except BuildQueueFull:
+                if time.time() + delay > deadline:
+                    return None
+                print(f"[ToolchainPrewarm] Build queue full, retrying {project_id} in {delay:.0f}s")
+                self._stop.wait(delay)
+                delay = min(delay * 2, 60.0)
+        return None
+
+    @staticmethod
+    def _user_builds_waiting() -> bool:
+        stats = build_scheduler.stats()
+        return (stats["running"] >= stats["workers"]
+                and any(job["priority"] < PREWARM_PRIORITY for job in stats["queue"]))
+
+    @staticmethod
+    def _install_packages(builder: PlatformIOBuilder, board: str, cancel_token) -> Dict[str, Any]:
+        """pio pkg install for the board's project: platform, framework and toolchain packages."""
+        pio_exe = get_pio_executable()
+        project_dir = builder._project_dir(f"_prewarm_{board}")
+        builder._prepare_project(project_dir, compile_cache.PREWARM_SKETCH, board, clean=False)
+        print(f"[ToolchainPrewarm] Installing packages for {board}")
+        try:
+            result = builder._run_process([pio_exe, "pkg", "install", "--project-dir", str(project_dir)],
+                                          project_dir, timeout=INSTALL_TIMEOUT, cancel_token=cancel_token)
+        except FileNotFoundError:
+            return {"success": False, "error": "PlatformIO not found. Install with: pip install platformio"}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        if result.returncode != 0:
+            return {"success": False, "error": (result.stderr or result.stdout).strip()[-500:]}
+        return {"success": True}
+
+toolchain_prewarmer = ToolchainPrewarmer()
+
+def prewarm_enabled() -> bool:
+    return os.getenv("TOOLCHAIN_PREWARM_ENABLED", "1").strip().lower() not in ("0", "false", "no")
@@ -0,0 +1,164 @@
+"""
+Toolchain Registry - PlatformIO CLI and Board/Driver Definitions
+Resolves the pio executable once per process and keeps board_definitions.json
+and driver_db.json parsed and indexed in memory, reloading a file only when
+its mtime or size changes. Shared by the builder, flashers and prewarm jobs.
+"""
+
+import os
+import json
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+MODULE_DIR = Path(__file__).parent
+# Older installs kept the JSON files in an orchestrator/ directory next to backend/
+LEGACY_DIR = MODULE_DIR.parent / "orchestrator"
+
+_pio_exe: Optional[str] = None
+_pio_lock = threading.Lock()
+
+def _pio_candidates() -> List[str]:
+    home = Path.home()
+    return [
+        os.getenv("PLATFORMIO_EXE", ""),
+        # Where the desktop installer puts it (pip --user on Windows)
+        str(home / "AppData" / "Roaming" / "Python" / "Python312" / "Scripts" / "pio.exe"),
+        # PlatformIO IDE / installer script virtualenv
+        str(home / ".platformio" / "penv" / "Scripts" / "pio.exe"),
+        str(home / ".platformio" / "penv" / "bin" / "pio"),
+    ]
+
+def get_pio_executable() -> str:
+    """Path to the pio CLI, resolved on first use; falls back to "pio" on PATH."""
+    global _pio_exe
+    if _pio_exe is None:
+        with _pio_lock:
+            if _pio_exe is None:
+                resolved = next((c for c in _pio_candidates() if c and os.path.isfile(c)), None)
+                _pio_exe = resolved or shutil.which("pio") or shutil.which("platformio") or "pio"
+                print(f"[ToolchainRegistry] Using PlatformIO CLI: {_pio_exe}")
+    return _pio_exe
+
+def reset_pio_executable():
+    """Forget the resolved path (e.g. after PlatformIO was installed while running)."""
+    global _pio_exe
+    with _pio_lock:
+        _pio_exe = None
+
+class JsonDefinitions:
+    """
+    A JSON file loaded once and re-read only when its (mtime, size) changes.
+    The first existing path in `paths` wins, so a file added next to the
+    module later takes over from the legacy copy.
+    """
+
+    def __init__(self, name: str, paths: List[Path]):
+        self.name = name
+        self.paths = paths
+        self.loads = 0
+        self._data: Dict[str, Any] = {}
+        self._signature: Optional[Tuple] = None
+        self._lock = threading.Lock()
+
+    def _current_signature(self) -> Optional[Tuple]:
+        for path in self.paths:
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            return (str(path), stat.st_mtime_ns, stat.st_size)
+        return None
+
+    def get(self) -> Dict[str, Any]:
+        signature = self._current_signature()
+        if signature == self._signature:
+            return self._data
+        with self._lock:
+            if signature != self._signature:
+                self._data = self._load(signature)
+                self._signature = signature
+                self.on_reload(self._data)
+        return self._data
+
+    def _load(self, signature: Optional[Tuple]) -> Dict[str, Any]:
+        if signature is None:
+            print(f"[ToolchainRegistry] {self.name} not found in {[str(p) for p in self.paths]}")
+            return {}
+        try:
+            with open(signature[0], encoding="utf-8") as f:
+                data = json.load(f)
+            self.loads += 1
+            print(f"[ToolchainRegistry] Loaded {self.name} from {signature[0]} ({len(data)} entries)")
+            return data
+        except Exception as e:
+            # Keep serving the last good copy if an edit left the file invalid
+            print(f"[ToolchainRegistry] Error loading {self.name}: {e}")
+            return self._data
+
+    def on_reload(self, data: Dict[str, Any]):
+        """Hook for subclasses to rebuild their indexes."""
+
+class BoardDefinitions(JsonDefinitions):
+    """board_definitions.json, indexed by platform and by PlatformIO board id."""
+
+    def __init__(self):
+        super().__init__("board_definitions.json",
+                         [MODULE_DIR / "board_definitions.json", LEGACY_DIR / "board_definitions.json"])
+        self.by_platform: Dict[str, List[str]] = {}
+        self.by_pio_board: Dict[str, str] = {}
+
+    def on_reload(self, data: Dict[str, Any]):
+        by_platform: Dict[str, List[str]] = {}
+        by_pio_board: Dict[str, str] = {}
+        for board_type, definition in data.items():
+            conf = definition.get("platformio", {})
+            if conf.get("platform"):
+                by_platform.setdefault(conf["platform"], []).append(board_type)
+            if conf.get("board"):
+                by_pio_board[conf["board"]] = board_type
+        self.by_platform = by_platform
+        self.by_pio_board = by_pio_board
+
+    def boards(self) -> Dict[str, Any]:
+        return self.get()
+
+    def board(self, board_type: str) -> Optional[Dict[str, Any]]:
+        return self.get().get(board_type)
+
+    def platformio_config(self, board_type: str) -> Dict[str, Any]:
+        return (self.board(board_type) or {}).get("platformio", {})
+
+    def pins(self, board_type: str) -> Optional[Dict[str, Any]]:
+        return (self.board(board_type) or {}).get("pins")
+
+    def platforms(self) -> Dict[str, List[str]]:
+        self.get()
+        return self.by_platform
+
+class DriverDatabase(JsonDefinitions):
+    """driver_db.json ({"0x1a86": {"0x7523": {...}}}) with case-insensitive VID/PID lookup."""
+
+    def __init__(self):
+        super().__init__("driver_db.json", [MODULE_DIR / "driver_db.json", LEGACY_DIR / "driver_db.json"])
+        self._index: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def on_reload(self, data: Dict[str, Any]):
+        index = {}
+        for vid, products in data.items():
+            if not isinstance(products, dict):
+                continue
+            for pid, entry in products.items():
+                if isinstance(entry, dict):
+                    index[(vid.lower(), pid.lower())] = entry
+        self._index = index
+
+    def lookup(self, vid: str, pid: str) -> Optional[Dict[str, Any]]:
+        """vid/pid as hex strings, with or without 0x."""
+        self.get()
+        normalize = lambda value: value.lower() if value.lower().startswith("0x") else f"0x{value.lower()}"
+        return self._index.get((normalize(vid), normalize(pid)))
+
+board_definitions = BoardDefinitions()
+driver_database = DriverDatabase()
@@ -1,4 +1,4 @@
-from typing import Generator
+from typing import AsyncGenerator
 from platformio_builder import PlatformIOBuilder
 
 class UniversalFlasher:
@@ -10,7 +10,8 @@ class UniversalFlasher:
     def __init__(self):
         self.builder = PlatformIOBuilder()
         
-    def flash(self, firmware_code: str, board_type: str, port: str = None) -> Generator[str, None, None]:
+    async def aflash(self, firmware_code: str, board_type: str, port: str = None,
+                     project_id: str = "current_project", cancel_token=None) -> AsyncGenerator[str, None]:
         """
         Flash firmware to the specified board.
         
@@ -19,19 +20,18 @@ class UniversalFlasher:
             board_type: The type of board (e.g., 'arduino_uno', 'stm32_f401re').
             port: Optional serial port (e.g., 'COM3'). If provided, PlatformIO might use it,
                   though PlatformIO usually auto-detects based on board config.
+            project_id: Build directory to use (see PlatformIOBuilder.build_and_flash).
+            cancel_token: Passed through so the build scheduler can kill pio.
         
         Yields:
-            Log lines from the build and flash process.
+            Log chunks from the build and flash process.
         """
         # Note: PlatformIO usually handles port selection automatically if only one board of that type is connected.
         # If we need to force a port, we might need to pass upload_port to platformio.ini or command line.
         # For now, we rely on PlatformIO's auto-detection or the config in board_definitions.json.
         
-        # We could inject 'upload_port = {port}' into platformio.ini if port is provided,
-        # but PlatformIOBuilder._init_platformio_project would need to support that.
-        # Given the current implementation, we just delegate to build_and_flash_stream.
-        
         yield f"Initializing universal flash for board: {board_type}\n"
         
-        for line in self.builder.build_and_flash_stream(firmware_code, board_type, flash=True):
-            yield line
+        async for chunk in self.builder.abuild_and_flash_stream(firmware_code, board_type, flash=True,
+                                                                project_id=project_id, cancel_token=cancel_token):
+            yield chunk